@@ -0,0 +1,248 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import uuid
+
+from sqlalchemy import text
+
+from llm_client import get_llm_client, LLMError
+
+
+# AI advisor jobs.
+# Submitting a prompt records a job and returns at once; a small thread pool
+# calls Gemini in the background and stores the result, which clients poll for.
+# Jobs live in the database, so a poll can land on any gunicorn worker.
+# Generated advice is cached under a hash of the prompt, so an unchanged
+# financial snapshot is answered without a second generation.
+# Streaming mode forwards Gemini's output to the browser over Server-Sent Events.
+
+class AdvisorError(Exception):
+    """The LLM call failed or returned no usable text."""
+
+
+def gemini_settings():
+    """
+    Gemini endpoint settings from the environment. GEMINI_API_BASE can point at
+    a local stub server for tests and offline development.
+    """
+    return {
+        "api_key": os.getenv("GEMINI_API_KEY"),
+        "api_base": os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/"),
+        "model": os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
+    }
+
+
+def gemini_payload(prompt):
+    """Request body for a single-turn generation of 'prompt'."""
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": 0.7,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": 2048,
+        }
+    }
+
+
+def generate_advice(prompt):
+    """Calls Gemini synchronously and returns the generated Markdown. Raises AdvisorError."""
+    settings = gemini_settings()
+    api_url = f"{settings['api_base']}/models/{settings['model']}:generateContent?key={settings['api_key']}"
+    try:
+        result = get_llm_client().post_json(api_url, gemini_payload(prompt))
+    except LLMError as e:
+        raise AdvisorError(f"Failed to get AI advice: {e}")
+
+    if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
+        return result['candidates'][0]['content']['parts'][0]['text']
+    raise AdvisorError("AI did not generate a valid response.")
+
+
+def stream_advice(prompt):
+    """
+    Calls Gemini's streaming endpoint (Server-Sent Events) and yields the
+    Markdown text chunks as they arrive. Raises AdvisorError.
+    """
+    settings = gemini_settings()
+    api_url = f"{settings['api_base']}/models/{settings['model']}:streamGenerateContent?alt=sse&key={settings['api_key']}"
+    produced = False
+    try:
+        for line in get_llm_client().stream_lines(api_url, gemini_payload(prompt)):
+            # Each event is a 'data: {...}' line holding one GenerateContentResponse
+            if not line or not line.startswith("data:"):
+                continue
+            result = json.loads(line[len("data:"):])
+            for candidate in result.get('candidates') or []:
+                for part in (candidate.get('content') or {}).get('parts') or []:
+                    if part.get('text'):
+                        produced = True
+                        yield part['text']
+    except (LLMError, ValueError) as e:
+        raise AdvisorError(f"Failed to get AI advice: {e}")
+    if not produced:
+        raise AdvisorError("AI did not generate a valid response.")
+
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def prompt_hash(prompt):
+    """Cache key of a prompt; includes the model so switching models doesn't reuse old advice."""
+    return hashlib.sha256(f"{gemini_settings()['model']}\n{prompt}".encode()).hexdigest()
+
+
+class AdvisorJobs:
+    """
+    Runs advisor generations on a background thread pool.
+    'app' is needed to give worker threads an application context for the database.
+    """
+
+    def __init__(self, app, db_instance, workers=4, cache_ttl_hours=24, job_timeout=300):
+        self.app = app
+        self.db = db_instance
+        self.cache_ttl_hours = cache_ttl_hours
+        self.job_timeout = job_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="advisor")
+
+    def cached_advice(self, key):
+        """Returns cached advice for a prompt hash if it is younger than the cache TTL."""
+        row = self.db.session.execute(text("""
+            SELECT advice FROM advisor_cache
+            WHERE prompt_hash = :prompt_hash AND created_at > NOW() - make_interval(hours => :ttl_hours)
+        """), {"prompt_hash": key, "ttl_hours": self.cache_ttl_hours}).fetchone()
+        return row[0] if row else None
+
+    def submit(self, user_id, prompt):
+        """
+        Creates a job for 'prompt' and returns it as a dict (see get()).
+        A cache hit gives a job that is already done; an identical job still in
+        flight for this user is returned instead of starting another one.
+        """
+        key = prompt_hash(prompt)
+        advice = self.cached_advice(key)
+        if advice is None:
+            in_flight = self.db.session.execute(text("""
+                SELECT id FROM advisor_jobs
+                WHERE user_id = :user_id AND prompt_hash = :prompt_hash AND status IN ('queued', 'running')
+                  AND created_at > NOW() - make_interval(secs => :job_timeout)
+                ORDER BY created_at DESC LIMIT 1
+            """), {"user_id": int(user_id), "prompt_hash": key, "job_timeout": self.job_timeout}).fetchone()
+            if in_flight:
+                self.db.session.rollback()
+                return self.get(in_flight[0], user_id)
+
+        job_id = uuid.uuid4().hex
+        self.db.session.execute(text("""
+            INSERT INTO advisor_jobs (id, user_id, prompt_hash, status, advice, finished_at)
+            VALUES (:id, :user_id, :prompt_hash, :status, :advice, CASE WHEN :status = 'done' THEN NOW() END)
+        """), {"id": job_id, "user_id": int(user_id), "prompt_hash": key,
+               "status": "done" if advice is not None else "queued", "advice": advice})
+        self.db.session.commit()
+
+        if advice is None:
+            self.executor.submit(self._run, job_id, key, prompt)
+        return self.get(job_id, user_id)
+
+    def get(self, job_id, user_id):
+        """
+        Returns {'id', 'status', 'advice', 'error'} for a job owned by 'user_id', or None.
+        status is 'queued', 'running', 'done' or 'failed'. Jobs stuck past the
+        job timeout (e.g. their worker process died) are reported as failed.
+        """
+        row = self.db.session.execute(text("""
+            SELECT id, status, advice, error,
+                   status IN ('queued', 'running') AND created_at < NOW() - make_interval(secs => :job_timeout) AS expired
+            FROM advisor_jobs
+            WHERE id = :id AND user_id = :user_id
+        """), {"id": job_id, "user_id": int(user_id), "job_timeout": self.job_timeout}).mappings().fetchone()
+        if row is None:
+            return None
+        job = {"id": row["id"], "status": row["status"], "advice": row["advice"], "error": row["error"]}
+        if row["expired"]:
+            job.update(status="failed", error="The advisor took too long to answer. Please try again.")
+        return job
+
+    def cache_advice(self, key, advice):
+        """Stores generated advice under its prompt hash and commits."""
+        self.db.session.execute(text("""
+            INSERT INTO advisor_cache (prompt_hash, advice, created_at) VALUES (:prompt_hash, :advice, NOW())
+            ON CONFLICT (prompt_hash) DO UPDATE SET advice = EXCLUDED.advice, created_at = EXCLUDED.created_at
+        """), {"prompt_hash": key, "advice": advice})
+        self.db.session.commit()
+
+    def stream(self, prompt):
+        """
+        Generator of SSE events for 'prompt': 'chunk' events carrying {'text'} as
+        Gemini produces it, then 'done', or 'error' with {'error'}. A cached answer
+        is sent as a single chunk; a completed stream is added to the cache.
+        """
+        key = prompt_hash(prompt)
+        advice = self.cached_advice(key)
+        # Release the connection: the stream may stay open for a long time
+        self.db.session.rollback()
+        if advice is not None:
+            yield sse_event("chunk", {"text": advice})
+            yield sse_event("done", {"cached": True})
+            return
+
+        chunks = []
+        try:
+            for chunk in stream_advice(prompt):
+                chunks.append(chunk)
+                yield sse_event("chunk", {"text": chunk})
+        except AdvisorError as e:
+            yield sse_event("error", {"error": str(e)})
+            return
+
+        try:
+            self.cache_advice(key, "".join(chunks))
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"Warning: could not cache streamed advice: {e}")
+        yield sse_event("done", {"cached": False})
+
+    def _set_status(self, job_id, status, advice=None, error=None):
+        self.db.session.execute(text("""
+            UPDATE advisor_jobs
+            SET status = :status, advice = :advice, error = :error,
+                finished_at = CASE WHEN :status IN ('done', 'failed') THEN NOW() END
+            WHERE id = :id
+        """), {"id": job_id, "status": status, "advice": advice, "error": error})
+        self.db.session.commit()
+
+    def _run(self, job_id, key, prompt):
+        """Worker thread body: generates the advice, caches it and completes the job."""
+        with self.app.app_context():
+            try:
+                self._set_status(job_id, "running")
+                advice = generate_advice(prompt)
+                self.cache_advice(key, advice)
+                self._set_status(job_id, "done", advice=advice)
+            except AdvisorError as e:
+                self.db.session.rollback()
+                self._set_status(job_id, "failed", error=str(e))
+            except Exception as e:
+                self.db.session.rollback()
+                print(f"Warning: advisor job {job_id} failed: {e}")
+                try:
+                    self._set_status(job_id, "failed", error="An unexpected error occurred.")
+                except Exception:
+                    self.db.session.rollback()
+
+
+def create_advisor_jobs(app, db_instance):
+    """
+    Builds the advisor job runner from the environment:
+    ADVISOR_WORKERS (threads per process), ADVISOR_CACHE_TTL_HOURS and
+    ADVISOR_JOB_TIMEOUT (seconds before an unfinished job counts as failed).
+    """
+    return AdvisorJobs(
+        app, db_instance,
+        workers=int(os.getenv("ADVISOR_WORKERS", 4)),
+        cache_ttl_hours=int(os.getenv("ADVISOR_CACHE_TTL_HOURS", 24)),
+        job_timeout=int(os.getenv("ADVISOR_JOB_TIMEOUT", 300)),
+    )
@@ -0,0 +1,360 @@
+from datetime import datetime
+import hashlib  # Import hashlib for creating alert hashes
+import json
+
+from sqlalchemy import text
+
+from helpers import execute_query_helper
+from etags import get_data_version
+
+
+# Incremental financial alert engine.
+# Each rule family declares the ledger tables it depends on and how often its
+# output goes stale on its own ('day', 'month' or None). Evaluated alerts are
+# stored per user and rule in user_alert_state; a write to a table only clears
+# the rules that depend on it (see invalidate_alert_rules), so polling
+# /api/financial_alerts_data is normally a read of already materialised alerts.
+# Stored alerts carry the user's data version (etags.py) they were computed at;
+# they are only stored if no write committed while they were being evaluated.
+
+def _make_alert(alert_type, message, icon, alert_hash_base):
+    return {
+        "type": alert_type,
+        "message": message,
+        "icon": icon,
+        "alert_hash": hashlib.md5(alert_hash_base.encode()).hexdigest(),
+        "is_read": False
+    }
+
+
+# 1. Overbudget Alerts
+def _budget_alerts(metrics, today):
+    alerts = []
+    for category, data in metrics["budget_vs_actual"].items():
+        message = None
+        if data['remaining'] < 0:
+            message = f"Heads up! You're **${abs(data['remaining']):.2f} over budget** for **{category}** this month. Time to adjust?"
+            alert_type = "warning"
+            icon = "fas fa-exclamation-triangle"
+        elif data['budgeted'] > 0 and data['remaining'] == data['budgeted'] and data['spent'] == 0: # Only if nothing spent
+            message = f"Great start! You've budgeted **${data['budgeted']:.2f}** for **{category}** and haven't spent anything yet."
+            alert_type = "info"
+            icon = "fas fa-check-circle"
+
+        if message:
+            alerts.append(_make_alert(alert_type, message, icon, f"budget_alert_{category}_{today.strftime('%Y-%m')}"))
+    return alerts
+
+
+# 2. Debt Due Soon Alerts
+def _debt_due_alerts(metrics, today):
+    alerts = []
+    for debt in metrics["debt_items"]:
+        message = None
+        alert_type = None
+        icon = None
+        if debt['due_date']: # Ensure due_date exists
+            try:
+                # due_date may come back as a string or as a date/datetime object
+                if isinstance(debt['due_date'], str):
+                    due_date_dt = datetime.strptime(debt['due_date'], '%Y-%m-%d')
+                else: # Assume it's already a datetime object
+                    due_date_dt = debt['due_date']
+
+                time_diff = due_date_dt - today
+                diff_days = time_diff.days
+
+                if diff_days >= 0 and diff_days <= 7:
+                    message = f"Action Required: Your **{debt['debt_name']}** payment of **${debt['current_balance']:.2f}** is due in **{diff_days} day(s)**! Don't miss it!"
+                    alert_type = "danger"
+                    icon = "fas fa-calendar-times"
+                elif diff_days < 0 and abs(diff_days) < 30:
+                    message = f"Urgent: Your **{debt['debt_name']}** payment was due **{abs(diff_days)} day(s) ago**. Please address this promptly!"
+                    alert_type = "danger"
+                    icon = "fas fa-bell"
+            except (ValueError, TypeError) as e:
+                print(f"Warning: Could not parse or process debt due date for debt ID {debt.get('id', 'N/A')}: {debt['due_date']} - Error: {e}")
+
+        if message:
+            alerts.append(_make_alert(alert_type, message, icon, f"debt_alert_{debt['id']}_{due_date_dt.strftime('%Y-%m-%d')}"))
+    return alerts
+
+
+# 3. Savings Goal Progress Alerts
+def _savings_alerts(metrics, today):
+    alerts = []
+    for goal in metrics["savings_goals"]:
+        message = None
+        alert_type = None
+        icon = None
+        savings_tier = "initial"
+
+        # Check if target_amount is valid and positive before comparison
+        if goal['target_amount'] is None or goal['target_amount'] <= 0:
+            savings_tier = "no_target"
+        elif goal['current_amount'] >= goal['target_amount']:
+            savings_tier = "smashed"
+        elif goal['progress_percentage'] >= 75:
+            savings_tier = "75_percent"
+        elif goal['progress_percentage'] >= 25:
+            savings_tier = "25_percent"
+        elif goal['current_amount'] > 0 and goal['progress_percentage'] < 25:
+            savings_tier = "initial_progress"
+
+        if savings_tier == "smashed":
+            message = f"Fantastic! You've **smashed your {goal['goal']} goal**! Consider setting a new one!"
+            alert_type = "success"
+            icon = "fas fa-trophy"
+        elif savings_tier == "75_percent":
+            message = f"Almost there! Your **{goal['goal']} goal is {goal['progress_percentage']:.0f}% complete**. Keep pushing!"
+            alert_type = "info"
+            icon = "fas fa-star"
+        elif savings_tier == "25_percent":
+            message = f"Good progress on **{goal['goal']}!** You're at **{goal['progress_percentage']:.0f}%** of your target."
+            alert_type = "info"
+            icon = "fas fa-piggy-bank"
+        elif savings_tier == "initial_progress":
+            message = f"Great start on your **{goal['goal']} goal**! You've already saved **${goal['current_amount']:.2f}**. Keep going!"
+            alert_type = "info"
+            icon = "fas fa-seedling"
+        elif savings_tier == "no_target":
+            message = f"Your savings goal '{goal['goal']}' doesn't have a target amount. Set one to track your progress!"
+            alert_type = "info"
+            icon = "fas fa-clipboard-list"
+
+        if message:
+            alerts.append(_make_alert(alert_type, message, icon, f"savings_alert_{goal['id']}_{savings_tier}"))
+    return alerts
+
+
+# 4. Cash Flow Health Alerts
+def _cash_flow_alerts(metrics, today):
+    cash_flow_tier = "healthy"
+    if metrics["cash_flow"] < 0:
+        cash_flow_tier = "negative"
+    elif metrics["cash_flow"] >= 0 and metrics["cash_flow"] < 100:
+        cash_flow_tier = "tight"
+
+    if cash_flow_tier == "negative":
+        message = f"Warning! Your **net cash flow is negative (${abs(metrics['cash_flow']):.2f})**. Let's find ways to boost income or cut expenses."
+        alert_type = "danger"
+        icon = "fas fa-chart-line"
+    elif cash_flow_tier == "tight":
+        message = f"Your cash flow is a bit tight (**${metrics['cash_flow']:.2f}**). Small changes can make a big difference!"
+        alert_type = "warning"
+        icon = "fas fa-chart-bar"
+    else:
+        message = f"Excellent cash flow! You're adding **${metrics['cash_flow']:.2f}** to your financial cushion. Keep it up!"
+        alert_type = "success"
+        icon = "fas fa-dollar-sign"
+
+    return [_make_alert(alert_type, message, icon, f"cash_flow_alert_{cash_flow_tier}_{today.strftime('%Y-%m')}")]
+
+
+# 5. Emergency Fund Status Alerts
+def _emergency_fund_alerts(metrics, today):
+    emergency_fund_target = metrics["average_monthly_expenses"] * 3
+    emergency_fund_tier = "low" # Default if below 50%
+    total_current_savings_for_ef = sum(g['current_amount'] for g in metrics["savings_goals"]) if metrics["savings_goals"] else 0.0
+
+    if metrics["average_monthly_expenses"] > 0:
+        if total_current_savings_for_ef >= emergency_fund_target:
+            emergency_fund_tier = "strong"
+        elif total_current_savings_for_ef >= emergency_fund_target * 0.5:
+            emergency_fund_tier = "growing"
+    else:
+        emergency_fund_tier = "no_expense_data"
+
+    if emergency_fund_tier == "strong":
+        message = f"Your **emergency fund is strong**! You have at least 3 months of expenses covered. Financial security unlocked!"
+        alert_type = "success"
+        icon = "fas fa-shield-alt"
+    elif emergency_fund_tier == "growing":
+        # Ensure division by zero is handled if emergency_fund_target is 0
+        progress_percent = (total_current_savings_for_ef / emergency_fund_target * 100) if emergency_fund_target > 0 else 0
+        message = f"Your **emergency fund is growing**! You're at {round(progress_percent, 0):.0f}% of your 3-month target. Keep saving!"
+        alert_type = "warning"
+        icon = "fas fa-hand-holding-usd"
+    elif emergency_fund_tier == "low":
+        message = f"Focus on your **emergency fund**. It's currently below 50% of your 3-month target (${emergency_fund_target:.2f})."
+        alert_type = "danger"
+        icon = "fas fa-fire"
+    else:
+        message = "To assess your emergency fund, please record some expenses first. Then we can calculate your target!"
+        alert_type = "info"
+        icon = "fas fa-clipboard"
+
+    return [_make_alert(alert_type, message, icon, f"emergency_fund_alert_{emergency_fund_tier}")]
+
+
+# 6. High Debt Alert
+HIGH_DEBT_THRESHOLD_WARNING = 5000 # Example
+HIGH_DEBT_THRESHOLD_DANGER = 15000 # Example
+
+
+def _high_debt_alerts(metrics, today):
+    debt_tier = "low_or_none"
+    if metrics["total_liabilities"] > HIGH_DEBT_THRESHOLD_DANGER:
+        debt_tier = "critical"
+    elif metrics["total_liabilities"] > HIGH_DEBT_THRESHOLD_WARNING:
+        debt_tier = "warning"
+    elif metrics["total_liabilities"] == 0 and metrics["all_total_income"] > 0:
+        debt_tier = "debt_free"
+
+    if debt_tier == "critical":
+        message = f"Critical Debt Alert! Your total liabilities are **${metrics['total_liabilities']:.2f}**. Let's strategize a robust repayment plan!"
+        alert_type = "danger"
+        icon = "fas fa-hand-holding-dollar"
+    elif debt_tier == "warning":
+        message = f"Your total debt is **${metrics['total_liabilities']:.2f}**. It's manageable, but keeping an eye on it is key!"
+        alert_type = "warning"
+        icon = "fas fa-chart-pie"
+    elif debt_tier == "debt_free":
+        message = "Congratulations! You are **debt-free**! That's a huge financial win!"
+        alert_type = "success"
+        icon = "fas fa-check-double"
+    else:
+        return []
+
+    return [_make_alert(alert_type, message, icon, f"debt_status_alert_{debt_tier}")]
+
+
+# General financial health summary, shown whenever some financial data has been processed
+def _health_summary_alerts(metrics, today):
+    if metrics["financial_health_score"] <= 0:
+        return []
+    message = f"Your overall financial health score is **{metrics['financial_health_score']}/100**. Click 'View Savings & Financial Health Overview' for details!"
+    return [_make_alert("info", message, "fas fa-heartbeat", "financial_health_summary_alert_general_info")]
+
+
+ALL_LEDGER_TABLES = frozenset({"income", "expenses", "budget", "savings", "debt"})
+
+# Rule families: what they evaluate, which tables they read, and when they expire on their own
+ALERT_RULES = {
+    "budget": {"evaluate": _budget_alerts, "depends_on": {"budget", "expenses"}, "refresh": "month"},
+    "debt_due": {"evaluate": _debt_due_alerts, "depends_on": {"debt"}, "refresh": "day"},
+    "savings": {"evaluate": _savings_alerts, "depends_on": {"savings"}, "refresh": None},
+    "cash_flow": {"evaluate": _cash_flow_alerts, "depends_on": {"income", "expenses"}, "refresh": "month"},
+    "emergency_fund": {"evaluate": _emergency_fund_alerts, "depends_on": {"savings", "expenses"}, "refresh": None},
+    "high_debt": {"evaluate": _high_debt_alerts, "depends_on": {"debt", "income"}, "refresh": None},
+    "health_summary": {"evaluate": _health_summary_alerts, "depends_on": ALL_LEDGER_TABLES, "refresh": None},
+}
+
+NO_ALERTS_MESSAGE = "You have no alerts for now."
+
+
+def rules_affected_by(tables):
+    """Names of the rule families that read any of 'tables'."""
+    tables = set(tables)
+    return [name for name, rule in ALERT_RULES.items() if rule["depends_on"] & tables]
+
+
+def invalidate_alert_rules(session, user_id, tables):
+    """
+    Drops the stored alerts of every rule that depends on 'tables' so they are
+    re-evaluated on the next read. Runs inside the writing transaction.
+    """
+    rules = rules_affected_by(tables)
+    if not rules:
+        return
+    session.execute(text("""
+        DELETE FROM user_alert_state WHERE user_id = :user_id AND rule = ANY(:rules)
+    """), {"user_id": user_id, "rules": rules})
+
+
+def _is_stale(rule, computed_on, today):
+    if computed_on is None:
+        return True
+    if rule["refresh"] == "day":
+        return computed_on != today.date()
+    if rule["refresh"] == "month":
+        return (computed_on.year, computed_on.month) != (today.year, today.month)
+    return False
+
+
+# Locks the user's data version row until the upsert commits and returns the version.
+# A writer bumps the version before clearing alert state (see app.py), so either it
+# waits for us and then clears what we stored, or we wait for it and see the new version.
+LOCK_DATA_VERSION_SQL = """
+    INSERT INTO user_data_version (user_id, version) VALUES (:user_id, 0)
+    ON CONFLICT (user_id) DO UPDATE SET version = user_data_version.version
+    RETURNING version
+"""
+
+
+def get_financial_alerts(db_instance, user_id, load_metrics):
+    """
+    Returns the user's active (non-dismissed) alerts, sorted by severity.
+    Only rules with no stored state, or whose state expired, are re-evaluated;
+    load_metrics() is called at most once, and only if something needs it.
+    It must read the ledger as of now, not a cached snapshot: what it returns is
+    stored until the next write or expiry.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    data_version = get_data_version(db_instance, user_id)
+    state_rows = execute_query_helper(db_instance, """
+        SELECT rule, alerts, computed_on FROM user_alert_state WHERE user_id = :user_id
+    """, {"user_id": user_id})
+    stored = {row['rule']: row for row in state_rows}
+
+    alerts_by_rule = {}
+    stale_rules = []
+    for name, rule in ALERT_RULES.items():
+        row = stored.get(name)
+        if row is None or _is_stale(rule, row['computed_on'], today):
+            stale_rules.append(name)
+        else:
+            alerts_by_rule[name] = json.loads(row['alerts'])
+
+    if stale_rules:
+        metrics = load_metrics()
+        upserts = []
+        for name in stale_rules:
+            alerts_by_rule[name] = ALERT_RULES[name]["evaluate"](metrics, today)
+            upserts.append({
+                "user_id": user_id,
+                "rule": name,
+                "alerts": json.dumps(alerts_by_rule[name]),
+                "computed_on": today.date(),
+                "data_version": data_version,
+            })
+        try:
+            current_version = db_instance.session.execute(text(LOCK_DATA_VERSION_SQL), {"user_id": user_id}).scalar()
+            if current_version == data_version:
+                db_instance.session.execute(text("""
+                    INSERT INTO user_alert_state (user_id, rule, alerts, computed_on, data_version)
+                    VALUES (:user_id, :rule, :alerts, :computed_on, :data_version)
+                    ON CONFLICT (user_id, rule) DO UPDATE
+                    SET alerts = EXCLUDED.alerts, computed_on = EXCLUDED.computed_on,
+                        data_version = EXCLUDED.data_version
+                """), upserts)
+            # Otherwise a write landed meanwhile and may have cleared these rules: leave
+            # them for the next read rather than store alerts that predate it
+            db_instance.session.commit()
+        except Exception as e:
+            # Materialising is an optimisation; the freshly evaluated alerts are still returned
+            db_instance.session.rollback()
+            print(f"Warning: could not store alert state for user {user_id}: {e}")
+
+    dismissed_alerts_hashes = {
+        row['alert_hash'] for row in execute_query_helper(db_instance,
+            "SELECT alert_hash FROM read_user_alerts WHERE user_id = :user_id", {"user_id": user_id})
+    }
+
+    generated_alerts = [
+        alert
+        for name in ALERT_RULES
+        for alert in alerts_by_rule[name]
+        if alert["alert_hash"] not in dismissed_alerts_hashes
+    ]
+
+    # Sort alerts (e.g., critical first, then warnings, then info/success)
+    type_order = {"danger": 1, "warning": 2, "info": 3, "success": 4}
+    generated_alerts.sort(key=lambda x: type_order.get(x["type"], 99))
+
+    # Only show the "no alerts for now" message if truly nothing else is relevant
+    if not generated_alerts:
+        generated_alerts.append(_make_alert("info", NO_ALERTS_MESSAGE, "fas fa-check-circle", "no_alerts_message"))
+
+    return generated_alerts
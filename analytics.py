@@ -0,0 +1,229 @@
+from datetime import date
+from operator import itemgetter
+
+import numpy as np
+from sqlalchemy import text
+
+
+# Columnar view of a user's ledger for the financial metrics.
+# monthly_rollup rows (one per month, kind and label; see ledger.py) are loaded
+# once into NumPy arrays (month ordinal, kind code, label code, total) and the
+# totals, month counts, budget variance and per-month series are computed with
+# vectorised operations instead of Python loops over Decimal values.
+
+KINDS = ("income", "expense", "budget")
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+
+def month_ordinal(day):
+    """Months since year 0 (2024-01 -> 24288), so consecutive months differ by 1."""
+    return day.year * 12 + day.month - 1
+
+
+def ordinal_to_month(ordinal):
+    return date(int(ordinal) // 12, int(ordinal) % 12 + 1, 1)
+
+
+class LedgerFrame:
+    """One user's monthly ledger totals as parallel arrays, one element per (month, kind, label)."""
+
+    def __init__(self, months, kinds, labels, totals, label_names):
+        self.months = months            # int32 month ordinals
+        self.kinds = kinds              # int8 codes into KINDS
+        self.labels = labels            # int32 codes into label_names
+        self.totals = totals            # float64 amounts
+        self.label_names = label_names  # category/source per label code
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds the frame from (month ordinal, kind, label, total) rows."""
+        if not rows:
+            return cls(np.zeros(0, np.int32), np.zeros(0, np.int8), np.zeros(0, np.int32), np.zeros(0), [])
+        count = len(rows)
+        column = lambda index: map(itemgetter(index), rows)
+        # Codes in first-seen order; map() keeps the per-row work in C
+        label_names = list(dict.fromkeys(column(2)))
+        label_codes = {label: code for code, label in enumerate(label_names)}
+        return cls(
+            np.fromiter(column(0), dtype=np.int32, count=count),
+            np.fromiter(map(KIND_CODES.__getitem__, column(1)), dtype=np.int8, count=count),
+            np.fromiter(map(label_codes.__getitem__, column(2)), dtype=np.int32, count=count),
+            np.fromiter(column(3), dtype=np.float64, count=count),
+            label_names,
+        )
+
+    def __len__(self):
+        return self.totals.size
+
+    def _mask(self, kind, month=None):
+        mask = self.kinds == KIND_CODES[kind]
+        if month is not None:
+            mask &= self.months == month_ordinal(month)
+        return mask
+
+    def total(self, kind):
+        return float(self.totals[self._mask(kind)].sum())
+
+    def distinct_months(self, kind):
+        months = self.months[self._mask(kind)]
+        if not months.size:
+            return 0
+        return int(np.count_nonzero(np.bincount(months - months.min())))
+
+    def monthly_average(self, kind):
+        """Total over the months that have entries of this kind (0.0 when there are none)."""
+        months = self.distinct_months(kind)
+        return self.total(kind) / months if months else 0.0
+
+    def by_label(self, kind, month=None):
+        """{label: total} for one kind, optionally restricted to one month."""
+        mask = self._mask(kind, month)
+        codes = self.labels[mask]
+        if not codes.size:
+            return {}
+        sums = np.bincount(codes, weights=self.totals[mask], minlength=len(self.label_names))
+        present = np.bincount(codes, minlength=len(self.label_names)) > 0
+        return {self.label_names[code]: float(sums[code]) for code in np.flatnonzero(present)}
+
+    def monthly_series(self, kind, first_month, last_month, label=None):
+        """Dense per-month totals from first_month to last_month inclusive (months without entries are 0)."""
+        start, end = month_ordinal(first_month), month_ordinal(last_month)
+        mask = self._mask(kind) & (self.months >= start) & (self.months <= end)
+        if label is not None:
+            if label not in self.label_names:
+                return np.zeros(end - start + 1)
+            mask &= self.labels == self.label_names.index(label)
+        return np.bincount(self.months[mask] - start, weights=self.totals[mask], minlength=end - start + 1)
+
+    def budget_vs_actual(self, month):
+        """{category: {budgeted, spent, remaining}} for every category budgeted or spent in 'month'."""
+        budgeted = self.by_label("budget", month)
+        spent = self.by_label("expense", month)
+        return {
+            category: {
+                "budgeted": budgeted.get(category, 0.0),
+                "spent": spent.get(category, 0.0),
+                "remaining": budgeted.get(category, 0.0) - spent.get(category, 0.0),
+            }
+            for category in {**budgeted, **spent}
+        }
+
+
+def load_ledger_frame(db_instance, user_id):
+    """Reads the user's monthly_rollup into a LedgerFrame in one query."""
+    # Totals come back as floats, not Decimal, so they go straight into the float64 array,
+    # and months as ordinals (see month_ordinal), so no per-row conversion happens in Python
+    rows = db_instance.session.execute(text("""
+        SELECT CAST(EXTRACT(YEAR FROM month) * 12 + EXTRACT(MONTH FROM month) - 1 AS INTEGER) AS month,
+               kind, label, CAST(total AS DOUBLE PRECISION) AS total
+        FROM monthly_rollup
+        WHERE user_id = :user_id AND entry_count > 0
+    """), {"user_id": user_id}).fetchall()
+    return LedgerFrame.from_rows(rows)
+
+
+def savings_progress(amounts, targets):
+    """Progress towards each savings target in percent (capped at 100, 0 without a target)."""
+    amounts = np.asarray(amounts, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        progress = np.where(targets > 0, np.minimum(amounts / targets * 100, 100), 0.0)
+    return np.round(progress, 2)
+
+
+# --- Trends and forecasts (see spending_trends) ---
+
+# Windows of the rolling averages, in months
+ROLLING_WINDOWS = (3, 6, 12)
+# Months of history the trends look back over (forecasts use all of them)
+TREND_HISTORY_MONTHS = 24
+# Longest history /api/trends accepts
+MAX_TREND_HISTORY_MONTHS = 120
+# Weight of the latest month in the exponential smoothing forecast (0-1)
+SMOOTHING_ALPHA = 0.5
+
+
+def _percent_change(current, previous):
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+
+def _series_trends(matrix, active_months):
+    """
+    Rolling averages, last month-over-month change and next-month forecast for
+    each row of 'matrix' (one row per series, one column per month, oldest first).
+    Only the last 'active_months' columns count, so users with a short history
+    are not averaged over months before they started recording.
+    """
+    active = matrix[:, -active_months:]
+    rolling = {
+        window: active[:, -window:].sum(axis=1) / min(window, active_months)
+        for window in ROLLING_WINDOWS
+    }
+    # Simple exponential smoothing, vectorised across series
+    level = active[:, 0].copy()
+    for column in range(1, active.shape[1]):
+        level = SMOOTHING_ALPHA * active[:, column] + (1 - SMOOTHING_ALPHA) * level
+    current = active[:, -1]
+    previous = active[:, -2] if active_months > 1 else np.zeros(len(active))
+    return [
+        {
+            "series": [round(float(value), 2) for value in matrix[row]],
+            "current": round(float(current[row]), 2),
+            "previous": round(float(previous[row]), 2),
+            "mom_delta": round(float(current[row] - previous[row]), 2),
+            "mom_delta_pct": _percent_change(float(current[row]), float(previous[row])),
+            "rolling_average": {str(window): round(float(values[row]), 2) for window, values in rolling.items()},
+            "forecast": round(float(level[row]), 2),
+        }
+        for row in range(len(matrix))
+    ]
+
+
+def spending_trends(frame, end_month, history_months=TREND_HISTORY_MONTHS):
+    """
+    Month-by-month income and spending up to 'end_month' (a date in the last month
+    to include): rolling 3/6/12-month averages, month-over-month deltas overall and
+    per expense category, and an exponential smoothing forecast of the next month.
+    Works on the monthly totals, so the cost does not grow with the number of entries.
+    """
+    end = month_ordinal(end_month)
+    start = end - history_months + 1
+    months = [ordinal_to_month(ordinal).strftime('%Y-%m') for ordinal in range(start, end + 1)]
+    in_window = (frame.months >= start) & (frame.months <= end)
+    # Months since the user's first entry (within the window), at least one
+    first = int(frame.months[in_window].min()) if in_window.any() else end
+    active_months = end - first + 1
+
+    totals = np.vstack([frame.monthly_series(kind, ordinal_to_month(start), end_month) for kind in ("income", "expense")])
+    income, expenses = _series_trends(totals, active_months)
+
+    # Category x month matrix of expenses in one bincount
+    mask = in_window & (frame.kinds == KIND_CODES["expense"])
+    codes, positions = np.unique(frame.labels[mask], return_inverse=True)
+    matrix = np.bincount(
+        positions * history_months + (frame.months[mask] - start),
+        weights=frame.totals[mask],
+        minlength=len(codes) * history_months,
+    ).reshape(len(codes), history_months)
+    categories = [
+        {"category": frame.label_names[code], **trend}
+        for code, trend in zip(codes, _series_trends(matrix, active_months))
+    ]
+    categories.sort(key=lambda item: item["forecast"], reverse=True)
+
+    next_month = ordinal_to_month(end + 1).strftime('%Y-%m')
+    return {
+        "months": months,
+        "end_month": months[-1],
+        "forecast_month": next_month,
+        "active_months": active_months,
+        "income": income,
+        "expenses": expenses,
+        "categories": categories,
+    }
+
+
+def last_complete_month(today=None):
+    """First day of the month before 'today' (the latest month with a full set of entries)."""
+    today = today or date.today()
+    return ordinal_to_month(month_ordinal(today) - 1)
@@ -1,22 +1,43 @@
 from dotenv import load_dotenv
 import calendar
 from datetime import datetime, timedelta, date
-from flask import Flask, render_template, session, request, redirect, url_for, flash, jsonify
-from flask_session import Session
-from flask_mail import Mail, Message
+from flask import Flask, render_template, session, request, redirect, url_for, flash, jsonify, Response, stream_with_context
+from flask_mail import Mail
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
-from helpers import apology, login_required, _get_all_financial_metrics, _generate_financial_alerts_list, execute_query_helper
-import json
+from helpers import apology, login_required, metrics_token_required, _get_all_financial_metrics, _get_dashboard_data, execute_query_helper
+from helpers import DATE_RANGE_SQL, month_range, date_range_params, period_filter
+from schema import ensure_schema, ensure_indexes, index_problems
+from ledger import insert_entry, update_entry, delete_entry, validate_entry, rebuild_monthly_rollup, monthly_rollup_is_empty
+from ledger import LEDGER_TABLES, on_ledger_commit, before_ledger_commit, register_ledger_events
+from alerts import get_financial_alerts, invalidate_alert_rules
+from metrics_cache import create_metrics_cache
+from rate_limit import create_rate_limiter
+from etags import etag_conditional, bump_data_version
+from pagination import list_ledger_rows, PAGING_ARGS
+from batch import apply_batch
+from sync import changes_since, purge_tombstones, DEFAULT_SYNC_PAGE_SIZE, MAX_SYNC_PAGE_SIZE
+from export import generate_export, EXPORT_FORMATS
+from importer import import_entries, detect_format, IMPORTABLE_TABLES, IMPORT_FORMATS
+from advisor import create_advisor_jobs, gemini_settings
+from session_store import configure_sessions
+from db_pool import engine_options_from_env, instrument_engine, pool_metrics
+from query_profiler import init_query_profiler
+from mail_outbox import create_mail_outbox
+from password_hashing import create_password_hasher, HashingBusy
+from analytics import load_ledger_frame, spending_trends, last_complete_month
+from analytics import ROLLING_WINDOWS, TREND_HISTORY_MONTHS, MAX_TREND_HISTORY_MONTHS
+from metrics import create_app_metrics
+from llm_client import get_llm_client
+import click
 import markdown
 import os
-import requests
 import traceback # Keep traceback for console logging
 
 # NEW IMPORTS FOR SQLALCHEMY
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text, func # text for raw SQL, func for SQL functions like SUM, strftime
-from werkzeug.security import check_password_hash, generate_password_hash
 
 # Load environment variables from .env file (if it exists)
 load_dotenv()
@@ -30,20 +51,233 @@ app = Flask(__name__)
 app.debug = True
 app.config["DEBUG"] = True
 
+# Behind a reverse proxy (e.g. the Heroku router) remote_addr is the proxy's address, so per-IP
+# rate limits would share one bucket. TRUSTED_PROXY_COUNT=N takes the client address from the
+# last N X-Forwarded-For hops; only set it when that many proxies really sit in front of the app.
+try:
+    trusted_proxy_count = int(os.getenv("TRUSTED_PROXY_COUNT") or 0)
+except ValueError:
+    print(f"Warning: ignoring TRUSTED_PROXY_COUNT={os.getenv('TRUSTED_PROXY_COUNT')!r}, expected a number")
+    trusted_proxy_count = 0
+if trusted_proxy_count > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxy_count, x_proto=trusted_proxy_count)
 
-# Configure session to use filesystem (instead of signed cookies)
+
+# Configure sessions: server-side files by default, or another store (see session_store.py)
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+configure_sessions(app)
 
 # Configure Database for PostgreSQL using Flask-SQLAlchemy
 # The DATABASE_URL will come from your .env file
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False # Suppresses a warning
+# Pool size, overflow, timeouts and recycling come from DB_POOL_* variables (see db_pool.py)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options_from_env()
 
 print(f"DEBUG: SQLALCHEMY_DATABASE_URI is: {os.getenv('DATABASE_URL')}")
 db = SQLAlchemy(app) # Initialize SQLAlchemy instance
 
+# Request, DB, cache, LLM and pool metrics for /metrics (see metrics.py)
+app_metrics = create_app_metrics()
+
+with app.app_context():
+    instrument_engine(db.engine)
+    app_metrics.init_app(app, db.engine)
+    # Opt-in SQL profiling per request (QUERY_PROFILER=true), None when disabled
+    query_profiler = init_query_profiler(app, db.engine)
+
+# Create the support tables the app relies on (idempotent). Indexes and the rollup
+# backfill can take minutes on large ledgers, so they run from the release step (see Procfile)
+with app.app_context():
+    try:
+        ensure_schema(db)
+        problems = index_problems(db)
+        if problems:
+            print(f"Warning: indexes {', '.join(f'{name} ({state})' for name, state in problems.items())} "
+                  f"need `flask ensure-indexes`")
+        # Building the rollup scans every ledger row, far too slow for a worker's boot timeout;
+        # the release step runs `flask rebuild-rollups --if-empty` instead (see Procfile)
+        if monthly_rollup_is_empty(db):
+            print("Warning: monthly_rollup is empty, dashboards read zero totals until `flask rebuild-rollups` runs")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Warning: could not apply schema updates: {e}")
+
+
+# --- Financial metrics cache ---
+# Snapshots of _get_all_financial_metrics per user, dropped whenever that user's ledger changes
+metrics_cache = create_metrics_cache()
+register_ledger_events(db)
+
+# --- Rate limiting ---
+# Token buckets per client for the auth, AI advisor and dashboard/polling routes (see rate_limit.py)
+rate_limiter = create_rate_limiter()
+
+
+@on_ledger_commit
+def invalidate_metrics_cache(user_id, tables):
+    """Drops the cached metrics of a user whose ledger just changed."""
+    metrics_cache.invalidate(user_id)
+
+
+@before_ledger_commit
+def bump_ledger_data_version(db_session, user_id, tables):
+    """Moves the user's API ETags on in the same transaction as the ledger write."""
+    bump_data_version(db_session, user_id)
+
+
+# Stored alerts of the rule families that read the written tables are dropped in the same
+# transaction. Registered after the version bump, which alerts.get_financial_alerts relies on.
+before_ledger_commit(invalidate_alert_rules)
+
+
+def get_financial_metrics(user_id):
+    """Returns _get_all_financial_metrics for a user, served from metrics_cache while fresh."""
+    return metrics_cache.get_or_compute(user_id, lambda: _get_all_financial_metrics(db, user_id))
+
+
+# --- AI advisor jobs ---
+# Gemini calls run on a background pool so they never hold a request worker
+advisor_jobs = create_advisor_jobs(app, db)
+
+
+# --- Prometheus metrics ---
+get_llm_client().add_observer(app_metrics.observe_llm_call)
+
+
+@app_metrics.add_collector
+def collect_runtime_metrics(registry):
+    """Copies the counters kept by the cache, LLM client and pool into the metrics registry."""
+    registry.set("cashcompass_metrics_cache_requests_total", (("result", "hit"),), metrics_cache.hits)
+    registry.set("cashcompass_metrics_cache_requests_total", (("result", "miss"),), metrics_cache.misses)
+
+    llm = get_llm_client().metrics()
+    for result, key in (("success", "successes"), ("failure", "failures"), ("retry", "retries"), ("rejected", "rejected")):
+        registry.set("cashcompass_llm_calls_total", (("result", result),), llm[key])
+    registry.set("cashcompass_llm_circuit_open", (), 0 if llm["circuit_state"] == "closed" else 1)
+
+    pool = pool_metrics.snapshot(db.engine.pool)
+    registry.set("cashcompass_db_pool_checkouts_total", (), pool["checkout_wait_ms"]["count"])
+    registry.set("cashcompass_db_pool_checkout_wait_seconds_total", (), pool["checkout_wait_ms"]["sum"] / 1000)
+    registry.set("cashcompass_db_pool_timeouts_total", (), pool["checkout_timeouts"])
+    if "checked_out" in pool:
+        registry.set("cashcompass_db_pool_checked_out", (), pool["checked_out"])
+        registry.set("cashcompass_db_pool_overflow", (), pool["overflow"])
+        registry.set("cashcompass_db_pool_size", (), pool["pool_size"])
+
+
+# --- Password hashing ---
+# check/generate run on a small process pool with a concurrency cap (see password_hashing.py)
+password_hasher = create_password_hasher()
+
+
+
+def observe_password_hash(operation, queue_seconds, hash_seconds):
+    app_metrics.registry.observe("cashcompass_password_hash_queue_seconds", (), queue_seconds)
+    app_metrics.registry.observe("cashcompass_password_hash_duration_seconds", (("operation", operation),), hash_seconds)
+
+
+password_hasher.add_observer(observe_password_hash)
+
+
+@app_metrics.add_collector
+def collect_password_hash_metrics(registry):
+    """Hash counters and the number of hashes in the pool for this process."""
+    counters = password_hasher.metrics()
+    for result in ("checks", "generates", "rehashes", "busy"):
+        registry.set("cashcompass_password_hashes_total", (("result", result),), counters[result])
+    registry.set("cashcompass_password_hash_in_flight", (), counters["in_flight"])
+
+
+@app_metrics.add_collector
+def collect_rate_limit_metrics(registry):
+    """Rate limiter decisions per route class and the time spent deciding."""
+    limiter = rate_limiter.metrics()
+    for (route_class, result), count in limiter["decisions"].items():
+        registry.set("cashcompass_rate_limit_decisions_total", (("class", route_class), ("result", result)), count)
+    registry.set("cashcompass_rate_limit_checks_total", (), limiter["checks"])
+    registry.set("cashcompass_rate_limit_check_seconds_total", (), limiter["check_seconds"])
+    registry.set("cashcompass_rate_limit_backend_errors_total", (), limiter["backend_errors"])
+
+
+def save_password_hash(user_id):
+    """save_hash callback for password_hasher.verify_and_upgrade: stores an upgraded hash."""
+    def save(new_hash):
+        try:
+            db.session.execute(text("UPDATE users SET password_hash = :password_hash WHERE id = :user_id"),
+                               {"password_hash": new_hash, "user_id": user_id})
+            db.session.commit()
+        except Exception:
+            # The login still succeeds; leave the session usable for the rest of the request
+            db.session.rollback()
+            raise
+    return save
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    """Every hashing slot stayed taken: ask the client to come back instead of queueing without limit."""
+    if request.path.startswith("/api/"):
+        response = app.make_response((jsonify({"msg": str(e)}), 503))
+    else:
+        response = app.make_response(apology(str(e), 503))
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@app.route("/metrics")
+@metrics_token_required
+def prometheus_metrics():
+    """All workers' request, DB, cache, LLM and pool metrics in Prometheus text format."""
+    return Response(app_metrics.exposition(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/metrics/db_pool")
+@metrics_token_required
+def db_pool_metrics():
+    """Connection pool gauges, checkout wait histogram and suspected leaks for this process."""
+    return jsonify({"pid": os.getpid(), **pool_metrics.snapshot(db.engine.pool)})
+
+
+@app.route("/debug/queries")
+@metrics_token_required
+def debug_queries():
+    """Recent request profiles from the query profiler: statement counts, DB time, slow and repeated statements."""
+    if query_profiler is None:
+        return jsonify({"error": "Query profiler is disabled. Set QUERY_PROFILER=true to enable it."}), 404
+    profiles = query_profiler.recent_profiles()
+    if request.args.get("format") == "json":
+        return jsonify(profiles)
+    return render_template("query_profiles.html", profiles=profiles,
+                           repeat_threshold=query_profiler.repeat_threshold)
+
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Build missing indexes and rebuild ones left invalid by an interrupted build (CONCURRENTLY)."""
+    failed = ensure_indexes(db)
+    if failed:
+        raise click.ClickException(f"could not build {', '.join(failed)}")
+    print("Indexes up to date.")
+
+
+@app.cli.command("rebuild-rollups")
+@click.option("--if-empty", is_flag=True, help="Only rebuild when monthly_rollup holds no rows yet (first deploy).")
+def rebuild_rollups_command(if_empty):
+    """Recompute monthly_rollup for every user from the raw ledger tables."""
+    if if_empty and not monthly_rollup_is_empty(db):
+        print("monthly_rollup already built, nothing to do.")
+        return
+    rebuild_monthly_rollup(db)
+    print("monthly_rollup rebuilt.")
+
+
+@app.cli.command("purge-sync-tombstones")
+def purge_sync_tombstones_command():
+    """Delete sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS (default 90)."""
+    purged = purge_tombstones(db, int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", 90)))
+    print(f"{purged} sync tombstones purged.")
+
 # Ensure SECRET_KEY is loaded from .env for Flask's session security
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "a_very_secret_key_if_not_set_in_env") # Provide a fallback for development
 
@@ -57,6 +291,22 @@ app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 
 mail = Mail(app)
+# Outgoing mail is queued in the database and sent by a background thread (see mail_outbox.py)
+mail_outbox = create_mail_outbox(app, db, mail)
+mail_outbox.add_observer(
+    lambda seconds, success: app_metrics.registry.observe(
+        "cashcompass_mail_send_duration_seconds", (("outcome", "success" if success else "failure"),), seconds)
+)
+
+
+@app_metrics.add_collector
+def collect_mail_metrics(registry):
+    """Outbox depth (shared by all workers) and this process's send counters."""
+    for status, count in mail_outbox.queue_depth().items():
+        registry.set("cashcompass_mail_outbox_messages", (("status", status),), count)
+    counters = mail_outbox.metrics()
+    for result in ("sent", "retried", "dead"):
+        registry.set("cashcompass_mail_send_results_total", (("result", result),), counters[result])
 
 # --- Token Serializer for Password Resets ---
 s = URLSafeTimedSerializer(app.config['SECRET_KEY'])
@@ -68,6 +318,9 @@ jwt = JWTManager(app)
 @app.after_request
 def after_request(response):
     """Ensure responses aren't cached"""
+    # Conditional API responses (see etags.py) may be stored but must be revalidated
+    if response.headers.get("ETag"):
+        return response
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Expires"] = 0
     response.headers["Pragma"] = "no-cache"
@@ -90,6 +343,7 @@ def date_format_filter(dt, fmt):
 
 @app.route("/")
 @login_required
+@rate_limiter.limit("read", identity="session")
 def dashboard():
     """Display user's financial dashboard"""
     user_id = session["user_id"]
@@ -111,177 +365,29 @@ def dashboard():
         available_months.append((month_val, month_label))
     available_months.reverse()
 
-    # 1. Fetch Total Income for selected month
-    income_items = execute_query_helper(db, """
-        SELECT amount
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-    total_income = sum(float(item['amount']) for item in income_items) if income_items else 0.0
-
-    # 2. Fetch Total Expenses for selected month
-    expenses_items = execute_query_helper(db, """
-        SELECT amount
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-    total_expenses = sum(float(item['amount']) for item in expenses_items) if expenses_items else 0.0
-
-    # 3. Fetch Total Budget for selected month
-    budget_items_monthly = execute_query_helper(db, """
-        SELECT amount
-        FROM budget
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-    total_budget = sum(float(item['amount']) for item in budget_items_monthly) if budget_items_monthly else 0.0
-
-    # 4. Fetch Total Savings for selected month (UPDATED: now filtered by month)
-    # Savings table doesn't have a date in your DDL, so this filtering might not make sense
-    # If savings are associated with a date of deposit, you'll need a 'date' column in your savings table.
-    # For now, I'm removing the month filter as per your DDL, if you add date column, you can put it back
-    savings_items = execute_query_helper(db, """
-        SELECT amount
-        FROM savings
-        WHERE user_id = :user_id
-    """, {"user_id": user_id})
-    total_savings = sum(float(item['amount']) for item in savings_items) if savings_items else 0.0
-
-    # 5. Calculate Net Balance for selected month
-    net_balance = total_income - total_expenses
-
-    # 6. Budget vs. Actual Spending per Category (Filtered by selected_month for *expenses*)
-    budget_vs_actual = {}
-
-    relevant_expense_categories = execute_query_helper(db, """
-        SELECT DISTINCT category
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    if not relevant_expense_categories:
-        budget_bar_labels = []
-        budgeted_data = []
-        spent_data = []
-    else:
-        for cat_entry in relevant_expense_categories:
-            category = cat_entry['category']
-
-            budgeted_amount_result = execute_query_helper(db, """
-                SELECT amount FROM budget
-                WHERE user_id = :user_id AND category = :category AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-            """, {"user_id": user_id, "category": category, "selected_month": selected_month}, fetch_one=True)
-            budgeted_amount = float(budgeted_amount_result['amount']) if budgeted_amount_result and budgeted_amount_result['amount'] is not None else 0.0
-
-            spent_amount_result = execute_query_helper(db, """
-                SELECT SUM(amount) AS spent FROM expenses
-                WHERE user_id = :user_id AND category = :category AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-            """, {"user_id": user_id, "category": category, "selected_month": selected_month}, fetch_one=True)
-            spent_amount = float(spent_amount_result['spent']) if spent_amount_result and spent_amount_result['spent'] is not None else 0.0
-
-            budget_vs_actual[category] = {
-                "budgeted": budgeted_amount,
-                "spent": spent_amount,
-                "remaining": budgeted_amount - spent_amount
-            }
-
-        budget_bar_labels = list(budget_vs_actual.keys())
-        budgeted_data = [d['budgeted'] for d in budget_vs_actual.values()]
-        spent_data = [d['spent'] for d in budget_vs_actual.values()]
-
-    # 7. Top Spending Categories (for Pie Chart) (Filtered by selected_month)
-    top_expenses_by_category = execute_query_helper(db, """
-        SELECT category, SUM(amount) AS total_spent
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY category
-        ORDER BY total_spent DESC
-        LIMIT 5
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    pie_chart_labels = [item['category'] for item in top_expenses_by_category]
-    pie_chart_data = [float(item['total_spent']) for item in top_expenses_by_category] # Ensure float
-
-    # 8. Daily Income vs. Expenses (for Line Chart) for the selected month
-    daily_income_raw = execute_query_helper(db, """
-        SELECT
-            TO_CHAR(date, 'YYYY-MM-DD') AS day,
-            SUM(amount) AS total_income
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY day
-        ORDER BY day
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    daily_expenses_raw = execute_query_helper(db, """
-        SELECT
-            TO_CHAR(date, 'YYYY-MM-DD') AS day,
-            SUM(amount) AS total_expenses
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY day
-        ORDER BY day
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    monthly_income_total_result = execute_query_helper(db, """
-        SELECT SUM(amount) AS total
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month}, fetch_one=True)
-    monthly_income_total = float(monthly_income_total_result['total']) if monthly_income_total_result and monthly_income_total_result['total'] is not None else 0.0
-
-    monthly_expenses_total_result = execute_query_helper(db, """
-        SELECT SUM(amount) AS total
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month}, fetch_one=True)
-    monthly_expenses_total = float(monthly_expenses_total_result['total']) if monthly_expenses_total_result and monthly_expenses_total_result['total'] is not None else 0.0
-
-    daily_data = {}
-    year, month = map(int, selected_month.split('-'))
-    num_days_in_month = calendar.monthrange(year, month)[1]
-    first_day_of_selected_month = datetime(year, month, 1)
-
-    for i in range(num_days_in_month):
-        current_day = first_day_of_selected_month + timedelta(days=i)
-        formatted_date = current_day.strftime('%Y-%m-%d')
-        daily_data[formatted_date] = {'income': 0.0, 'expenses': 0.0}
-
-    for row in daily_income_raw:
-        daily_data[row['day']]['income'] = float(row['total_income'])
-    for row in daily_expenses_raw:
-        daily_data[row['day']]['expenses'] = float(row['total_expenses'])
-
-    sorted_days = sorted(daily_data.keys())
-    line_chart_labels = []
-    line_chart_income_data = []
-    line_chart_expenses_data = []
-
-    for day in sorted_days:
-        line_chart_labels.append(datetime.strptime(
-            day, '%Y-%m-%d').strftime('%b %d'))
-        line_chart_income_data.append(daily_data[day]['income'])
-        line_chart_expenses_data.append(daily_data[day]['expenses'])
+    # Totals, budget vs. actual, pie and line chart data in one grouped query
+    dashboard_data = _get_dashboard_data(db, user_id, selected_month)
 
     return render_template("index.html",
-                           total_income=total_income,
-                           total_expenses=total_expenses,
-                           total_budget=total_budget,
-                           total_savings=total_savings,
-                           net_balance=net_balance,
-                           budget_vs_actual=budget_vs_actual,
-                           budget_bar_labels=budget_bar_labels,
-                           budgeted_data=budgeted_data,
-                           spent_data=spent_data,
-                           pie_chart_labels=pie_chart_labels,
-                           pie_chart_data=pie_chart_data,
-                           line_chart_labels=line_chart_labels,
-                           line_chart_income_data=line_chart_income_data,
-                           line_chart_expenses_data=line_chart_expenses_data,
+                           total_income=dashboard_data["total_income"],
+                           total_expenses=dashboard_data["total_expenses"],
+                           total_budget=dashboard_data["total_budget"],
+                           total_savings=dashboard_data["total_savings"],
+                           net_balance=dashboard_data["net_balance"],
+                           budget_vs_actual=dashboard_data["budget_vs_actual"],
+                           budget_bar_labels=dashboard_data["budget_bar_labels"],
+                           budgeted_data=dashboard_data["budgeted_data"],
+                           spent_data=dashboard_data["spent_data"],
+                           pie_chart_labels=dashboard_data["pie_chart_labels"],
+                           pie_chart_data=dashboard_data["pie_chart_data"],
+                           line_chart_labels=dashboard_data["line_chart_labels"],
+                           line_chart_income_data=dashboard_data["line_chart_income_data"],
+                           line_chart_expenses_data=dashboard_data["line_chart_expenses_data"],
                            selected_month=selected_month,
                            selected_month_display=selected_month_display,
                            available_months=available_months,
-                           monthly_income_total=monthly_income_total,
-                           monthly_expenses_total=monthly_expenses_total)
+                           monthly_income_total=dashboard_data["monthly_income_total"],
+                           monthly_expenses_total=dashboard_data["monthly_expenses_total"])
 
 
 @app.route("/savings_dashboard")
@@ -290,8 +396,8 @@ def savings_dashboard():
     """Display user's savings goals, net worth, and financial health score"""
     user_id = session["user_id"]
 
-    # Pass the 'db' instance to the helper function
-    financial_data = _get_all_financial_metrics(db, user_id)
+    # Served from the metrics cache unless this user's ledger changed
+    financial_data = get_financial_metrics(user_id)
 
     return render_template("savings_dashboard.html",
                             savings_goals=financial_data["savings_goals"],
@@ -306,11 +412,15 @@ def savings_dashboard():
 
 @app.route("/api/financial_alerts_data")
 @login_required
+@rate_limiter.limit("read", identity="session")
+@etag_conditional(db, identity="session")
 def api_financial_alerts_data():
     """API endpoint to provide financial alerts."""
     user_id = session["user_id"]
-    # Pass the 'db' instance to the helper function
-    alerts = _generate_financial_alerts_list(db, user_id)
+    # Reads the materialised alerts; only rules invalidated by a write (or expired) are re-evaluated.
+    # Those are evaluated from the database, not metrics_cache: another worker's cache may
+    # still hold the snapshot from before the write.
+    alerts = get_financial_alerts(db, user_id, lambda: _get_all_financial_metrics(db, user_id))
     return jsonify(alerts)
 
 
@@ -328,6 +438,7 @@ def api_delete_alert():
         db.session.execute(text(
             "INSERT INTO read_user_alerts (user_id, alert_hash) VALUES (:user_id, :alert_hash) ON CONFLICT (user_id, alert_hash) DO NOTHING"
         ), {"user_id": user_id, "alert_hash": alert_hash})
+        bump_data_version(db, user_id)
         db.session.commit() # Commit the transaction
         return jsonify({"success": True, "message": "Alert dismissed permanently."}), 200
     except Exception as e:
@@ -342,6 +453,7 @@ def api_reset_alerts():
     user_id = session["user_id"]
     try:
         db.session.execute(text("DELETE FROM read_user_alerts WHERE user_id = :user_id"), {"user_id": user_id})
+        bump_data_version(db, user_id)
         db.session.commit() # Commit the transaction
         return jsonify({"success": True, "message": "All alerts have been reset."}), 200
     except Exception as e:
@@ -350,7 +462,32 @@ def api_reset_alerts():
         return jsonify({"success": False, "message": "Failed to reset alerts."}), 500
 
 
+def queue_password_reset(email):
+    """Queues the password reset mail for 'email' in the outbox (sent in the background)."""
+    # Generate a token that expires after some time (e.g., 1 hour)
+    token = s.dumps(email, salt='password-reset-salt') # Use a distinct salt
+
+    # Construct the reset link
+    # For local development, this will be http://127.0.0.1:5000/reset_password/<token>
+    reset_url = url_for('reset_password', token=token, _external=True)
+
+    mail_outbox.enqueue(email, "Password Reset Request for Cash Compass", f"""
+Dear {email},
+
+You have requested to reset your password for your Cash Compass account.
+
+Please click on the following link to reset your password:
+{reset_url}
+
+This link is valid for 1 hour. If you did not request a password reset, please ignore this email.
+
+Thank you,
+The Cash Compass Team
+    """)
+
+
 @app.route("/forgot_password", methods=["GET", "POST"])
+@rate_limiter.limit("auth", methods=("POST",))
 def forgot_password():
     """
     Handles forgotten password requests.
@@ -367,36 +504,13 @@ def forgot_password():
         user = execute_query_helper(db, "SELECT id, email FROM users WHERE email = :email", {"email": email}, fetch_one=True)
 
         if user:
-            # Generate a token that expires after some time (e.g., 1 hour)
-            token = s.dumps(user['email'], salt='password-reset-salt') # Use a distinct salt
-
-            # Construct the reset link
-            # For local development, this will be http://127.0.0.1:5000/reset_password/<token>
-            reset_url = url_for('reset_password', token=token, _external=True)
-
-            # Send the email
             try:
-                msg = Message("Password Reset Request for Cash Compass",
-                              sender=app.config['MAIL_DEFAULT_SENDER'],
-                              recipients=[user['email']])
-                msg.body = f"""
-Dear {user['email']},
-
-You have requested to reset your password for your Cash Compass account.
-
-Please click on the following link to reset your password:
-{reset_url}
-
-This link is valid for 1 hour. If you did not request a password reset, please ignore this email.
-
-Thank you,
-The Cash Compass Team
-                """
-                mail.send(msg)
+                queue_password_reset(user['email'])
                 flash("A password reset link has been sent to your email address.", "info")
             except Exception as e:
-                flash(f"Failed to send email. Please check server configuration or try again later. Error: {e}", "danger")
-                print(f"MAIL SEND ERROR: {e}")
+                db.session.rollback()
+                flash("Failed to send email. Please try again later.", "danger")
+                print(f"MAIL QUEUE ERROR: {e}")
         else:
             flash("If an account with that email exists, a password reset link has been sent.", "info")
             # We intentionally give a generic message for security reasons
@@ -407,6 +521,7 @@ The Cash Compass Team
     return render_template("forgot_password.html")
 
 @app.route("/reset_password/<token>", methods=["GET", "POST"])
+@rate_limiter.limit("auth", methods=("POST",))
 def reset_password(token):
     """
     Handles the password reset process after clicking the link.
@@ -443,7 +558,7 @@ def reset_password(token):
         if len(new_password) < 6:
             return apology("New password must be at least 6 characters long", 400)
 
-        new_password_hash = generate_password_hash(new_password)
+        new_password_hash = password_hasher.generate(new_password)
 
         try:
             db.session.execute(text("""
@@ -464,6 +579,7 @@ def reset_password(token):
 
 
 @app.route("/login", methods=["GET", "POST"])
+@rate_limiter.limit("auth", methods=("POST",))
 def login():
     """Log user in"""
     session.clear()
@@ -479,8 +595,8 @@ def login():
             {"username": request.form.get("username")}
         )
 
-        if len(rows) != 1 or not check_password_hash(
-            rows[0]["password_hash"], request.form.get("password")
+        if len(rows) != 1 or not password_hasher.verify_and_upgrade(
+            rows[0]["password_hash"], request.form.get("password"), save_password_hash(rows[0]["id"])
         ):
             return apology("invalid username and/or password", 403)
 
@@ -499,6 +615,7 @@ def logout():
 
 
 @app.route("/register", methods=["GET", "POST"])
+@rate_limiter.limit("auth", methods=("POST",))
 def register():
     """Register user"""
     if request.method == "POST":
@@ -518,7 +635,7 @@ def register():
         if not email: # NEW: Validate email presence
             return apology("must provide email", 400)
 
-        hash_pass = generate_password_hash(password)
+        hash_pass = password_hasher.generate(password)
 
         try:
             # MODIFIED: Include email in the INSERT statement
@@ -570,14 +687,10 @@ def budget():
             flash("Invalid month format provided.", "danger")
             return redirect("/budget")
 
-        db.session.execute(text("""
-            INSERT INTO budget (user_id, category, amount, date)
-            VALUES (:user_id, :category, :amount, :date)
-        """), {
-            "user_id": user_id,
+        insert_entry(db, "budget", user_id, {
             "category": category,
             "amount": amount,
-            "date": budget_date # SQLAlchemy will handle datetime objects for PostgreSQL
+            "date": budget_date
         })
         db.session.commit()
 
@@ -603,12 +716,12 @@ def budget():
             available_months.append((month_val, month_label))
         available_months.reverse()
 
-        budget_items = execute_query_helper(db, """
+        budget_items = execute_query_helper(db, f"""
             SELECT id, category, amount, date
             FROM budget
-            WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
+            WHERE user_id = :user_id AND {DATE_RANGE_SQL}
             ORDER BY category
-        """, {"user_id": user_id, "selected_month": selected_month})
+        """, {"user_id": user_id, **date_range_params(*month_range(selected_month))})
 
         total_budget = sum(float(item['amount']) for item in budget_items) if budget_items else 0.0
 
@@ -648,16 +761,10 @@ def edit_budget(item_id):
         flash("Invalid date format provided.", "danger")
         return redirect("/budget")
 
-    db.session.execute(text("""
-        UPDATE budget
-        SET category = :category, amount = :amount, date = :date
-        WHERE id = :id AND user_id = :user_id
-    """), {
+    update_entry(db, "budget", item_id, user_id, {
         "category": category,
         "amount": amount,
-        "date": budget_date,
-        "id": item_id,
-        "user_id": user_id
+        "date": budget_date
     })
     db.session.commit()
 
@@ -671,10 +778,7 @@ def delete_budget(item_id):
     """Delete a budget item"""
     user_id = session["user_id"]
 
-    db.session.execute(text("""
-        DELETE FROM budget
-        WHERE id = :id AND user_id = :user_id
-    """), {"id": item_id, "user_id": user_id})
+    delete_entry(db, "budget", item_id, user_id)
     db.session.commit()
 
     flash("Budget item deleted successfully!", "success")
@@ -715,33 +819,13 @@ def expenses():
         "%Y-%m"), datetime.now().strftime("%B %Y") + " (Current)"))
 
     if request.method == "POST":
-        category = request.form.get("category")
-        amount = request.form.get("amount")
-        date_str = request.form.get("date")
-
-        if not category or not amount or not date_str:
-            flash("Missing required expense information: Category, Amount, or Date.", "danger")
-            return redirect("/expenses")
-
         try:
-            amount = float(amount)
-            if amount <= 0:
-                flash("Amount must be a positive number.", "danger")
-                return redirect("/expenses")
-            expense_date = datetime.strptime(date_str, "%Y-%m-%d")
-        except (ValueError, TypeError):
-            flash("Invalid amount or date format.", "danger")
+            entry = validate_entry("expenses", request.form)
+        except ValueError as e:
+            flash(str(e), "danger")
             return redirect("/expenses")
 
-        db.session.execute(text("""
-            INSERT INTO expenses (user_id, category, amount, date)
-            VALUES (:user_id, :category, :amount, :date)
-        """), {
-            "user_id": user_id,
-            "category": category,
-            "amount": amount,
-            "date": expense_date # SQLAlchemy will handle datetime objects for PostgreSQL
-        })
+        insert_entry(db, "expenses", user_id, entry)
         db.session.commit()
 
         flash("Expense added successfully!", "success")
@@ -757,12 +841,12 @@ def expenses():
         """, {"user_id": user_id})
         categories = [row["category"] for row in budget_categories]
 
-        expenses_items = execute_query_helper(db, """
+        expenses_items = execute_query_helper(db, f"""
             SELECT id, category, amount, date
             FROM expenses
-            WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
+            WHERE user_id = :user_id AND {DATE_RANGE_SQL}
             ORDER BY date DESC, category
-        """, {"user_id": user_id, "selected_month": selected_month_str})
+        """, {"user_id": user_id, **date_range_params(*month_range(selected_month_str))})
 
         total_expenses = sum(float(item['amount']) for item in expenses_items)
 
@@ -782,34 +866,13 @@ def edit_expense(item_id):
     """Edit an expense item"""
     user_id = session["user_id"]
 
-    category = request.form.get("category")
-    amount = request.form.get("amount")
-    date_str = request.form.get("date")
-
-    if not category:
-        flash("Category cannot be empty", "danger")
-        return redirect("/expenses")
     try:
-        amount = float(amount)
-        if amount <= 0:
-            flash("Amount must be a positive number.", "danger")
-            return redirect("/expenses")
-        expense_date = datetime.strptime(date_str, "%Y-%m-%d")
-    except (ValueError, TypeError):
-        flash("Invalid amount or date format.", "danger")
+        entry = validate_entry("expenses", request.form)
+    except ValueError as e:
+        flash(str(e), "danger")
         return redirect("/expenses")
 
-    db.session.execute(text("""
-        UPDATE expenses
-        SET category = :category, amount = :amount, date = :date
-        WHERE id = :id AND user_id = :user_id
-    """), {
-        "category": category,
-        "amount": amount,
-        "date": expense_date,
-        "id": item_id,
-        "user_id": user_id
-    })
+    update_entry(db, "expenses", item_id, user_id, entry)
     db.session.commit()
 
     flash("Expense item updated successfully!", "success")
@@ -823,10 +886,7 @@ def delete_expense(item_id):
     """Delete an expense item"""
     user_id = session["user_id"]
 
-    db.session.execute(text("""
-        DELETE FROM expenses
-        WHERE id = :id AND user_id = :user_id
-    """), {"id": item_id, "user_id": user_id})
+    delete_entry(db, "expenses", item_id, user_id)
     db.session.commit()
 
     flash("Expense item deleted successfully!", "success")
@@ -841,37 +901,13 @@ def income():
     user_id = session["user_id"]
 
     if request.method == "POST":
-        source = request.form.get("source")
-        amount = request.form.get("amount")
-        income_date_str = request.form.get("date")
-
-        if not source:
-            flash("Income source cannot be empty", "danger")
-            return redirect("/income")
-        try:
-            amount = float(amount)
-            if amount <= 0:
-                flash("Amount must be a positive number", "danger")
-                return redirect("/income")
-        except (ValueError, TypeError):
-            flash("Invalid amount format", "danger")
-            return redirect("/income")
-
         try:
-            income_date = datetime.strptime(income_date_str, '%Y-%m-%d')
-        except ValueError:
-            flash("Invalid date format provided.", "danger")
+            entry = validate_entry("income", request.form)
+        except ValueError as e:
+            flash(str(e), "danger")
             return redirect("/income")
 
-        db.session.execute(text("""
-            INSERT INTO income (user_id, source, amount, date)
-            VALUES (:user_id, :source, :amount, :date)
-        """), {
-            "user_id": user_id,
-            "source": source,
-            "amount": amount,
-            "date": income_date
-        })
+        insert_entry(db, "income", user_id, entry)
         db.session.commit()
 
         flash("Income added successfully!", "success")
@@ -896,12 +932,12 @@ def income():
             available_months.append((month_val, month_label))
         available_months.reverse()
 
-        income_items = execute_query_helper(db, """
+        income_items = execute_query_helper(db, f"""
             SELECT id, source, amount, date
             FROM income
-            WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
+            WHERE user_id = :user_id AND {DATE_RANGE_SQL}
             ORDER BY date DESC, source
-        """, {"user_id": user_id, "selected_month": selected_month})
+        """, {"user_id": user_id, **date_range_params(*month_range(selected_month))})
 
         total_income = sum(float(item['amount']) for item in income_items) if income_items else 0.0
 
@@ -920,39 +956,13 @@ def edit_income(item_id):
     """Edit an income item"""
     user_id = session["user_id"]
 
-    source = request.form.get("source")
-    amount = request.form.get("amount")
-    date_str = request.form.get("date")
-
-    if not source:
-        flash("Income source cannot be empty", "danger")
-        return redirect("/income")
     try:
-        amount = float(amount)
-        if amount <= 0:
-            flash("Amount must be a positive number", "danger")
-            return redirect("/income")
-    except (ValueError, TypeError):
-        flash("Invalid amount format", "danger")
-        return redirect("/income")
-
-    try:
-        income_date = datetime.strptime(date_str, '%Y-%m-%d')
-    except ValueError:
-        flash("Invalid date format provided.", "danger")
+        entry = validate_entry("income", request.form)
+    except ValueError as e:
+        flash(str(e), "danger")
         return redirect("/income")
 
-    db.session.execute(text("""
-        UPDATE income
-        SET source = :source, amount = :amount, date = :date
-        WHERE id = :id AND user_id = :user_id
-    """), {
-        "source": source,
-        "amount": amount,
-        "date": income_date,
-        "id": item_id,
-        "user_id": user_id
-    })
+    update_entry(db, "income", item_id, user_id, entry)
     db.session.commit()
 
     flash("Income item updated successfully!", "success")
@@ -965,10 +975,7 @@ def delete_income(item_id):
     """Delete an income item"""
     user_id = session["user_id"]
 
-    db.session.execute(text("""
-        DELETE FROM income
-        WHERE id = :id AND user_id = :user_id
-    """), {"id": item_id, "user_id": user_id})
+    delete_entry(db, "income", item_id, user_id)
     db.session.commit()
 
     flash("Income item deleted successfully!", "success")
@@ -1009,11 +1016,7 @@ def savings():
             flash("Invalid target amount format", "danger")
             return redirect("/savings")
 
-        db.session.execute(text("""
-            INSERT INTO savings (user_id, goal, amount, target_amount)
-            VALUES (:user_id, :goal, :amount, :target_amount)
-        """), {
-            "user_id": user_id,
+        insert_entry(db, "savings", user_id, {
             "goal": goal,
             "amount": amount,
             "target_amount": target_amount
@@ -1071,16 +1074,10 @@ def edit_savings(item_id):
         flash("Invalid target amount format", "danger")
         return redirect("/savings")
 
-    db.session.execute(text("""
-        UPDATE savings
-        SET goal = :goal, amount = :amount, target_amount = :target_amount
-        WHERE id = :id AND user_id = :user_id
-    """), {
+    update_entry(db, "savings", item_id, user_id, {
         "goal": goal,
         "amount": amount,
-        "target_amount": target_amount,
-        "id": item_id,
-        "user_id": user_id
+        "target_amount": target_amount
     })
     db.session.commit()
 
@@ -1094,16 +1091,53 @@ def delete_savings(item_id):
     """Delete a savings item"""
     user_id = session["user_id"]
 
-    db.session.execute(text("""
-        DELETE FROM savings
-        WHERE id = :id AND user_id = :user_id
-    """), {"id": item_id, "user_id": user_id})
+    delete_entry(db, "savings", item_id, user_id)
     db.session.commit()
 
     flash("Savings item deleted successfully!", "success")
     return redirect("/savings")
 
 
+@app.route("/import", methods=["GET", "POST"])
+@login_required
+def import_transactions():
+    """Upload a CSV, OFX or JSON file of income or expenses"""
+    user_id = session["user_id"]
+
+    if request.method == "POST":
+        entity = request.form.get("entity")
+        upload = request.files.get("file")
+        if entity not in IMPORTABLE_TABLES:
+            flash("Choose whether the file holds income or expenses.", "danger")
+            return redirect("/import")
+        if not upload or not upload.filename:
+            flash("Choose a file to import.", "danger")
+            return redirect("/import")
+
+        import_format = request.form.get("format") or detect_format(upload.filename, upload.mimetype)
+        if import_format not in IMPORT_FORMATS:
+            flash("Unsupported file type. Upload a .csv, .ofx or .json file.", "danger")
+            return redirect("/import")
+
+        try:
+            summary = import_entries(db, entity, user_id, upload.read().decode("utf-8-sig"), import_format)
+            db.session.commit()
+        except (ValueError, UnicodeDecodeError) as e:
+            db.session.rollback()
+            flash(str(e), "danger")
+            return redirect("/import")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Database error during import: {e}")
+            flash("An error occurred while importing. Nothing was saved.", "danger")
+            return redirect("/import")
+
+        flash(f"Imported {summary['imported']} of {summary['received']} rows.", "success" if summary["imported"] else "warning")
+        return render_template("import.html", summary=summary, entities=IMPORTABLE_TABLES)
+
+    return render_template("import.html", summary=None, entities=IMPORTABLE_TABLES)
+
+
 @app.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
@@ -1151,11 +1185,7 @@ def debt():
 
         due_date = due_date_str if due_date_str else None # Store as string or None
 
-        db.session.execute(text("""
-            INSERT INTO debt (user_id, debt_name, debt_type, current_balance, due_date)
-            VALUES (:user_id, :debt_name, :debt_type, :current_balance, :due_date)
-        """), {
-            "user_id": user_id,
+        insert_entry(db, "debt", user_id, {
             "debt_name": debt_name,
             "debt_type": debt_type,
             "current_balance": current_balance,
@@ -1213,17 +1243,11 @@ def edit_debt(item_id):
 
     due_date = due_date_str if due_date_str else None
 
-    db.session.execute(text("""
-        UPDATE debt
-        SET debt_name = :debt_name, debt_type = :debt_type, current_balance = :current_balance, due_date = :due_date
-        WHERE id = :id AND user_id = :user_id
-    """), {
+    update_entry(db, "debt", item_id, user_id, {
         "debt_name": debt_name,
         "debt_type": debt_type,
         "current_balance": current_balance,
-        "due_date": due_date,
-        "id": item_id,
-        "user_id": user_id
+        "due_date": due_date
     })
     db.session.commit()
 
@@ -1237,10 +1261,7 @@ def delete_debt(item_id):
     """Delete a debt item"""
     user_id = session["user_id"]
 
-    db.session.execute(text("""
-        DELETE FROM debt
-        WHERE id = :id AND user_id = :user_id
-    """), {"id": item_id, "user_id": user_id})
+    delete_entry(db, "debt", item_id, user_id)
     db.session.commit()
 
     flash("Debt item deleted successfully!", "success")
@@ -1263,7 +1284,7 @@ def settings():
             flash("User not found.", "danger")
             return redirect("/login")
 
-        if not current_password or not check_password_hash(user_row["password_hash"], current_password):
+        if not current_password or not password_hasher.check(user_row["password_hash"], current_password):
             return apology("Invalid current password", 403)
 
         if not new_password or not confirmation:
@@ -1273,7 +1294,7 @@ def settings():
         if len(new_password) < 6:
             return apology("New password must be at least 6 characters long", 400)
 
-        new_password_hash = generate_password_hash(new_password)
+        new_password_hash = password_hasher.generate(new_password)
 
         db.session.execute(text("""
             UPDATE users
@@ -1358,7 +1379,7 @@ def delete_account():
             flash("User not found.", "danger")
             return redirect("/login")
 
-        if not password or not check_password_hash(user_row["password_hash"], password):
+        if not password or not password_hasher.check(user_row["password_hash"], password):
             return apology("Invalid password", 403)
 
         try:
@@ -1367,10 +1388,17 @@ def delete_account():
             db.session.execute(text("DELETE FROM savings WHERE user_id = :user_id"), {"user_id": user_id})
             db.session.execute(text("DELETE FROM expenses WHERE user_id = :user_id"), {"user_id": user_id})
             db.session.execute(text("DELETE FROM income WHERE user_id = :user_id"), {"user_id": user_id})
+            db.session.execute(text("DELETE FROM monthly_rollup WHERE user_id = :user_id"), {"user_id": user_id})
+            db.session.execute(text("DELETE FROM sync_tombstones WHERE user_id = :user_id"), {"user_id": user_id})
+            db.session.execute(text("DELETE FROM user_change_seq WHERE user_id = :user_id"), {"user_id": user_id})
             db.session.execute(text("DELETE FROM debt WHERE user_id = :user_id"), {"user_id": user_id})
             db.session.execute(text("DELETE FROM read_user_alerts WHERE user_id = :user_id"), {"user_id": user_id})
+            db.session.execute(text("DELETE FROM advisor_jobs WHERE user_id = :user_id"), {"user_id": user_id})
+            db.session.execute(text("DELETE FROM user_alert_state WHERE user_id = :user_id"), {"user_id": user_id})
+            db.session.execute(text("DELETE FROM user_data_version WHERE user_id = :user_id"), {"user_id": user_id})
             db.session.execute(text("DELETE FROM users WHERE id = :user_id"), {"user_id": user_id})
             db.session.commit()
+            metrics_cache.invalidate(user_id)
 
             flash("Your account has been successfully deleted.", "info")
             session.pop('user_id', None)
@@ -1387,58 +1415,90 @@ def delete_account():
 
 @app.route("/financial_advisor", methods=["GET", "POST"])
 @login_required
+@rate_limiter.limit("ai", identity="session", methods=("POST",))
 def financial_advisor():
     """AI Financial Advisor page."""
     user_id = session["user_id"]
 
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
     financial_advice_html = None
+    job_id = None
 
     if request.method == "POST":
-        # 1. Fetch financial data from your database using your helper
-        # Pass the 'db' instance to the helper function
-        financial_data = _get_all_financial_metrics(db, user_id)
+        if not gemini_settings()["api_key"]:
+            flash("AI Financial Advisor not configured. Please update your Key in your .env file.", "warning")
+            return render_template("financial_advisor.html", financial_advice=None)
 
-        # 2. Build the prompt for the AI
+        # Served from the metrics cache unless this user's ledger changed
+        financial_data = get_financial_metrics(user_id)
         prompt = build_ai_prompt(financial_data)
 
-        # 3. Make the Gemini API call (using gemini-2.0-flash)
-        if not GEMINI_API_KEY:
-            flash("AI Financial Advisor not configured. Please update your Key in your .env file.", "warning")
-            return render_template("financial_advisor.html", financial_advice=None)
+        # The Gemini call runs in the background; the page polls the job until it finishes
+        job = advisor_jobs.submit(user_id, prompt)
+        if job["status"] == "done":
+            financial_advice_html = markdown.markdown(job["advice"])
+            flash("Financial advice generated successfully!", "success")
+        else:
+            job_id = job["id"]
 
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-        payload = {
-            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 2048,
-            }
-        }
+    return render_template("financial_advisor.html", financial_advice=financial_advice_html,
+                           job_id=job_id, show_loading=job_id is not None)
+
+
+@app.route("/financial_advisor/jobs/<job_id>")
+@login_required
+def financial_advisor_job(job_id):
+    """Poll endpoint for the advisor page: job status and, once done, the advice as HTML."""
+    job = advisor_jobs.get(job_id, session["user_id"])
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify({
+        "status": job["status"],
+        "advice_html": markdown.markdown(job["advice"]) if job["status"] == "done" else None,
+        "error": job["error"],
+    })
 
-        try:
-            response = requests.post(api_url, headers={'Content-Type': 'application/json'}, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
-
-            if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
-                ai_text_response = result['candidates'][0]['content']['parts'][0]['text']
-                financial_advice_html = markdown.markdown(ai_text_response)
-                flash("Financial advice generated successfully!", "success")
-            else:
-                flash("AI did not generate a valid response. Please try again.", "warning")
-                financial_advice_html = None
-        except requests.exceptions.RequestException as e:
-            flash("Danger, failed to get AI advice. Make sure to update your actual gemini API key in your .env file.", "danger")
-            financial_advice_html = None
-        except Exception as e:
-            flash(f"An unexpected error occurred: {e}", "danger")
-            financial_advice_html = None
 
-    return render_template("financial_advisor.html", financial_advice=financial_advice_html)
+@app.route("/financial_advisor/stream")
+@login_required
+@rate_limiter.limit("ai", identity="session")
+def financial_advisor_stream():
+    """Streams advice for the advisor page as Server-Sent Events while Gemini generates it."""
+    user_id = session["user_id"]
+    if not gemini_settings()["api_key"]:
+        return jsonify({"error": "AI Financial Advisor not configured. Please update your Key in your .env file."}), 500
+    prompt = build_ai_prompt(get_financial_metrics(user_id))
+    return advice_event_stream(prompt)
+
+
+def advice_event_stream(prompt):
+    """SSE response relaying advisor_jobs.stream(prompt) to the client as it is produced."""
+    return Response(
+        stream_with_context(advisor_jobs.stream(prompt)),
+        mimetype="text/event-stream",
+        # Stop reverse proxies (nginx, Heroku router) from buffering the events
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+
+def format_trends(trends):
+    """The 'Spending Trends' part of the AI prompt, or nothing without recorded months."""
+    if not trends or not any(trends["expenses"]["series"] + trends["income"]["series"]):
+        return ""
+    format_change = lambda trend: (f"{trend['mom_delta_pct']:+.1f}%" if trend["mom_delta_pct"] is not None
+                                   else f"{trend['mom_delta']:+.2f}")
+    income, expenses = trends["income"], trends["expenses"]
+    lines = [
+        f"**Spending Trends (months up to {trends['end_month']}):**",
+        f"        • Monthly Income: ${income['current']:.2f} ({format_change(income)} vs. previous month); "
+        f"3/6/12-month averages ${income['rolling_average']['3']:.2f} / ${income['rolling_average']['6']:.2f} / ${income['rolling_average']['12']:.2f}",
+        f"        • Monthly Expenses: ${expenses['current']:.2f} ({format_change(expenses)} vs. previous month); "
+        f"3/6/12-month averages ${expenses['rolling_average']['3']:.2f} / ${expenses['rolling_average']['6']:.2f} / ${expenses['rolling_average']['12']:.2f}",
+        f"        • Forecast for {trends['forecast_month']}: income ${income['forecast']:.2f}, expenses ${expenses['forecast']:.2f}",
+    ]
+    for category in trends["categories"][:5]:
+        lines.append(f"        • {category['category']}: ${category['current']:.2f} last month ({format_change(category)}), "
+                     f"6-month average ${category['rolling_average']['6']:.2f}, forecast ${category['forecast']:.2f}")
+    return "\n".join(lines)
 
 
 def build_ai_prompt(financial_data):
@@ -1463,6 +1523,7 @@ def build_ai_prompt(financial_data):
     emergency_fund_coverage = data.get('emergency_fund_coverage', 0)
     over_budget_categories = data.get('over_budget_categories', [])
     top_spending_categories_str = data.get('top_spending_categories_str', 'None')
+    trends = data.get('spending_trends')
 
 
     has_significant_financial_data = (
@@ -1511,6 +1572,8 @@ def build_ai_prompt(financial_data):
         • Over-Budget Categories: {get_categories(over_budget_categories)}
         • Top Spending Categories: {top_spending_categories_str}
 
+        {format_trends(trends)}
+
         Please provide detailed advice covering:
         1. **Financial Health Assessment** - Overall financial position analysis
         2. **Net Worth & Cash Flow Optimization** - Strategies to improve financial position
@@ -1528,6 +1591,7 @@ def build_ai_prompt(financial_data):
 
 # --- API: Login (returns JWT) ---
 @app.route("/api/login", methods=["POST"])
+@rate_limiter.limit("auth")
 def api_login():
     data = request.get_json()
     username = data.get("username")
@@ -1535,7 +1599,7 @@ def api_login():
     if not username or not password:
         return jsonify({"msg": "Missing username or password"}), 400
     user = execute_query_helper(db, "SELECT id, username, password_hash FROM users WHERE username = :username", {"username": username}, fetch_one=True)
-    if not user or not check_password_hash(user["password_hash"], password):
+    if not user or not password_hasher.verify_and_upgrade(user["password_hash"], password, save_password_hash(user["id"])):
         return jsonify({"msg": "Invalid username or password"}), 401
     # FIX: Ensure identity is a string for Flask-JWT-Extended
     access_token = create_access_token(identity=str(user["id"]))
@@ -1543,13 +1607,14 @@ def api_login():
 
 # --- API: Register (JSON, no email/confirmation required) ---
 @app.route("/api/register", methods=["POST"])
+@rate_limiter.limit("auth")
 def api_register():
     data = request.get_json()
     username = data.get("username")
     password = data.get("password")
     if not username or not password:
         return jsonify({"msg": "Missing username or password"}), 400
-    hash_pass = generate_password_hash(password)
+    hash_pass = password_hasher.generate(password)
     try:
         db.session.execute(text(
             "INSERT INTO users (username, password_hash) VALUES (:username, :password_hash)"
@@ -1565,25 +1630,17 @@ def api_register():
 # --- API: Income CRUD ---
 @app.route('/api/income', methods=['GET', 'POST'])
 @jwt_required()
+@etag_conditional(db)
 def api_income():
     user_id = get_jwt_identity()
     if request.method == 'GET':
-        month = request.args.get('month')
-        year = request.args.get('year')
-        query = "SELECT id, user_id, source, amount, date FROM income WHERE user_id = :user_id"
-        params = {"user_id": user_id}
-        if month and year:
-            query += " AND EXTRACT(MONTH FROM date) = :month AND EXTRACT(YEAR FROM date) = :year"
-            params["month"] = int(month)
-            params["year"] = int(year)
-        elif year:
-            query += " AND EXTRACT(YEAR FROM date) = :year"
-            params["year"] = int(year)
-        elif month:
-            query += " AND EXTRACT(MONTH FROM date) = :month"
-            params["month"] = int(month)
-        result = db.session.execute(text(query), params)
-        income_items = [dict(row) for row in result.mappings()]
+        # Optional: month/year or start_date/end_date filters, fields=, limit/cursor paging
+        try:
+            income_items, next_cursor = list_ledger_rows(db, "income", user_id, request.args)
+        except ValueError as e:
+            return jsonify({'msg': str(e)}), 400
+        if any(request.args.get(arg) for arg in PAGING_ARGS):
+            return jsonify({'income': income_items, 'next_cursor': next_cursor})
         return jsonify({'income': income_items})
     elif request.method == 'POST':
         data = request.get_json()
@@ -1592,18 +1649,11 @@ def api_income():
         date = data.get('date')
         if not source or amount is None or not date:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                INSERT INTO income (user_id, source, amount, date)
-                VALUES (:user_id, :source, :amount, :date)
-            """),
-            {
-                'user_id': user_id,
-                'source': source,
-                'amount': amount,
-                'date': date
-            }
-        )
+        insert_entry(db, "income", user_id, {
+            "source": source,
+            "amount": amount,
+            "date": date
+        })
         db.session.commit()
         return jsonify({'msg': 'Income item added'}), 201
 
@@ -1618,59 +1668,32 @@ def api_income_item(item_id):
         date = data.get('date')
         if not source or amount is None or not date:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                UPDATE income
-                SET source = :source, amount = :amount, date = :date
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'source': source,
-                'amount': amount,
-                'date': date,
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        update_entry(db, "income", item_id, user_id, {
+            "source": source,
+            "amount": amount,
+            "date": date
+        })
         db.session.commit()
         return jsonify({'msg': 'Income item updated'})
     elif request.method == 'DELETE':
-        db.session.execute(
-            text("""
-                DELETE FROM income
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        delete_entry(db, "income", item_id, user_id)
         db.session.commit()
         return jsonify({'msg': 'Income item deleted'})
 
 # --- API: Expenses CRUD ---
 @app.route('/api/expenses', methods=['GET', 'POST'])
 @jwt_required()
+@etag_conditional(db)
 def api_expenses():
     user_id = get_jwt_identity()
     if request.method == 'GET':
-        # Optional: filter by month/year
-        month = request.args.get('month')
-        year = request.args.get('year')
-        query = "SELECT id, user_id, category, amount, date FROM expenses WHERE user_id = :user_id"
-        params = {"user_id": user_id}
-        if month and year:
-            query += " AND EXTRACT(MONTH FROM date) = :month AND EXTRACT(YEAR FROM date) = :year"
-            params["month"] = int(month)
-            params["year"] = int(year)
-        elif year:
-            query += " AND EXTRACT(YEAR FROM date) = :year"
-            params["year"] = int(year)
-        elif month:
-            query += " AND EXTRACT(MONTH FROM date) = :month"
-            params["month"] = int(month)
-        result = db.session.execute(text(query), params)
-        expense_items = [dict(row) for row in result.mappings()]
+        # Optional: month/year or start_date/end_date filters, fields=, limit/cursor paging
+        try:
+            expense_items, next_cursor = list_ledger_rows(db, "expenses", user_id, request.args)
+        except ValueError as e:
+            return jsonify({'msg': str(e)}), 400
+        if any(request.args.get(arg) for arg in PAGING_ARGS):
+            return jsonify({'expenses': expense_items, 'next_cursor': next_cursor})
         return jsonify({'expenses': expense_items})
     elif request.method == 'POST':
         data = request.get_json()
@@ -1679,18 +1702,11 @@ def api_expenses():
         date = data.get('date')
         if not category or amount is None or not date:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                INSERT INTO expenses (user_id, category, amount, date)
-                VALUES (:user_id, :category, :amount, :date)
-            """),
-            {
-                'user_id': user_id,
-                'category': category,
-                'amount': amount,
-                'date': date
-            }
-        )
+        insert_entry(db, "expenses", user_id, {
+            "category": category,
+            "amount": amount,
+            "date": date
+        })
         db.session.commit()
         return jsonify({'msg': 'Expense item added'}), 201
 
@@ -1705,57 +1721,31 @@ def api_expense_item(item_id):
         date = data.get('date')
         if not category or amount is None or not date:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                UPDATE expenses
-                SET category = :category, amount = :amount, date = :date
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'category': category,
-                'amount': amount,
-                'date': date,
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        update_entry(db, "expenses", item_id, user_id, {
+            "category": category,
+            "amount": amount,
+            "date": date
+        })
         db.session.commit()
         return jsonify({'msg': 'Expense item updated'})
     elif request.method == 'DELETE':
-        db.session.execute(
-            text("""
-                DELETE FROM expenses
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        delete_entry(db, "expenses", item_id, user_id)
         db.session.commit()
         return jsonify({'msg': 'Expense item deleted'})
 
 # --- API: Budgets CRUD ---
 @app.route('/api/budgets', methods=['GET', 'POST'])
 @jwt_required()
+@etag_conditional(db)
 def api_budgets():
     user_id = get_jwt_identity()
     if request.method == 'GET':
         # Optional: filter by month/year
         month = request.args.get('month')
         year = request.args.get('year')
-        query = "SELECT id, user_id, category, amount, date FROM budget WHERE user_id = :user_id"
-        params = {"user_id": user_id}
-        if month and year:
-            query += " AND EXTRACT(MONTH FROM date) = :month AND EXTRACT(YEAR FROM date) = :year"
-            params["month"] = int(month)
-            params["year"] = int(year)
-        elif year:
-            query += " AND EXTRACT(YEAR FROM date) = :year"
-            params["year"] = int(year)
-        elif month:
-            query += " AND EXTRACT(MONTH FROM date) = :month"
-            params["month"] = int(month)
+        period_sql, period_params = period_filter(month, year)
+        query = "SELECT id, user_id, category, amount, date FROM budget WHERE user_id = :user_id" + period_sql
+        params = {"user_id": user_id, **period_params}
         result = db.session.execute(text(query), params)
         budget_items = [dict(row) for row in result.mappings()]
         return jsonify({'budgets': budget_items})
@@ -1766,18 +1756,11 @@ def api_budgets():
         date = data.get('date')
         if not category or amount is None or not date:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                INSERT INTO budget (user_id, category, amount, date)
-                VALUES (:user_id, :category, :amount, :date)
-            """),
-            {
-                'user_id': user_id,
-                'category': category,
-                'amount': amount,
-                'date': date
-            }
-        )
+        insert_entry(db, "budget", user_id, {
+            "category": category,
+            "amount": amount,
+            "date": date
+        })
         db.session.commit()
         return jsonify({'msg': 'Budget item added'}), 201
 
@@ -1792,39 +1775,22 @@ def api_budget_item(item_id):
         date = data.get('date')
         if not category or amount is None or not date:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                UPDATE budget
-                SET category = :category, amount = :amount, date = :date
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'category': category,
-                'amount': amount,
-                'date': date,
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        update_entry(db, "budget", item_id, user_id, {
+            "category": category,
+            "amount": amount,
+            "date": date
+        })
         db.session.commit()
         return jsonify({'msg': 'Budget item updated'})
     elif request.method == 'DELETE':
-        db.session.execute(
-            text("""
-                DELETE FROM budget
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        delete_entry(db, "budget", item_id, user_id)
         db.session.commit()
         return jsonify({'msg': 'Budget item deleted'})
 
 # --- API: Savings CRUD ---
 @app.route('/api/savings', methods=['GET', 'POST'])
 @jwt_required()
+@etag_conditional(db)
 def api_savings():
     user_id = get_jwt_identity()
     if request.method == 'GET':
@@ -1841,18 +1807,11 @@ def api_savings():
         target_amount = data.get('target_amount')
         if not goal or amount is None or target_amount is None:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                INSERT INTO savings (user_id, goal, amount, target_amount)
-                VALUES (:user_id, :goal, :amount, :target_amount)
-            """),
-            {
-                'user_id': user_id,
-                'goal': goal,
-                'amount': amount,
-                'target_amount': target_amount
-            }
-        )
+        insert_entry(db, "savings", user_id, {
+            "goal": goal,
+            "amount": amount,
+            "target_amount": target_amount
+        })
         db.session.commit()
         return jsonify({'msg': 'Savings item added'}), 201
 
@@ -1867,39 +1826,22 @@ def api_savings_item(item_id):
         target_amount = data.get('target_amount')
         if not goal or amount is None or target_amount is None:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                UPDATE savings
-                SET goal = :goal, amount = :amount, target_amount = :target_amount
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'goal': goal,
-                'amount': amount,
-                'target_amount': target_amount,
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        update_entry(db, "savings", item_id, user_id, {
+            "goal": goal,
+            "amount": amount,
+            "target_amount": target_amount
+        })
         db.session.commit()
         return jsonify({'msg': 'Savings item updated'})
     elif request.method == 'DELETE':
-        db.session.execute(
-            text("""
-                DELETE FROM savings
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        delete_entry(db, "savings", item_id, user_id)
         db.session.commit()
         return jsonify({'msg': 'Savings item deleted'})
 
 # --- API: Debt CRUD ---
 @app.route('/api/debt', methods=['GET', 'POST'])
 @jwt_required()
+@etag_conditional(db)
 def api_debt():
     user_id = get_jwt_identity()
     if request.method == 'GET':
@@ -1931,19 +1873,12 @@ def api_debt():
         due_date = data.get('due_date')
         if not debt_name or not debt_type or current_balance is None:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                INSERT INTO debt (user_id, debt_name, debt_type, current_balance, due_date)
-                VALUES (:user_id, :debt_name, :debt_type, :current_balance, :due_date)
-            """),
-            {
-                'user_id': user_id,
-                'debt_name': debt_name,
-                'debt_type': debt_type,
-                'current_balance': current_balance,
-                'due_date': due_date
-            }
-        )
+        insert_entry(db, "debt", user_id, {
+            "debt_name": debt_name,
+            "debt_type": debt_type,
+            "current_balance": current_balance,
+            "due_date": due_date
+        })
         db.session.commit()
         return jsonify({'msg': 'Debt item added'}), 201
 
@@ -1959,37 +1894,95 @@ def api_debt_item(item_id):
         due_date = data.get('due_date')
         if not debt_name or not debt_type or current_balance is None:
             return jsonify({'msg': 'Missing required fields'}), 400
-        db.session.execute(
-            text("""
-                UPDATE debt
-                SET debt_name = :debt_name, debt_type = :debt_type, current_balance = :current_balance, due_date = :due_date
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'debt_name': debt_name,
-                'debt_type': debt_type,
-                'current_balance': current_balance,
-                'due_date': due_date,
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        update_entry(db, "debt", item_id, user_id, {
+            "debt_name": debt_name,
+            "debt_type": debt_type,
+            "current_balance": current_balance,
+            "due_date": due_date
+        })
         db.session.commit()
         return jsonify({'msg': 'Debt item updated'})
     elif request.method == 'DELETE':
-        db.session.execute(
-            text("""
-                DELETE FROM debt
-                WHERE id = :item_id AND user_id = :user_id
-            """),
-            {
-                'item_id': item_id,
-                'user_id': user_id
-            }
-        )
+        delete_entry(db, "debt", item_id, user_id)
         db.session.commit()
         return jsonify({'msg': 'Debt item deleted'})
 
+# --- API: Batch writes ---
+@app.route('/api/batch', methods=['POST'])
+@jwt_required()
+def api_batch():
+    """
+    Applies {"operations": [{"op", "entity", "id", "data"}, ...], "atomic": false}
+    in order, in one transaction. Returns one result per operation; with
+    "atomic": true nothing is written unless every operation succeeds.
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    try:
+        results, applied = apply_batch(db, user_id, data.get('operations'), atomic=bool(data.get('atomic')))
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    failed = sum(1 for result in results if result['status'] == 'error')
+    body = {'applied': applied, 'failed': failed, 'results': results}
+    if not applied:
+        # 400 when the batch itself was invalid, 409 when applying it failed
+        codes = {result['code'] for result in results if result['status'] == 'error'}
+        return jsonify(body), 400 if codes == {400} else 409
+    return jsonify(body)
+
+# --- API: Export ---
+@app.route('/api/export/<entity>', methods=['GET'])
+@jwt_required()
+def api_export(entity):
+    """Streams every income/expenses/budget/savings/debt row of the user as NDJSON or CSV."""
+    user_id = get_jwt_identity()
+    if entity not in LEDGER_TABLES:
+        return jsonify({'msg': f'Unknown entity. Use one of: {", ".join(LEDGER_TABLES)}'}), 404
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'msg': f'Unknown format. Use one of: {", ".join(EXPORT_FORMATS)}'}), 400
+
+    # No Content-Length: the body goes out with chunked transfer encoding as batches are read
+    return Response(
+        stream_with_context(generate_export(db, entity, user_id, export_format)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={entity}.{export_format}'}
+    )
+
+# --- API: Import ---
+@app.route('/api/import/<entity>', methods=['POST'])
+@jwt_required()
+def api_import(entity):
+    """
+    Bulk-imports income or expenses from an uploaded 'file', a JSON array body,
+    or a raw CSV/OFX body (?format= or Content-Type). Valid rows are inserted in
+    one transaction; the response lists rejected rows and the throughput.
+    """
+    user_id = get_jwt_identity()
+    if entity not in IMPORTABLE_TABLES:
+        return jsonify({'msg': f'Unknown entity. Use one of: {", ".join(IMPORTABLE_TABLES)}'}), 404
+
+    upload = request.files.get('file')
+    if upload:
+        import_format = request.args.get('format') or detect_format(upload.filename, upload.mimetype)
+        raw = upload.read()
+    else:
+        import_format = request.args.get('format') or detect_format(content_type=request.content_type)
+        raw = request.get_data()
+    if import_format not in IMPORT_FORMATS:
+        return jsonify({'msg': f'Unknown format. Use one of: {", ".join(IMPORT_FORMATS)}'}), 400
+
+    try:
+        summary = import_entries(db, entity, user_id, raw.decode('utf-8-sig'), import_format)
+        db.session.commit()
+    except (ValueError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        return jsonify({'msg': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Error importing rows: {e}'}), 500
+    return jsonify(summary), 201 if summary['imported'] else 200
+
 # --- API: Profile ---
 @app.route('/api/profile', methods=['GET', 'PUT'])
 @jwt_required()
@@ -2012,13 +2005,26 @@ def api_profile():
 
 # --- API: Forgot Password ---
 @app.route('/api/forgot_password', methods=['POST'])
+@rate_limiter.limit("auth")
 def api_forgot_password():
-    data = request.get_json()
-    
+    data = request.get_json(silent=True) or {}
+    email = data.get('email')
+    if not email:
+        return jsonify({'msg': 'Email is required'}), 400
+    user = execute_query_helper(db, "SELECT id, email FROM users WHERE email = :email", {"email": email}, fetch_one=True)
+    if user:
+        try:
+            queue_password_reset(user['email'])
+        except Exception as e:
+            db.session.rollback()
+            print(f"MAIL QUEUE ERROR: {e}")
+            return jsonify({'msg': 'Could not send the reset email. Please try again later.'}), 503
+    # Same answer either way, so the endpoint can't be used to find registered emails
     return jsonify({'msg': 'If the email exists, a reset link was sent.'})
 
 # --- API: Reset Password ---
 @app.route('/api/reset_password', methods=['POST'])
+@rate_limiter.limit("auth")
 def api_reset_password():
     data = request.get_json()
     
@@ -2027,43 +2033,54 @@ def api_reset_password():
 # --- API: AI Financial Advisor (JSON for mobile) ---
 @app.route('/api/ai_advisor', methods=['POST'])
 @jwt_required()
+@rate_limiter.limit("ai", identity="jwt")
 def api_ai_advisor():
+    """
+    Starts an advice generation. Returns the advice at once (200) when this
+    financial snapshot was already answered, otherwise a job to poll (202).
+    """
     user_id = get_jwt_identity()
+    if not gemini_settings()["api_key"]:
+        return jsonify({'error': 'AI Financial Advisor not configured. Please update your Key in your .env file.'}), 500
     # Use the same logic as /financial_advisor to get financial data
-    financial_data = _get_all_financial_metrics(db, user_id)
+    financial_data = get_financial_metrics(user_id)
     prompt = build_ai_prompt(financial_data)
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
+    job = advisor_jobs.submit(user_id, prompt)
+    if job["status"] == "done":
+        # Return as markdown/plain text for mobile
+        return jsonify({'advice': job["advice"], 'job_id': job["id"], 'status': job["status"]})
+    return jsonify({
+        'job_id': job["id"],
+        'status': job["status"],
+        'poll_url': url_for('api_ai_advisor_job', job_id=job["id"])
+    }), 202
+
+
+@app.route('/api/ai_advisor/stream', methods=['GET', 'POST'])
+@jwt_required()
+@rate_limiter.limit("ai", identity="jwt")
+def api_ai_advisor_stream():
+    """Streams advice as Server-Sent Events: 'chunk' events with Markdown text, then 'done' or 'error'."""
+    user_id = get_jwt_identity()
+    if not gemini_settings()["api_key"]:
         return jsonify({'error': 'AI Financial Advisor not configured. Please update your Key in your .env file.'}), 500
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": 0.7,
-            "topK": 40,
-            "topP": 0.95,
-            "maxOutputTokens": 2048,
-        }
-    }
-    try:
-        import requests
-        import markdown
-        response = requests.post(api_url, headers={'Content-Type': 'application/json'}, data=json.dumps(payload))
-        response.raise_for_status()
-        result = response.json()
-        if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
-            ai_text_response = result['candidates'][0]['content']['parts'][0]['text']
-            # Return as markdown/plain text for mobile
-            return jsonify({'advice': ai_text_response})
-        else:
-            return jsonify({'error': 'AI did not generate a valid response.'}), 500
-    except Exception as e:
-        return jsonify({'error': f'Failed to get AI advice: {e}'}), 500
+    prompt = build_ai_prompt(get_financial_metrics(user_id))
+    return advice_event_stream(prompt)
 
 
+@app.route('/api/ai_advisor/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def api_ai_advisor_job(job_id):
+    """Status of an advisor job; 'advice' holds the Markdown once status is 'done'."""
+    job = advisor_jobs.get(job_id, get_jwt_identity())
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify({'job_id': job["id"], 'status': job["status"], 'advice': job["advice"], 'error': job["error"]})
+
 
 @app.route('/api/settings', methods=['GET', 'PUT'])
 @jwt_required()
+@etag_conditional(db)
 def api_settings():
     user_id = get_jwt_identity()
     if request.method == 'GET':
@@ -2085,6 +2102,8 @@ def api_settings():
                 """),
                 {"user_id": user_id, "key": key, "value": value}
             )
+        # Settings such as savings_goal show up in the dashboard payload
+        bump_data_version(db, user_id)
         db.session.commit()
         return jsonify({'msg': 'Settings updated'})
 
@@ -2121,11 +2140,11 @@ def api_change_password():
     if not current_password or not new_password:
         return jsonify({'msg': 'Current and new password are required.'}), 400
     user_row = execute_query_helper(db, "SELECT password_hash FROM users WHERE id = :user_id", {"user_id": user_id}, fetch_one=True)
-    if not user_row or not check_password_hash(user_row["password_hash"], current_password):
+    if not user_row or not password_hasher.check(user_row["password_hash"], current_password):
         return jsonify({'msg': 'Invalid current password.'}), 403
     if len(new_password) < 6:
         return jsonify({'msg': 'New password must be at least 6 characters.'}), 400
-    new_password_hash = generate_password_hash(new_password)
+    new_password_hash = password_hasher.generate(new_password)
     db.session.execute(text("""
         UPDATE users SET password_hash = :new_password_hash WHERE id = :user_id
     """), {"new_password_hash": new_password_hash, "user_id": user_id})
@@ -2140,18 +2159,25 @@ def api_delete_account():
     data = request.get_json() or {}
     password = data.get('password')
     user_row = execute_query_helper(db, "SELECT password_hash FROM users WHERE id = :user_id", {"user_id": user_id}, fetch_one=True)
-    if not user_row or not check_password_hash(user_row["password_hash"], password):
+    if not user_row or not password_hasher.check(user_row["password_hash"], password):
         return jsonify({'msg': 'Invalid password.'}), 403
     try:
         db.session.execute(text("DELETE FROM budget WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM savings WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM expenses WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM income WHERE user_id = :user_id"), {"user_id": user_id})
+        db.session.execute(text("DELETE FROM monthly_rollup WHERE user_id = :user_id"), {"user_id": user_id})
+        db.session.execute(text("DELETE FROM sync_tombstones WHERE user_id = :user_id"), {"user_id": user_id})
+        db.session.execute(text("DELETE FROM user_change_seq WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM debt WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM read_user_alerts WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM user_settings WHERE user_id = :user_id"), {"user_id": user_id})
+        db.session.execute(text("DELETE FROM advisor_jobs WHERE user_id = :user_id"), {"user_id": user_id})
+        db.session.execute(text("DELETE FROM user_alert_state WHERE user_id = :user_id"), {"user_id": user_id})
+        db.session.execute(text("DELETE FROM user_data_version WHERE user_id = :user_id"), {"user_id": user_id})
         db.session.execute(text("DELETE FROM users WHERE id = :user_id"), {"user_id": user_id})
         db.session.commit()
+        metrics_cache.invalidate(user_id)
         return jsonify({'msg': 'Account deleted successfully.'})
     except Exception as e:
         db.session.rollback()
@@ -2159,6 +2185,8 @@ def api_delete_account():
 
 @app.route('/api/dashboard', methods=['GET'])
 @jwt_required()
+@rate_limiter.limit("read", identity="jwt")
+@etag_conditional(db)
 def api_dashboard_full():
     user_id = get_jwt_identity()
     selected_month = request.args.get('month')
@@ -2166,82 +2194,36 @@ def api_dashboard_full():
         selected_month = datetime.now().strftime('%Y-%m')
     selected_month_display = datetime.strptime(selected_month, '%Y-%m').strftime('%B %Y')
 
-    # --- Current Month Data (as before) ---
-    income_items = execute_query_helper(db, """
-        SELECT amount
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-    total_income = sum(float(item['amount']) for item in income_items) if income_items else 0.0
-
-    expenses_items = execute_query_helper(db, """
-        SELECT amount
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-    total_expenses = sum(float(item['amount']) for item in expenses_items) if expenses_items else 0.0
-
-    budget_items_monthly = execute_query_helper(db, """
-        SELECT amount
-        FROM budget
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-    total_budget = sum(float(item['amount']) for item in budget_items_monthly) if budget_items_monthly else 0.0
-
-    savings_items = execute_query_helper(db, """
-        SELECT amount
-        FROM savings
-        WHERE user_id = :user_id
-    """, {"user_id": user_id})
-    total_savings = sum(float(item['amount']) for item in savings_items) if savings_items else 0.0
-
-    net_balance = total_income - total_expenses
+    # --- Current Month Data (one grouped query, shared with the web dashboard) ---
+    dashboard_data = _get_dashboard_data(db, user_id, selected_month)
 
     # --- Top Income Sources (current month) ---
-    top_income_sources = execute_query_helper(db, """
-        SELECT source, SUM(amount) AS amount
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY source
-        ORDER BY amount DESC
-        LIMIT 3
-    """, {"user_id": user_id, "selected_month": selected_month})
-    top_income_sources = [{"source": row["source"], "amount": float(row["amount"])} for row in top_income_sources] if top_income_sources else []
+    top_income_sources = [
+        {"source": source, "amount": amount}
+        for source, amount in sorted(dashboard_data["income_by_source"].items(), key=lambda item: item[1], reverse=True)[:3]
+    ]
 
     # --- Top Expense Categories (current month) ---
-    top_expense_categories = execute_query_helper(db, """
-        SELECT category, SUM(amount) AS amount
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY category
-        ORDER BY amount DESC
-        LIMIT 3
-    """, {"user_id": user_id, "selected_month": selected_month})
-    top_expense_categories = [{"category": row["category"], "amount": float(row["amount"])} for row in top_expense_categories] if top_expense_categories else []
+    top_expense_categories = [
+        {"category": category, "amount": amount}
+        for category, amount in sorted(dashboard_data["spent_by_category"].items(), key=lambda item: item[1], reverse=True)[:3]
+    ]
 
     # --- Last Month Data ---
     last_month_dt = datetime.strptime(selected_month, '%Y-%m') - timedelta(days=1)
     last_month = last_month_dt.strftime('%Y-%m')
-    last_month_income_items = execute_query_helper(db, """
-        SELECT amount
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :last_month
-    """, {"user_id": user_id, "last_month": last_month})
-    last_month_income = sum(float(item['amount']) for item in last_month_income_items) if last_month_income_items else 0.0
-
-    last_month_expenses_items = execute_query_helper(db, """
-        SELECT amount
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :last_month
-    """, {"user_id": user_id, "last_month": last_month})
-    last_month_expenses = sum(float(item['amount']) for item in last_month_expenses_items) if last_month_expenses_items else 0.0
-
-    last_month_savings_items = execute_query_helper(db, """
-        SELECT amount
-        FROM savings
-        WHERE user_id = :user_id
-    """, {"user_id": user_id})
-    last_month_savings = sum(float(item['amount']) for item in last_month_savings_items) if last_month_savings_items else 0.0
+    last_month_totals = execute_query_helper(db, """
+        SELECT kind, SUM(total) AS total
+        FROM monthly_rollup
+        WHERE user_id = :user_id AND month = :month AND kind IN ('income', 'expense')
+        GROUP BY kind
+    """, {"user_id": user_id, "month": month_range(last_month)[0]})
+    last_month_by_kind = {row['kind']: float(row['total']) for row in last_month_totals}
+    last_month_income = last_month_by_kind.get('income', 0.0)
+    last_month_expenses = last_month_by_kind.get('expense', 0.0)
+
+    # Savings have no date column, so last month's savings are the current total
+    last_month_savings = dashboard_data["total_savings"]
 
     last_month_net_balance = last_month_income - last_month_expenses
 
@@ -2251,119 +2233,6 @@ def api_dashboard_full():
     """, {"user_id": user_id}, fetch_one=True)
     savings_goal = float(savings_goal_row['value']) if savings_goal_row and savings_goal_row['value'] is not None else 0.0
 
-    # 6. Budget vs. Actual Spending per Category (Filtered by selected_month for *expenses*)
-    budget_vs_actual = {}
-
-    relevant_expense_categories = execute_query_helper(db, """
-        SELECT DISTINCT category
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    if not relevant_expense_categories:
-        budget_bar_labels = []
-        budgeted_data = []
-        spent_data = []
-    else:
-        for cat_entry in relevant_expense_categories:
-            category = cat_entry['category']
-
-            budgeted_amount_result = execute_query_helper(db, """
-                SELECT amount FROM budget
-                WHERE user_id = :user_id AND category = :category AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-            """, {"user_id": user_id, "category": category, "selected_month": selected_month}, fetch_one=True)
-            budgeted_amount = float(budgeted_amount_result['amount']) if budgeted_amount_result and budgeted_amount_result['amount'] is not None else 0.0
-
-            spent_amount_result = execute_query_helper(db, """
-                SELECT SUM(amount) AS spent FROM expenses
-                WHERE user_id = :user_id AND category = :category AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-            """, {"user_id": user_id, "category": category, "selected_month": selected_month}, fetch_one=True)
-            spent_amount = float(spent_amount_result['spent']) if spent_amount_result and spent_amount_result['spent'] is not None else 0.0
-
-            budget_vs_actual[category] = {
-                "budgeted": budgeted_amount,
-                "spent": spent_amount,
-                "remaining": budgeted_amount - spent_amount
-            }
-
-        budget_bar_labels = list(budget_vs_actual.keys())
-        budgeted_data = [d['budgeted'] for d in budget_vs_actual.values()]
-        spent_data = [d['spent'] for d in budget_vs_actual.values()]
-
-    # 7. Top Spending Categories (for Pie Chart) (Filtered by selected_month)
-    top_expenses_by_category = execute_query_helper(db, """
-        SELECT category, SUM(amount) AS total_spent
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY category
-        ORDER BY total_spent DESC
-        LIMIT 5
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    pie_chart_labels = [item['category'] for item in top_expenses_by_category]
-    pie_chart_data = [float(item['total_spent']) for item in top_expenses_by_category] # Ensure float
-
-    # 8. Daily Income vs. Expenses (for Line Chart) for the selected month
-    daily_income_raw = execute_query_helper(db, """
-        SELECT
-            TO_CHAR(date, 'YYYY-MM-DD') AS day,
-            SUM(amount) AS total_income
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY day
-        ORDER BY day
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    daily_expenses_raw = execute_query_helper(db, """
-        SELECT
-            TO_CHAR(date, 'YYYY-MM-DD') AS day,
-            SUM(amount) AS total_expenses
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-        GROUP BY day
-        ORDER BY day
-    """, {"user_id": user_id, "selected_month": selected_month})
-
-    monthly_income_total_result = execute_query_helper(db, """
-        SELECT SUM(amount) AS total
-        FROM income
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month}, fetch_one=True)
-    monthly_income_total = float(monthly_income_total_result['total']) if monthly_income_total_result and monthly_income_total_result['total'] is not None else 0.0
-
-    monthly_expenses_total_result = execute_query_helper(db, """
-        SELECT SUM(amount) AS total
-        FROM expenses
-        WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :selected_month
-    """, {"user_id": user_id, "selected_month": selected_month}, fetch_one=True)
-    monthly_expenses_total = float(monthly_expenses_total_result['total']) if monthly_expenses_total_result and monthly_expenses_total_result['total'] is not None else 0.0
-
-    daily_data = {}
-    year, month = map(int, selected_month.split('-'))
-    num_days_in_month = calendar.monthrange(year, month)[1]
-    first_day_of_selected_month = datetime(year, month, 1)
-
-    for i in range(num_days_in_month):
-        current_day = first_day_of_selected_month + timedelta(days=i)
-        formatted_date = current_day.strftime('%Y-%m-%d')
-        daily_data[formatted_date] = {'income': 0.0, 'expenses': 0.0}
-
-    for row in daily_income_raw:
-        daily_data[row['day']]['income'] = float(row['total_income'])
-    for row in daily_expenses_raw:
-        daily_data[row['day']]['expenses'] = float(row['total_expenses'])
-
-    sorted_days = sorted(daily_data.keys())
-    line_chart_labels = []
-    line_chart_income_data = []
-    line_chart_expenses_data = []
-
-    for day in sorted_days:
-        line_chart_labels.append(datetime.strptime(
-            day, '%Y-%m-%d').strftime('%b %d'))
-        line_chart_income_data.append(daily_data[day]['income'])
-        line_chart_expenses_data.append(daily_data[day]['expenses'])
-
     # Generate available months (last 12 months, as yyyy-MM)
     available_months = []
     current_date = datetime.now()
@@ -2379,11 +2248,11 @@ def api_dashboard_full():
     available_months.reverse()
 
     return jsonify({
-        'total_income': total_income,
-        'total_expenses': total_expenses,
-        'total_budget': total_budget,
-        'total_savings': total_savings,
-        'net_balance': net_balance,
+        'total_income': dashboard_data["total_income"],
+        'total_expenses': dashboard_data["total_expenses"],
+        'total_budget': dashboard_data["total_budget"],
+        'total_savings': dashboard_data["total_savings"],
+        'net_balance': dashboard_data["net_balance"],
         'top_income_sources': top_income_sources,
         'top_expense_categories': top_expense_categories,
         'last_month_income': last_month_income,
@@ -2391,27 +2260,69 @@ def api_dashboard_full():
         'last_month_savings': last_month_savings,
         'last_month_net_balance': last_month_net_balance,
         'savings_goal': savings_goal,
-        'budget_vs_actual': budget_vs_actual,
-        'budget_bar_labels': budget_bar_labels,
-        'budgeted_data': budgeted_data,
-        'spent_data': spent_data,
-        'pie_chart_labels': pie_chart_labels,
-        'pie_chart_data': pie_chart_data,
-        'line_chart_labels': line_chart_labels,
-        'line_chart_income_data': line_chart_income_data,
-        'line_chart_expenses_data': line_chart_expenses_data,
+        'budget_vs_actual': dashboard_data["budget_vs_actual"],
+        'budget_bar_labels': dashboard_data["budget_bar_labels"],
+        'budgeted_data': dashboard_data["budgeted_data"],
+        'spent_data': dashboard_data["spent_data"],
+        'pie_chart_labels': dashboard_data["pie_chart_labels"],
+        'pie_chart_data': dashboard_data["pie_chart_data"],
+        'line_chart_labels': dashboard_data["line_chart_labels"],
+        'line_chart_income_data': dashboard_data["line_chart_income_data"],
+        'line_chart_expenses_data': dashboard_data["line_chart_expenses_data"],
         'selected_month': selected_month,
         'selected_month_display': selected_month_display,
-        'monthly_income_total': monthly_income_total,
-        'monthly_expenses_total': monthly_expenses_total,
+        'monthly_income_total': dashboard_data["monthly_income_total"],
+        'monthly_expenses_total': dashboard_data["monthly_expenses_total"],
         'available_months': available_months
     })
 
+@app.route('/api/sync', methods=['GET'])
+@jwt_required()
+@rate_limiter.limit("read", identity="jwt")
+@etag_conditional(db)
+def api_sync():
+    """
+    Income, expenses, budget, savings and debt rows written or deleted after
+    ?since=<next_since of the previous call>. Without 'since' the whole ledger
+    comes back with reset=true. ?limit= caps the changes per page (see has_more).
+    """
+    user_id = get_jwt_identity()
+    try:
+        since = int(request.args['since']) if request.args.get('since') else None
+        limit = int(request.args.get('limit', DEFAULT_SYNC_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'msg': 'since and limit must be integers'}), 400
+    if since is not None and since < 0:
+        return jsonify({'msg': 'since must not be negative'}), 400
+    return jsonify(changes_since(db, user_id, since, max(1, min(limit, MAX_SYNC_PAGE_SIZE))))
+
+
+@app.route('/api/trends', methods=['GET'])
+@jwt_required()
+@rate_limiter.limit("read", identity="jwt")
+@etag_conditional(db)
+def api_trends():
+    """
+    Monthly income/expense series up to ?month=YYYY-MM (default: last complete month)
+    over ?months= of history, with rolling averages, month-over-month deltas per
+    category and a forecast of the next month.
+    """
+    user_id = get_jwt_identity()
+    try:
+        end_month = datetime.strptime(request.args['month'], '%Y-%m').date() if request.args.get('month') else last_complete_month()
+        history_months = int(request.args.get('months', TREND_HISTORY_MONTHS))
+    except ValueError:
+        return jsonify({"msg": "month must be YYYY-MM and months a number"}), 400
+    history_months = max(max(ROLLING_WINDOWS), min(history_months, MAX_TREND_HISTORY_MONTHS))
+    frame = load_ledger_frame(db, user_id)
+    return jsonify(spending_trends(frame, end_month, history_months))
+
 @app.route('/api/financial_health', methods=['GET'])
 @jwt_required()
+@etag_conditional(db)
 def api_financial_health():
     user_id = get_jwt_identity()
-    financial_data = _get_all_financial_metrics(db, user_id)
+    financial_data = get_financial_metrics(user_id)
     return jsonify({
         'savings_goals': financial_data["savings_goals"],
         'net_worth': financial_data["total_assets"] - financial_data["total_liabilities"],
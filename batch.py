@@ -0,0 +1,163 @@
+from ledger import LEDGER_TABLES, validate_row, change_seq, insert_entries, update_entries, delete_entries
+
+
+# Batched ledger writes for the JSON API (/api/batch).
+# A client replaying queued edits sends them as one ordered list. Runs of
+# consecutive operations of the same kind on the same table are applied with
+# one multi-row statement each (see ledger.insert_entries/update_entries/
+# delete_entries), and the whole batch is committed once.
+
+MAX_BATCH_OPERATIONS = 1000
+
+BATCH_OPS = ("create", "update", "delete")
+
+# Entity names accepted in operations: the table names and the API collection names
+BATCH_ENTITIES = {**{table: table for table in LEDGER_TABLES}, "budgets": "budget"}
+
+
+def _error(index, message, code=400):
+    return {"index": index, "status": "error", "code": code, "error": message}
+
+
+def parse_operation(operation):
+    """Checks one operation and validates its data. Returns (op, table, id, values); raises ValueError."""
+    if not isinstance(operation, dict):
+        raise ValueError("Operation must be an object")
+    op = operation.get("op")
+    if op not in BATCH_OPS:
+        raise ValueError(f"op must be one of: {', '.join(BATCH_OPS)}")
+    table = BATCH_ENTITIES.get(operation.get("entity"))
+    if table is None:
+        raise ValueError(f"entity must be one of: {', '.join(BATCH_ENTITIES)}")
+
+    item_id = None
+    if op != "create":
+        item_id = operation.get("id")
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            raise ValueError("id must be an integer")
+    values = None
+    if op != "delete":
+        data = operation.get("data")
+        if not isinstance(data, dict):
+            raise ValueError("data must be an object")
+        values = validate_row(table, data)
+    return op, table, item_id, values
+
+
+def _groups(operations):
+    """
+    Splits the parsed operations into runs of the same op on the same table,
+    keeping their order. A run never holds the same id twice, so each run can
+    be a single statement.
+    """
+    group, ids = [], set()
+    for operation in operations:
+        index, op, table, item_id, values = operation
+        if group and ((op, table) != group[0][1:3] or item_id in ids):
+            yield group
+            group, ids = [], set()
+        group.append(operation)
+        if item_id is not None:
+            ids.add(item_id)
+    if group:
+        yield group
+
+
+def _apply_group(db_instance, user_id, group):
+    """Runs one group as a single statement. Returns a result per operation."""
+    op, table = group[0][1], group[0][2]
+    if op == "create":
+        ids = insert_entries(db_instance, table, user_id, [values for _, _, _, _, values in group])
+        return [{"index": index, "status": "created", "id": new_id}
+                for (index, *_), new_id in zip(group, ids)]
+
+    if op == "update":
+        done = update_entries(db_instance, table, user_id, [(item_id, values) for _, _, _, item_id, values in group])
+        status = "updated"
+    else:
+        done = delete_entries(db_instance, table, user_id, [item_id for _, _, _, item_id, _ in group])
+        status = "deleted"
+    return [
+        {"index": index, "status": status, "id": item_id} if item_id in done
+        else _error(index, f"{table} item {item_id} not found", 404)
+        for index, _, _, item_id, _ in group
+    ]
+
+
+def apply_batch(db_instance, user_id, operations, atomic=False):
+    """
+    Validates and applies an ordered list of operations
+    ({"op": "create"|"update"|"delete", "entity": ..., "id": ..., "data": {...}})
+    and commits. Returns (results, applied): one result per operation, in order.
+
+    Without 'atomic', every valid operation is applied even if others fail; a
+    group whose statement fails is retried one operation at a time in savepoints
+    so only the offending operations are reported. With 'atomic', the first
+    failure rolls everything back, and the other operations are reported as
+    'not_applied'. 'applied' is False only when an atomic batch was rolled back.
+    Raises ValueError when the list itself is unusable.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+
+    user_id = int(user_id)
+    results = [None] * len(operations)
+    parsed = []
+    for index, operation in enumerate(operations):
+        try:
+            parsed.append((index, *parse_operation(operation)))
+        except ValueError as e:
+            results[index] = _error(index, str(e))
+
+    if atomic and len(parsed) < len(operations):
+        return _not_applied(results), False
+    if not parsed:
+        return results, True
+
+    # Taken before any savepoint, so a group rolled back to its savepoint leaves
+    # the number (and the writes already recorded for the commit listeners) alone
+    change_seq(db_instance, user_id)
+    for group in _groups(parsed):
+        if atomic:
+            try:
+                group_results = _apply_group(db_instance, user_id, group)
+            except Exception as e:
+                db_instance.session.rollback()
+                print(f"Warning: batch write failed for user {user_id}: {e}")
+                for index, *_ in group:
+                    results[index] = _error(index, "Database error", 500)
+                return _not_applied(results), False
+            for result in group_results:
+                results[result["index"]] = result
+            if any(result["status"] == "error" for result in group_results):
+                db_instance.session.rollback()
+                return _not_applied(results), False
+            continue
+
+        try:
+            with db_instance.session.begin_nested():
+                group_results = _apply_group(db_instance, user_id, group)
+        except Exception as e:
+            print(f"Warning: batch group failed for user {user_id}, retrying one by one: {e}")
+            group_results = []
+            for operation in group:
+                try:
+                    with db_instance.session.begin_nested():
+                        group_results.extend(_apply_group(db_instance, user_id, [operation]))
+                except Exception as e:
+                    print(f"Warning: batch operation {operation[0]} failed for user {user_id}: {e}")
+                    group_results.append(_error(operation[0], "Database error", 500))
+        for result in group_results:
+            results[result["index"]] = result
+
+    db_instance.session.commit()
+    return results, True
+
+
+def _not_applied(results):
+    """Marks every operation without an error as not applied (the atomic batch was rolled back)."""
+    return [result if result is not None and result["status"] == "error"
+            else {"index": index, "status": "not_applied"}
+            for index, result in enumerate(results)]
@@ -0,0 +1,14 @@
+"""
+Benchmarks for CashCompass.
+
+    ledger_generator.py  synthetic users with 1k to 1M ledger transactions
+    microbench.py        dashboard, metrics and alert helpers called directly
+    load_test.py         HTTP load on the web pages and JSON APIs
+    analytics_bench.py   vectorised metrics (analytics.py) vs. the Python loop, offline
+    login_storm.py       dashboard latency while /api/login is flooded
+    session_backends.py  request latency of the session backends
+
+Run them from the repository root, e.g. `python benchmarks/microbench.py`.
+microbench.py and load_test.py take --save-baseline/--baseline to record
+results and flag regressions against them (see stats.py).
+"""
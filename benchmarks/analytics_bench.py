@@ -0,0 +1,117 @@
+"""
+Vectorised metrics (analytics.LedgerFrame) against the previous Python loop.
+
+Runs offline on synthetic data: --rows ledger transactions (100k by default)
+made by ledger_generator.py are aggregated by both implementations, once as
+raw ledger rows and once as the monthly_rollup rows the app actually reads.
+The Python loop gets Decimal totals (what psycopg2 returns for NUMERIC); the
+frame gets floats (load_ledger_frame casts in SQL).
+
+    python benchmarks/analytics_bench.py --rows 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import LedgerFrame, month_ordinal, ordinal_to_month
+from benchmarks.ledger_generator import TABLE_MIX, ledger_rows
+from benchmarks.stats import print_table, summarize
+
+KIND_BY_TABLE = {"income": "income", "expenses": "expense", "budget": "budget"}
+
+
+def python_aggregates(rows, current_month_start):
+    """The loop _get_all_financial_metrics ran before analytics.py."""
+    all_total_income = 0.0
+    all_total_expenses = 0.0
+    expense_months = set()
+    budget_vs_actual = {}
+    for row in rows:
+        amount = float(row['total'])
+        if row['kind'] == 'income':
+            all_total_income += amount
+        elif row['kind'] == 'expense':
+            all_total_expenses += amount
+            expense_months.add(row['month'])
+        if row['month'] == current_month_start and row['kind'] in ('budget', 'expense'):
+            category = row['label']
+            if category not in budget_vs_actual:
+                budget_vs_actual[category] = {'budgeted': 0.0, 'spent': 0.0, 'remaining': 0.0}
+            if row['kind'] == 'budget':
+                budget_vs_actual[category]['budgeted'] += amount
+            else:
+                budget_vs_actual[category]['spent'] += amount
+    for category in budget_vs_actual:
+        budget_vs_actual[category]['remaining'] = budget_vs_actual[category]['budgeted'] - budget_vs_actual[category]['spent']
+    return all_total_income, all_total_expenses, len(expense_months), budget_vs_actual
+
+
+def frame_aggregates(rows, current_month_start):
+    frame = LedgerFrame.from_rows(rows)
+    return (frame.total('income'), frame.total('expense'), frame.distinct_months('expense'),
+            frame.budget_vs_actual(current_month_start))
+
+
+def synthetic_rows(count, months, seed):
+    """Raw ledger rows as (month, kind, label, total) and the equivalent monthly_rollup rows."""
+    rng = random.Random(seed)
+    raw = []
+    for table, share in TABLE_MIX:
+        label_column = "source" if table == "income" else "category"
+        for row in ledger_rows(rng, table, int(count * share), months):
+            entry_date = date.fromisoformat(row["date"])
+            raw.append((month_ordinal(entry_date), KIND_BY_TABLE[table], row[label_column], row["amount"]))
+
+    rollup = defaultdict(float)
+    for month, kind, label, amount in raw:
+        rollup[(month, kind, label)] += amount
+    return raw, [(month, kind, label, total) for (month, kind, label), total in rollup.items()]
+
+
+def time_call(call, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    current_month_start = date.today().replace(day=1)
+    raw, rollup = synthetic_rows(args.rows, args.months, args.seed)
+
+    results = {}
+    for shape, rows in ((f"raw ledger ({len(raw)} rows)", raw), (f"monthly_rollup ({len(rollup)} rows)", rollup)):
+        as_dicts = [{"month": ordinal_to_month(m), "kind": k, "label": l, "total": Decimal(str(round(t, 2)))} for m, k, l, t in rows]
+        expected = python_aggregates(as_dicts, current_month_start)
+        actual = frame_aggregates(rows, current_month_start)
+        assert abs(expected[0] - actual[0]) < 0.01 and abs(expected[1] - actual[1]) < 0.01 and expected[2] == actual[2]
+        assert expected[3].keys() == actual[3].keys()
+
+        results[f"python loop, {shape}"] = time_call(lambda: python_aggregates(as_dicts, current_month_start), args.iterations)
+        results[f"LedgerFrame, {shape}"] = time_call(lambda: frame_aggregates(rows, current_month_start), args.iterations)
+        # The frame is built once per request and shared by the metrics and trends
+        frame = LedgerFrame.from_rows(rows)
+        results[f"  aggregates only, {shape}"] = time_call(
+            lambda: (frame.total('income'), frame.total('expense'), frame.distinct_months('expense'),
+                     frame.budget_vs_actual(current_month_start)), args.iterations)
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
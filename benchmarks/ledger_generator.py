@@ -0,0 +1,195 @@
+"""
+Synthetic ledger generator for the benchmarks.
+
+Creates benchmark users with a chosen number of ledger transactions each
+(income, expenses and budget rows spread over the last --months months, plus
+a few savings goals and debts), all with the password given by --password.
+
+    python benchmarks/ledger_generator.py --sizes 1000 100000 1000000
+    python benchmarks/ledger_generator.py --database-url sqlite:///bench.db --sizes 10000
+
+PostgreSQL (DATABASE_URL by default) is expected to have the app's tables
+already; monthly_rollup is rebuilt for the generated users so the dashboard
+reads them like real data. With a sqlite:/// URL the base tables are created
+in that file, which can then be loaded into PostgreSQL with migrate_data.py
+(followed by `flask rebuild-rollups`).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from werkzeug.security import generate_password_hash
+
+from ledger import LEDGER_TABLES, ROLLUP_REBUILD_SQL
+
+load_dotenv()
+
+USERNAME_PREFIX = "bench_user_"
+DEFAULT_PASSWORD = "benchmark"
+INSERT_CHUNK = 10000
+
+INCOME_SOURCES = ["Salary", "Freelance", "Dividends", "Rental", "Bonus", "Refund"]
+EXPENSE_CATEGORIES = [
+    "Rent", "Groceries", "Utilities", "Transport", "Dining", "Entertainment",
+    "Healthcare", "Insurance", "Shopping", "Travel", "Education", "Subscriptions",
+]
+# Share of each user's transactions going to income / expenses / budget
+TABLE_MIX = (("income", 0.10), ("expenses", 0.85), ("budget", 0.05))
+
+# Base tables for SQLite files (PostgreSQL tables are created by hand, see README)
+SQLITE_DDL = [
+    """CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE,
+       password_hash TEXT NOT NULL, email TEXT UNIQUE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE IF NOT EXISTS income (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+       source TEXT, amount NUMERIC NOT NULL, date DATE NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS expenses (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+       category TEXT, amount NUMERIC NOT NULL, date DATE NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS budget (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+       category TEXT, amount NUMERIC NOT NULL, date DATE NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS savings (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+       goal TEXT NOT NULL, amount NUMERIC NOT NULL DEFAULT 0, date DATE, target_amount NUMERIC)""",
+    """CREATE TABLE IF NOT EXISTS debt (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+       debt_name TEXT NOT NULL, debt_type TEXT, current_balance NUMERIC NOT NULL, due_date DATE)""",
+]
+
+# Tables holding per-user rows, cleared by --reset (the support tables only exist in PostgreSQL)
+USER_TABLES = ["income", "expenses", "budget", "savings", "debt"]
+POSTGRES_USER_TABLES = ["monthly_rollup", "user_alert_state", "user_data_version", "read_user_alerts", "advisor_jobs"]
+
+
+def ledger_rows(rng, table, count, months):
+    """Yields 'count' random rows for a dated ledger table over the last 'months' months."""
+    label_column = LEDGER_TABLES[table]["label"]
+    today = date.today()
+    span_days = months * 30
+    for _ in range(count):
+        if table == "income":
+            label = rng.choice(INCOME_SOURCES)
+            amount = round(rng.lognormvariate(7.5, 0.6), 2)
+        else:
+            label = rng.choice(EXPENSE_CATEGORIES)
+            amount = round(rng.lognormvariate(4.0, 1.0), 2)
+        if table == "budget":
+            amount = round(amount * 10, 2)
+        entry_date = today - timedelta(days=rng.randrange(span_days))
+        yield {label_column: label, "amount": amount, "date": entry_date.isoformat()}
+
+
+def insert_rows(conn, table, user_id, rows):
+    """Inserts rows (dicts with the same keys) in INSERT_CHUNK sized executemany batches."""
+    inserted = 0
+    batch = []
+    statement = None
+    for row in rows:
+        row["user_id"] = user_id
+        if statement is None:
+            columns = list(row)
+            statement = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            conn.execute(statement, batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        conn.execute(statement, batch)
+        inserted += len(batch)
+    return inserted
+
+
+def reset_users(conn, prefix, is_postgres):
+    user_ids = [row[0] for row in conn.execute(
+        text("SELECT id FROM users WHERE username LIKE :pattern"), {"pattern": prefix + "%"})]
+    if not user_ids:
+        return 0
+    tables = USER_TABLES + (POSTGRES_USER_TABLES if is_postgres else [])
+    for table in tables:
+        conn.execute(text(f"DELETE FROM {table} WHERE user_id IN ({', '.join(map(str, user_ids))})"))
+    conn.execute(text(f"DELETE FROM users WHERE id IN ({', '.join(map(str, user_ids))})"))
+    return len(user_ids)
+
+
+def generate_user(conn, rng, username, password_hash, transactions, months):
+    """Creates one user with 'transactions' ledger rows. Returns the new user id."""
+    conn.execute(text("INSERT INTO users (username, password_hash, email) VALUES (:username, :password_hash, :email)"),
+                 {"username": username, "password_hash": password_hash, "email": f"{username}@example.com"})
+    user_id = conn.execute(text("SELECT id FROM users WHERE username = :username"), {"username": username}).scalar()
+
+    for table, share in TABLE_MIX:
+        insert_rows(conn, table, user_id, ledger_rows(rng, table, max(1, int(transactions * share)), months))
+    insert_rows(conn, "savings", user_id, (
+        {"goal": goal, "amount": round(rng.uniform(100, 20000), 2), "target_amount": round(rng.uniform(5000, 50000), 2)}
+        for goal in ("Emergency Fund", "Vacation", "House Deposit")
+    ))
+    insert_rows(conn, "debt", user_id, (
+        {"debt_name": name, "debt_type": debt_type, "current_balance": round(rng.uniform(500, 30000), 2),
+         "due_date": (date.today() + timedelta(days=rng.randrange(1, 60))).isoformat()}
+        for name, debt_type in (("Credit Card", "credit_card"), ("Car Loan", "auto_loan"))
+    ))
+    return user_id
+
+
+def rebuild_rollups(conn, user_ids):
+    """monthly_rollup for the generated users (PostgreSQL only; SQL shared with ledger.py)."""
+    for table, spec in LEDGER_TABLES.items():
+        if spec["kind"] is None:
+            continue
+        conn.execute(text(ROLLUP_REBUILD_SQL.format(table=table, label=spec["label"], user_filter="user_id = ANY(:user_ids)")),
+                     {"kind": spec["kind"], "user_ids": user_ids})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="SQLAlchemy URL (default: DATABASE_URL); sqlite:///file.db for a SQLite file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000],
+                        help="Transactions per user; one set of users is created per size")
+    parser.add_argument("--users-per-size", type=int, default=1)
+    parser.add_argument("--months", type=int, default=24, help="History length the transactions are spread over")
+    parser.add_argument("--prefix", default=USERNAME_PREFIX, help="Username prefix of the generated users")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="Delete previously generated users with this prefix first")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("no database: pass --database-url or set DATABASE_URL")
+
+    engine = create_engine(args.database_url)
+    is_postgres = engine.dialect.name == "postgresql"
+    rng = random.Random(args.seed)
+    # One hash for every generated user; hashing per user would dominate small runs
+    password_hash = generate_password_hash(args.password)
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            for statement in SQLITE_DDL:
+                conn.execute(text(statement))
+        if args.reset:
+            print(f"Removed {reset_users(conn, args.prefix, is_postgres)} existing benchmark users.")
+
+    user_ids = []
+    for size in args.sizes:
+        for n in range(args.users_per_size):
+            username = f"{args.prefix}{size}_{n}"
+            started = time.perf_counter()
+            with engine.begin() as conn:
+                user_ids.append(generate_user(conn, rng, username, password_hash, size, args.months))
+            elapsed = time.perf_counter() - started
+            print(f"{username}: {size} transactions in {elapsed:.1f}s ({size / elapsed:,.0f} rows/s)")
+
+    if is_postgres:
+        with engine.begin() as conn:
+            rebuild_rollups(conn, user_ids)
+        print("monthly_rollup rebuilt for the generated users.")
+    print(f"Done. Log in as {args.prefix}<size>_<n> with password '{args.password}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+HTTP load test of the main web pages and JSON APIs.
+
+Each virtual user logs in as one of the users made by ledger_generator.py,
+through the web form or /api/login, then requests its scenario's routes in a
+loop. Reports p50/p95/p99 per route and, when the server runs with
+QUERY_PROFILER=true, SQL statements per request (read from Server-Timing).
+
+Every client logs in from one address and the virtual users share a few
+accounts, so the server's rate limiter (rate_limit.py) must be off: a 429 stops
+the run instead of being measured.
+
+    RATE_LIMIT_BACKEND=none gunicorn app:app --worker-class gthread --threads 8 &
+    python benchmarks/load_test.py --base-url http://localhost:8000 --concurrency 16 --duration 60
+    python benchmarks/load_test.py --baseline benchmarks/baseline_http.json
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from benchmarks.ledger_generator import DEFAULT_PASSWORD, USERNAME_PREFIX
+from benchmarks.stats import add_baseline_arguments, report, summarize
+
+# Routes per scenario; "web" uses the session cookie, "api" a JWT bearer token
+SCENARIOS = {
+    "web": ["/", "/api/financial_alerts_data", "/income", "/expenses"],
+    "api": ["/api/dashboard", "/api/financial_health", "/api/income?limit=100", "/api/expenses?limit=100"],
+}
+
+_SERVER_TIMING_STATEMENTS = re.compile(r'db;[^,]*desc="(\d+) statements"')
+
+RATE_LIMITED_MESSAGE = (
+    "{what} got HTTP 429 from the server's rate limiter. Benchmarks log in many clients "
+    "from one address as the same users: start the server with RATE_LIMIT_BACKEND=none "
+    "(or RATE_LIMIT_AUTH=off RATE_LIMIT_READ=off)."
+)
+
+
+def log_in(base_url, scenario, username, password):
+    """A requests.Session authenticated for the scenario."""
+    client = requests.Session()
+    if scenario == "web":
+        response = client.post(f"{base_url}/login", data={"username": username, "password": password},
+                               allow_redirects=False)
+        if response.status_code == 429:
+            raise SystemExit(RATE_LIMITED_MESSAGE.format(what=f"web login for {username}"))
+        if response.status_code != 302:
+            raise RuntimeError(f"web login failed for {username}: HTTP {response.status_code}")
+    else:
+        response = client.post(f"{base_url}/api/login", json={"username": username, "password": password})
+        if response.status_code == 429:
+            raise SystemExit(RATE_LIMITED_MESSAGE.format(what=f"API login for {username}"))
+        if response.status_code != 200:
+            raise RuntimeError(f"API login failed for {username}: HTTP {response.status_code}")
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    return client
+
+
+class LoadRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.queries = {}
+        self.errors = {}
+        self.rate_limited = None  # First route answered 429; the run stops there
+
+    def record(self, route, elapsed_ms, response):
+        with self._lock:
+            if response is not None and response.status_code == 429:
+                self.rate_limited = self.rate_limited or route
+                return
+            if response is None or response.status_code >= 300:  # a redirect means the login was lost
+                self.errors[route] = self.errors.get(route, 0) + 1
+                return
+            self.timings.setdefault(route, []).append(elapsed_ms)
+            match = _SERVER_TIMING_STATEMENTS.search(response.headers.get("Server-Timing", ""))
+            if match:
+                self.queries.setdefault(route, []).append(int(match.group(1)))
+
+
+def virtual_user(base_url, scenario, client, recorder, deadline):
+    routes = SCENARIOS[scenario]
+    # The dashboards read the current month, like a browser would
+    month = datetime.now().strftime('%Y-%m')
+    while time.monotonic() < deadline and not recorder.rate_limited:
+        for route in routes:
+            url = f"{base_url}{route}"
+            if route in ("/", "/api/dashboard"):
+                url += f"?month={month}"
+            started = time.perf_counter()
+            try:
+                response = client.get(url, allow_redirects=False, timeout=60)
+            except requests.exceptions.RequestException:
+                response = None
+            recorder.record(f"{scenario} {route}", (time.perf_counter() - started) * 1000, response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--users", nargs="+", help="Usernames to log in as (default: the generator's 1000-row user)")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users per scenario")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    usernames = args.users or [f"{USERNAME_PREFIX}1000_0"]
+    recorder = LoadRecorder()
+    # Logins happen up front so they are not part of the measured window
+    clients = [
+        (scenario, log_in(args.base_url, scenario, usernames[n % len(usernames)], args.password))
+        for scenario in args.scenarios
+        for n in range(args.concurrency)
+    ]
+
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=virtual_user, args=(args.base_url, scenario, client, recorder, deadline), daemon=True)
+        for scenario, client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if recorder.rate_limited:
+        sys.exit(RATE_LIMITED_MESSAGE.format(what=recorder.rate_limited))
+
+    results = {route: summarize(timings, recorder.queries.get(route)) for route, timings in sorted(recorder.timings.items())}
+    total = sum(result["count"] for result in results.values())
+    print(f"{total} requests in {args.duration:.0f}s ({total / args.duration:,.1f} req/s), "
+          f"{sum(recorder.errors.values())} errors {recorder.errors or ''}\n")
+    sys.exit(report(results, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Dashboard latency while a login storm hits the same server.
+
+Dashboard readers request /api/dashboard for the whole run. The run has two
+phases of --duration seconds each: "quiet" (dashboard readers only) and
+"storm" (the same readers plus --storm-clients clients posting /api/login
+back to back). With password hashing on its own bounded pool (see
+password_hashing.py) the dashboard p95 should barely move during the storm;
+logins over the cap come back 503 with Retry-After instead of piling up.
+
+Start the server with the rate limiter off, or the storm measures the auth
+limit (429) rather than hashing load; a 429 is backed off like a 503 and
+counted separately, and a rate-limited dashboard read stops the run.
+
+    RATE_LIMIT_BACKEND=none gunicorn app:app --worker-class gthread --threads 8 &
+    python benchmarks/login_storm.py --base-url http://localhost:8000 --storm-clients 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from benchmarks.ledger_generator import DEFAULT_PASSWORD, USERNAME_PREFIX
+from benchmarks.load_test import RATE_LIMITED_MESSAGE, LoadRecorder, log_in
+from benchmarks.stats import add_baseline_arguments, report, summarize
+
+
+def dashboard_reader(base_url, client, recorder, phase, deadline):
+    url = f"{base_url}/api/dashboard?month={datetime.now().strftime('%Y-%m')}"
+    while time.monotonic() < deadline and not recorder.rate_limited:
+        started = time.perf_counter()
+        try:
+            response = client.get(url, allow_redirects=False, timeout=60)
+        except requests.exceptions.RequestException:
+            response = None
+        recorder.record(f"{phase} /api/dashboard", (time.perf_counter() - started) * 1000, response)
+
+
+def login_storm(base_url, username, password, recorder, busy, limited, deadline):
+    client = requests.Session()
+    while time.monotonic() < deadline and not recorder.rate_limited:
+        started = time.perf_counter()
+        try:
+            response = client.post(f"{base_url}/api/login", json={"username": username, "password": password}, timeout=60)
+        except requests.exceptions.RequestException:
+            response = None
+        if response is not None and response.status_code in (429, 503):
+            # 503: the hashing pool is full; 429: the auth rate limit is on
+            (busy if response.status_code == 503 else limited).append(response.headers.get("Retry-After"))
+            time.sleep(min(float(response.headers.get("Retry-After") or 1), max(0, deadline - time.monotonic())))
+            continue
+        recorder.record("storm /api/login", (time.perf_counter() - started) * 1000, response)
+
+
+def run_phase(threads):
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--user", default=f"{USERNAME_PREFIX}1000_0", help="Username for the readers and the storm")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--readers", type=int, default=4, help="Concurrent dashboard readers")
+    parser.add_argument("--storm-clients", type=int, default=32, help="Concurrent login clients in the storm phase")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per phase")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    recorder = LoadRecorder()
+    busy, limited = [], []
+    readers = [log_in(args.base_url, "api", args.user, args.password) for _ in range(args.readers)]
+
+    deadline = time.monotonic() + args.duration
+    run_phase([
+        threading.Thread(target=dashboard_reader, args=(args.base_url, client, recorder, "quiet", deadline), daemon=True)
+        for client in readers
+    ])
+
+    deadline = time.monotonic() + args.duration
+    run_phase([
+        threading.Thread(target=dashboard_reader, args=(args.base_url, client, recorder, "storm", deadline), daemon=True)
+        for client in readers
+    ] + [
+        threading.Thread(target=login_storm, args=(args.base_url, args.user, args.password, recorder, busy, limited, deadline), daemon=True)
+        for _ in range(args.storm_clients)
+    ])
+
+    if recorder.rate_limited:
+        sys.exit(RATE_LIMITED_MESSAGE.format(what=recorder.rate_limited))
+
+    results = {route: summarize(timings) for route, timings in sorted(recorder.timings.items())}
+    logins = results.get("storm /api/login", {}).get("count", 0)
+    print(f"{logins} logins in {args.duration:.0f}s ({logins / args.duration:,.1f}/s), "
+          f"{len(busy)} rejected as busy (503), {sum(recorder.errors.values())} errors {recorder.errors or ''}\n")
+    if limited:
+        print(f"Warning: {len(limited)} logins were rate limited (429); the storm measured the limiter, not hashing. "
+              f"Restart the server with RATE_LIMIT_BACKEND=none.\n")
+    quiet, storm = results.get("quiet /api/dashboard"), results.get("storm /api/dashboard")
+    if quiet and storm and quiet["count"] and storm["count"]:
+        print(f"Dashboard p95 during the storm: {storm['p95']:.1f} ms vs. {quiet['p95']:.1f} ms quiet "
+              f"({storm['p95'] / quiet['p95'] - 1:+.0%})\n")
+    sys.exit(report(results, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Microbenchmarks of the dashboard, metrics and alert helpers.
+
+Calls the helpers directly against PostgreSQL (DATABASE_URL) for each user
+made by ledger_generator.py and reports p50/p95/p99 and SQL statements per
+call, per helper and history size.
+
+    python benchmarks/microbench.py --iterations 50
+    python benchmarks/microbench.py --save-baseline benchmarks/baseline_micro.json
+    python benchmarks/microbench.py --baseline benchmarks/baseline_micro.json
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from alerts import ALERT_RULES, get_financial_alerts
+from helpers import _get_all_financial_metrics, _get_dashboard_data, execute_query_helper
+from benchmarks.ledger_generator import USERNAME_PREFIX
+from benchmarks.stats import add_baseline_arguments, report, summarize
+
+load_dotenv()
+
+
+class BenchmarkDB:
+    """Stands in for the Flask-SQLAlchemy 'db' the helpers take: an engine and a session."""
+
+    def __init__(self, url):
+        self.engine = create_engine(url)
+        self.session = Session(self.engine)
+        self.statements = 0
+        event.listen(self.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+
+def run_case(db, call, iterations, warmup=3):
+    for _ in range(warmup):
+        call()
+    timings, queries = [], []
+    for _ in range(iterations):
+        before = db.statements
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(db.statements - before)
+        # Each helper call starts from a fresh transaction, like a request
+        db.session.rollback()
+    return summarize(timings, queries)
+
+
+def cases_for_user(db, user_id):
+    """(name, callable) per helper for one user."""
+    current_month = datetime.now().strftime('%Y-%m')
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    metrics = _get_all_financial_metrics(db, user_id)
+    db.session.rollback()
+
+    def evaluate_alert_rules():
+        for rule in ALERT_RULES.values():
+            rule["evaluate"](metrics, today)
+
+    def alerts_cold():
+        # Drops the materialised alerts first, so every rule is evaluated (worst case after a write)
+        db.session.execute(text("DELETE FROM user_alert_state WHERE user_id = :user_id"), {"user_id": user_id})
+        get_financial_alerts(db, user_id, lambda: _get_all_financial_metrics(db, user_id))
+
+    return [
+        ("dashboard_data", lambda: _get_dashboard_data(db, user_id, current_month)),
+        ("all_financial_metrics", lambda: _get_all_financial_metrics(db, user_id)),
+        ("alert_rules_evaluate", evaluate_alert_rules),
+        ("financial_alerts_cold", alerts_cold),
+        ("financial_alerts_warm", lambda: get_financial_alerts(db, user_id, lambda: _get_all_financial_metrics(db, user_id))),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--prefix", default=USERNAME_PREFIX, help="Username prefix of the generated users")
+    parser.add_argument("--iterations", type=int, default=50)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("no database: pass --database-url or set DATABASE_URL")
+    db = BenchmarkDB(args.database_url)
+    users = execute_query_helper(db, "SELECT id, username FROM users WHERE username LIKE :pattern ORDER BY id",
+                                 {"pattern": args.prefix + "%"})
+    if not users:
+        parser.error(f"no users named {args.prefix}*; run benchmarks/ledger_generator.py first")
+
+    results = {}
+    for user in users:
+        # bench_user_<size>_<n> -> cases are reported per history size
+        size = user["username"][len(args.prefix):]
+        for name, call in cases_for_user(db, user["id"]):
+            results[f"{name}[{size}]"] = run_case(db, call, args.iterations)
+    sys.exit(report(results, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Request latency of the session backends (see session_store.py).
+
+Builds a minimal Flask app per backend, logs a client in once, then times
+requests to a view that reads the session the way login_required does.
+
+    python benchmarks/session_backends.py [--requests 5000]
+
+The redis backend is measured when SESSION_REDIS_URL points at a reachable
+Redis-compatible server (e.g. a local redis-server or valkey-server).
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, session
+
+from session_store import MemorySessionBackend, RedisSessionBackend, ServerSideSessionInterface
+
+
+def build_app(backend_name):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "benchmark"
+    app.config["SESSION_PERMANENT"] = False
+
+    if backend_name == "memory":
+        app.session_interface = ServerSideSessionInterface(MemorySessionBackend())
+    elif backend_name == "redis":
+        backend = RedisSessionBackend(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"))
+        backend.client.ping()
+        app.session_interface = ServerSideSessionInterface(backend)
+    elif backend_name == "filesystem":
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config["SESSION_FILE_DIR"] = tempfile.mkdtemp(prefix="cashcompass-sessions-")
+        Session(app)
+    # 'cookie' keeps Flask's default signed-cookie interface
+
+    @app.route("/login")
+    def login():
+        session.clear()
+        session["user_id"] = 1
+        return "ok"
+
+    @app.route("/page")
+    def page():
+        return "ok" if session.get("user_id") else ("login required", 401)
+
+    return app
+
+
+def measure(backend_name, requests):
+    app = build_app(backend_name)
+    client = app.test_client()
+    client.get("/login")
+    for _ in range(min(200, requests)):  # warm up
+        client.get("/page")
+
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get("/page")
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{backend_name}: session lost ({response.status_code})")
+    timings.sort()
+    return {
+        "mean": statistics.fmean(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95)],
+        "p99": timings[int(len(timings) * 0.99)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--backends", nargs="+", default=["cookie", "memory", "redis", "filesystem"])
+    args = parser.parse_args()
+
+    print(f"{'backend':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for backend_name in args.backends:
+        try:
+            result = measure(backend_name, args.requests)
+        except Exception as e:
+            print(f"{backend_name:<12}skipped: {e}")
+            continue
+        print(f"{backend_name:<12}{result['mean']:>10.3f}{result['p50']:>10.3f}{result['p95']:>10.3f}{result['p99']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Latency summaries and baseline comparison shared by the benchmark scripts.
+
+A result is a dict per case name: {"p50", "p95", "p99", "mean" (ms), "count",
+and optionally "queries" per call}. Baselines are those dicts saved as JSON.
+"""
+import json
+import statistics
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def summarize(timings_ms, queries=None):
+    """Summary of one case from its timings (ms) and, optionally, statement counts per call."""
+    timings = sorted(timings_ms)
+    result = {
+        "count": len(timings),
+        "mean": statistics.fmean(timings) if timings else None,
+        "p50": percentile(timings, 0.50),
+        "p95": percentile(timings, 0.95),
+        "p99": percentile(timings, 0.99),
+    }
+    if queries:
+        result["queries"] = statistics.fmean(queries)
+    return result
+
+
+def print_table(results):
+    width = max([36] + [len(name) + 2 for name in results])
+    print(f"{'case':<{width}}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}")
+    for name, result in results.items():
+        if not result["count"]:
+            print(f"{name:<{width}}{0:>8}  no successful calls")
+            continue
+        queries = f"{result['queries']:.1f}" if result.get("queries") is not None else "-"
+        print(f"{name:<{width}}{result['count']:>8}{result['p50']:>10.2f}{result['p95']:>10.2f}{result['p99']:>10.2f}{queries:>9}")
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Baseline written to {path}")
+
+
+def compare_with_baseline(path, results, tolerance=0.2):
+    """
+    Prints each case against the baseline and returns the regressions: cases whose
+    p95 grew by more than 'tolerance' (0.2 = 20%) or that now run more queries per call.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print(f"\n{'case':<36}{'base p95':>10}{'p95':>10}{'change':>9}{'base q':>8}{'q':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not before.get("p95") or not result["count"]:
+            continue
+        change = result["p95"] / before["p95"] - 1
+        base_queries, queries = before.get("queries"), result.get("queries")
+        flags = []
+        if change > tolerance:
+            flags.append("slower")
+        if base_queries is not None and queries is not None and queries > base_queries + 0.5:
+            flags.append("more queries")
+        fmt = lambda value: f"{value:.1f}" if value is not None else "-"
+        print(f"{name:<36}{before['p95']:>10.2f}{result['p95']:>10.2f}{change:>+9.0%}"
+              f"{fmt(base_queries):>8}{fmt(queries):>8}  {', '.join(flags)}")
+        if flags:
+            regressions.append(name)
+    return regressions
+
+
+def add_baseline_arguments(parser):
+    parser.add_argument("--save-baseline", metavar="FILE", help="Write the results to FILE as the new baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against a saved baseline; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 growth over the baseline (0.2 = 20%%)")
+
+
+def report(results, args):
+    """Prints the results and handles --save-baseline/--baseline. Returns the process exit code."""
+    print_table(results)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.baseline:
+        regressions = compare_with_baseline(args.baseline, results, args.tolerance)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
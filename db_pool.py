@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+# Database connection pool settings and instrumentation.
+# Pool sizing comes from the environment, and every process records how long
+# requests wait for a connection, how many are in use or in overflow, and which
+# connections have been held suspiciously long (likely leaks), so pools can be
+# sized against real traffic.
+
+# Upper bounds (ms) of the checkout wait histogram buckets; the last bucket is +Inf
+CHECKOUT_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _env_flag(name, default):
+    return os.getenv(name, str(default)).lower() in ('true', '1', 't')
+
+
+class PoolMetrics:
+    """Per-process pool statistics, filled by InstrumentedQueuePool and the pool events."""
+
+    def __init__(self, leak_seconds=30):
+        self.leak_seconds = leak_seconds
+        self._lock = threading.Lock()
+        self.wait_buckets = [0] * (len(CHECKOUT_WAIT_BUCKETS_MS) + 1)
+        self.wait_count = 0
+        self.wait_sum_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.long_held_returns = 0
+        # id(connection record) -> (checked out at, thread name, request path)
+        self.checked_out = {}
+
+    def observe_wait(self, seconds):
+        wait_ms = seconds * 1000
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            for i, bound in enumerate(CHECKOUT_WAIT_BUCKETS_MS):
+                if wait_ms <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+            else:
+                self.wait_buckets[-1] += 1
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def on_checkout(self, record_id):
+        path = request.path if has_request_context() else None
+        with self._lock:
+            self.checked_out[record_id] = (time.monotonic(), threading.current_thread().name, path)
+
+    def on_checkin(self, record_id):
+        with self._lock:
+            entry = self.checked_out.pop(record_id, None)
+            if entry and time.monotonic() - entry[0] > self.leak_seconds:
+                self.long_held_returns += 1
+
+    def snapshot(self, pool=None):
+        """Metrics as a dict; includes live gauges when the engine's pool is given."""
+        now = time.monotonic()
+        with self._lock:
+            suspected_leaks = [
+                {"held_seconds": round(now - started, 1), "thread": thread, "path": path}
+                for started, thread, path in self.checked_out.values()
+                if now - started > self.leak_seconds
+            ]
+            data = {
+                "checkout_wait_ms": {
+                    "buckets": {
+                        **{f"le_{bound}": count for bound, count in zip(CHECKOUT_WAIT_BUCKETS_MS, self.wait_buckets)},
+                        "le_inf": self.wait_buckets[-1],
+                    },
+                    "count": self.wait_count,
+                    "sum": round(self.wait_sum_ms, 3),
+                    "max": round(self.wait_max_ms, 3),
+                },
+                "checkout_timeouts": self.timeouts,
+                "connections_opened": self.connects,
+                "connections_invalidated": self.invalidations,
+                "long_held_returns": self.long_held_returns,
+                "leak_threshold_seconds": self.leak_seconds,
+                "suspected_leaks": sorted(suspected_leaks, key=lambda leak: -leak["held_seconds"]),
+            }
+        if pool is not None and isinstance(pool, QueuePool):
+            data.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+                "max_overflow": pool._max_overflow,
+            })
+        return data
+
+
+pool_metrics = PoolMetrics(leak_seconds=float(os.getenv("DB_POOL_LEAK_SECONDS", 30)))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            # Every connection stayed busy for pool_timeout seconds
+            pool_metrics.count("timeouts")
+            raise
+        finally:
+            pool_metrics.observe_wait(time.perf_counter() - started)
+
+
+def engine_options_from_env():
+    """
+    SQLALCHEMY_ENGINE_OPTIONS from the environment: DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT (seconds to wait for a connection), DB_POOL_RECYCLE (seconds
+    before a connection is replaced) and DB_POOL_PRE_PING (test connections on checkout).
+    """
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", True),
+    }
+
+
+def instrument_engine(engine):
+    """Hooks the pool events feeding pool_metrics (connections opened, in use, invalidated)."""
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_metrics.count("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.on_checkout(id(connection_record))
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_metrics.on_checkin(id(connection_record))
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.count("invalidations")
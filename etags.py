@@ -0,0 +1,73 @@
+from datetime import date
+from functools import wraps
+import hashlib
+
+from flask import request, session, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import text
+
+
+# Conditional GET support for the JSON API.
+# Every user has a data version, bumped in the same transaction as any write
+# that can change what the API returns. ETags are derived from that version, so
+# checking If-None-Match costs one primary-key lookup and an unchanged resource
+# is answered with 304 before any aggregation query runs.
+
+def bump_data_version(session_or_db, user_id):
+    """Increments the user's data version. Call inside the writing transaction."""
+    db_session = getattr(session_or_db, "session", session_or_db)
+    db_session.execute(text("""
+        INSERT INTO user_data_version (user_id, version) VALUES (:user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = user_data_version.version + 1
+    """), {"user_id": int(user_id)})
+
+
+def get_data_version(db_instance, user_id):
+    """Returns the user's current data version (0 if they never wrote anything)."""
+    row = db_instance.session.execute(text(
+        "SELECT version FROM user_data_version WHERE user_id = :user_id"
+    ), {"user_id": int(user_id)}).fetchone()
+    return row[0] if row else 0
+
+
+def compute_etag(user_id, version):
+    """
+    Strong ETag for the current request: the path, the query string, the user,
+    their data version and today's date (several payloads depend on the current
+    day/month, e.g. alert due dates and the default dashboard month).
+    """
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    basis = f"{request.path}?{query}|{int(user_id)}|{version}|{date.today().isoformat()}"
+    return hashlib.sha1(basis.encode()).hexdigest()
+
+
+def etag_conditional(db_instance, identity="jwt"):
+    """
+    Decorate GET views to answer If-None-Match with 304 when the user's data
+    hasn't changed. 'identity' is 'jwt' (place below @jwt_required()) or
+    'session' (place below @login_required). Other methods pass straight through.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return f(*args, **kwargs)
+
+            user_id = get_jwt_identity() if identity == "jwt" else session.get("user_id")
+            etag = compute_etag(user_id, get_data_version(db_instance, user_id))
+
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Clients may keep the payload but must revalidate it on every use
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,73 @@
+from datetime import date, datetime
+from decimal import Decimal
+import csv
+import io
+import json
+
+from sqlalchemy import text
+
+from ledger import LEDGER_TABLES
+
+
+# Bulk export of a user's ledger tables.
+# Rows are read through a server-side cursor in fixed-size batches and written
+# out as they arrive, so memory stays flat however large the ledger is.
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def export_columns(table):
+    """Columns exported for a ledger table: its id followed by its user-editable columns."""
+    return ("id",) + LEDGER_TABLES[table]["columns"]
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _stream_rows(db_instance, table, user_id):
+    """Yields lists of row tuples owned by 'user_id', EXPORT_BATCH_SIZE at a time."""
+    # A dedicated connection keeps the open cursor out of the request's session
+    with db_instance.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(text(f"""
+            SELECT {', '.join(export_columns(table))} FROM {table}
+            WHERE user_id = :user_id
+            ORDER BY id
+        """), {"user_id": int(user_id)})
+        for batch in result.partitions():
+            yield batch
+
+
+def generate_export(db_instance, table, user_id, export_format):
+    """
+    Generator producing the export of one ledger table for one user as
+    NDJSON (one object per line) or CSV (with a header row), one chunk per batch.
+    """
+    columns = export_columns(table)
+
+    if export_format == "ndjson":
+        for batch in _stream_rows(db_instance, table, user_id):
+            yield "".join(json.dumps(dict(zip(columns, row)), default=_json_default) + "\n" for row in batch)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for batch in _stream_rows(db_instance, table, user_id):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            [value.isoformat() if isinstance(value, (date, datetime)) else value for value in row]
+            for row in batch
+        )
+        yield buffer.getvalue()
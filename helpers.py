@@ -1,13 +1,17 @@
+import calendar
 from datetime import datetime, timedelta
-from flask import redirect, render_template, session
+from flask import redirect, render_template, session, request, jsonify
 from functools import wraps
-import hashlib  # Import hashlib for creating alert hashes
+import hmac
 import math
+import os
 import requests
 
 # NEW IMPORTS FOR SQLALCHEMY
 from sqlalchemy import text, func
 
+from analytics import load_ledger_frame, savings_progress, spending_trends, last_complete_month
+
 
 # Helper function to execute a query and fetch results as dictionaries
 # This function is designed to be passed the 'db' instance from app.py
@@ -33,6 +37,48 @@ def execute_query_helper(db_instance, sql_query, params=None, fetch_one=False):
         raise e # Re-raise the exception after rollback to handle in Flask route
 
 
+# Half-open date range filter shared by every month/year scoped query.
+# Comparing the bare column (instead of TO_CHAR(date, ...)) lets PostgreSQL use
+# the (user_id, date) indexes created in schema.py.
+DATE_RANGE_SQL = "date >= :start_date AND date < :end_date"
+
+
+def month_range(month_str):
+    """
+    Returns the (start, next_start) dates for a 'YYYY-MM' month string,
+    suitable for DATE_RANGE_SQL. Raises ValueError on a malformed month.
+    """
+    start = datetime.strptime(month_str, '%Y-%m').date()
+    next_start = (start + timedelta(days=32)).replace(day=1)
+    return start, next_start
+
+
+def year_range(year):
+    """Returns the (start, next_start) dates covering a whole calendar year."""
+    year = int(year)
+    return datetime(year, 1, 1).date(), datetime(year + 1, 1, 1).date()
+
+
+def date_range_params(start, end):
+    """Builds the bind parameters expected by DATE_RANGE_SQL."""
+    return {"start_date": start, "end_date": end}
+
+
+def period_filter(month=None, year=None):
+    """
+    Returns (sql_fragment, params) restricting a ledger query to the optional
+    'month' / 'year' query arguments accepted by the JSON API.
+    """
+    if month and year:
+        return " AND " + DATE_RANGE_SQL, date_range_params(*month_range(f"{int(year):04d}-{int(month):02d}"))
+    if year:
+        return " AND " + DATE_RANGE_SQL, date_range_params(*year_range(year))
+    if month:
+        # The same month across every year can't be expressed as one range
+        return " AND EXTRACT(MONTH FROM date) = :month", {"month": int(month)}
+    return "", {}
+
+
 def apology(message, code=400):
     """Render message as an apology to user."""
 
@@ -74,6 +120,134 @@ def login_required(f):
     return decorated_function
 
 
+def metrics_token_required(f):
+    """
+    Decorate operational endpoints (metrics, pool stats, query profiles). Requests
+    must send METRICS_TOKEN as 'Authorization: Bearer <token>'; while METRICS_TOKEN
+    is unset the endpoints are disabled (they expose SQL and internals).
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = os.getenv("METRICS_TOKEN")
+        if not token:
+            return jsonify({"error": "Disabled. Set METRICS_TOKEN to enable operational endpoints."}), 403
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return jsonify({"error": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+# Helper function to gather everything the monthly dashboard shows in a single grouped query
+# Used by both the web dashboard ('/') and the mobile dashboard API ('/api/dashboard')
+def _get_dashboard_data(db_instance, user_id, selected_month):
+    """
+    Gathers the monthly dashboard data (totals, budget vs. actual, pie chart and
+    daily line chart series) for one user and month.
+
+    Per-source/category totals for the month come from monthly_rollup, the
+    daily line chart series from income and expenses grouped per day, and the
+    savings total from the savings table, all in one round trip.
+    """
+    start_date, end_date = month_range(selected_month)
+    rows = execute_query_helper(db_instance, f"""
+        SELECT kind, label, NULL AS day, total
+        FROM monthly_rollup
+        WHERE user_id = :user_id AND month = :start_date AND entry_count > 0
+        UNION ALL
+        SELECT 'income_daily' AS kind, NULL AS label, TO_CHAR(date, 'YYYY-MM-DD') AS day, SUM(amount) AS total
+        FROM income
+        WHERE user_id = :user_id AND {DATE_RANGE_SQL}
+        GROUP BY TO_CHAR(date, 'YYYY-MM-DD')
+        UNION ALL
+        SELECT 'expense_daily' AS kind, NULL AS label, TO_CHAR(date, 'YYYY-MM-DD') AS day, SUM(amount) AS total
+        FROM expenses
+        WHERE user_id = :user_id AND {DATE_RANGE_SQL}
+        GROUP BY TO_CHAR(date, 'YYYY-MM-DD')
+        UNION ALL
+        SELECT 'savings' AS kind, NULL AS label, NULL AS day, SUM(amount) AS total
+        FROM savings
+        WHERE user_id = :user_id
+    """, {"user_id": user_id, **date_range_params(start_date, end_date)})
+
+    income_by_source = {}
+    spent_by_category = {}
+    budget_by_category = {}
+    daily_income = {}
+    daily_expenses = {}
+    total_savings = 0.0
+
+    for row in rows:
+        amount = float(row['total']) if row['total'] is not None else 0.0
+        if row['kind'] == 'income':
+            income_by_source[row['label']] = amount
+        elif row['kind'] == 'expense':
+            spent_by_category[row['label']] = amount
+        elif row['kind'] == 'budget':
+            budget_by_category[row['label']] = amount
+        elif row['kind'] == 'income_daily':
+            daily_income[row['day']] = amount
+        elif row['kind'] == 'expense_daily':
+            daily_expenses[row['day']] = amount
+        elif row['kind'] == 'savings':
+            total_savings = amount
+
+    total_income = sum(income_by_source.values())
+    total_expenses = sum(spent_by_category.values())
+    total_budget = sum(budget_by_category.values())
+
+    # Budget vs. Actual covers every category with spending in the selected month
+    budget_vs_actual = {}
+    for category in sorted(spent_by_category):
+        budgeted_amount = budget_by_category.get(category, 0.0)
+        spent_amount = spent_by_category[category]
+        budget_vs_actual[category] = {
+            "budgeted": budgeted_amount,
+            "spent": spent_amount,
+            "remaining": budgeted_amount - spent_amount
+        }
+
+    # Top 5 spending categories for the pie chart
+    top_expenses_by_category = sorted(spent_by_category.items(), key=lambda item: item[1], reverse=True)[:5]
+
+    # Daily income vs. expenses, one point per day of the selected month
+    year, month = map(int, selected_month.split('-'))
+    num_days_in_month = calendar.monthrange(year, month)[1]
+    first_day_of_selected_month = datetime(year, month, 1)
+
+    line_chart_labels = []
+    line_chart_income_data = []
+    line_chart_expenses_data = []
+    for i in range(num_days_in_month):
+        current_day = first_day_of_selected_month + timedelta(days=i)
+        formatted_date = current_day.strftime('%Y-%m-%d')
+        line_chart_labels.append(current_day.strftime('%b %d'))
+        line_chart_income_data.append(daily_income.get(formatted_date, 0.0))
+        line_chart_expenses_data.append(daily_expenses.get(formatted_date, 0.0))
+
+    return {
+        "total_income": total_income,
+        "total_expenses": total_expenses,
+        "total_budget": total_budget,
+        "total_savings": total_savings,
+        "net_balance": total_income - total_expenses,
+        "income_by_source": income_by_source,
+        "spent_by_category": spent_by_category,
+        "budget_vs_actual": budget_vs_actual,
+        "budget_bar_labels": list(budget_vs_actual.keys()),
+        "budgeted_data": [d['budgeted'] for d in budget_vs_actual.values()],
+        "spent_data": [d['spent'] for d in budget_vs_actual.values()],
+        "pie_chart_labels": [category for category, _ in top_expenses_by_category],
+        "pie_chart_data": [total for _, total in top_expenses_by_category],
+        "line_chart_labels": line_chart_labels,
+        "line_chart_income_data": line_chart_income_data,
+        "line_chart_expenses_data": line_chart_expenses_data,
+        "monthly_income_total": total_income,
+        "monthly_expenses_total": total_expenses,
+    }
+
+
 # Helper function to gather all raw and derived financial metrics
 # Now accepts 'db_instance' as an argument
 def _get_all_financial_metrics(db_instance, user_id):
@@ -86,30 +260,28 @@ def _get_all_financial_metrics(db_instance, user_id):
 
     savings_goals = []
     if savings_goals_raw:
-        for item in savings_goals_raw:
-            current_amount = float(item['amount']) # Ensure amount is float for calculations
-            target_amount = float(item['target_amount']) if item['target_amount'] is not None else 0.0
-
-            if target_amount <= 0:
-                progress_percentage = 0
-            else:
-                progress_percentage = (current_amount / target_amount * 100)
-                progress_percentage = min(progress_percentage, 100)
-
+        amounts = [float(item['amount']) for item in savings_goals_raw]
+        targets = [float(item['target_amount']) if item['target_amount'] is not None else 0.0 for item in savings_goals_raw]
+        progress = savings_progress(amounts, targets)
+        for item, current_amount, target_amount, progress_percentage in zip(savings_goals_raw, amounts, targets, progress):
             savings_goals.append({
                 "id": item['id'],
                 "goal": item['goal'],
                 "current_amount": current_amount,
                 "target_amount": target_amount,
-                "progress_percentage": round(progress_percentage, 2)
+                "progress_percentage": float(progress_percentage)
             })
 
-    # --- Financial Data for Cash Flow ---
-    all_income_items = execute_query_helper(db_instance, "SELECT amount FROM income WHERE user_id = :user_id", {"user_id": user_id})
-    all_total_income = sum(float(item['amount']) for item in all_income_items) if all_income_items else 0.0
+    # --- Monthly rollup: all-time totals, months with expenses and this month's budget vs. actual ---
+    # Reads O(months x categories) rows into columnar arrays (see analytics.py)
+    current_month_start = datetime.now().date().replace(day=1)
+    frame = load_ledger_frame(db_instance, user_id)
 
-    all_expenses_items = execute_query_helper(db_instance, "SELECT amount FROM expenses WHERE user_id = :user_id", {"user_id": user_id})
-    all_total_expenses = sum(float(item['amount']) for item in all_expenses_items) if all_expenses_items else 0.0
+    all_total_income = frame.total('income')
+    all_total_expenses = frame.total('expense')
+    num_months_expenses = frame.distinct_months('expense')
+    # --- Additional data for Budget vs Actual for alerts ---
+    budget_vs_actual = frame.budget_vs_actual(current_month_start)
 
     cash_flow = all_total_income - all_total_expenses
 
@@ -117,52 +289,16 @@ def _get_all_financial_metrics(db_instance, user_id):
     # total_assets previously was sum of savings_goals.current_amount. Let's keep that for now.
     total_assets = sum(goal['current_amount'] for goal in savings_goals) if savings_goals else 0.0
 
-    total_liabilities_result = execute_query_helper(db_instance, """
-        SELECT SUM(current_balance) AS total_debt FROM debt WHERE user_id = :user_id
-    """, {"user_id": user_id}, fetch_one=True)
-    total_liabilities = float(total_liabilities_result['total_debt']) if total_liabilities_result and total_liabilities_result['total_debt'] is not None else 0.0
-
     debt_items = execute_query_helper(db_instance, "SELECT id, debt_name, current_balance, due_date FROM debt WHERE user_id = :user_id", {"user_id": user_id})
     if not debt_items:
         debt_items = []
     # Ensure current_balance in debt_items is float
     for debt in debt_items:
         debt['current_balance'] = float(debt['current_balance'])
-
-    # --- Additional data for Budget vs Actual for alerts ---
-    current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    current_month_str = current_month_start.strftime('%Y-%m') # YYYY-MM format
-
-    budget_data_raw = execute_query_helper(db_instance, """
-        SELECT category, amount FROM budget WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :current_month
-    """, {"user_id": user_id, "current_month": current_month_str})
-
-    expenses_data_raw = execute_query_helper(db_instance, """
-        SELECT category, amount FROM expenses WHERE user_id = :user_id AND TO_CHAR(date, 'YYYY-MM') = :current_month
-    """, {"user_id": user_id, "current_month": current_month_str})
-
-    budget_vs_actual = {}
-    for item in budget_data_raw:
-        category = item['category']
-        if category not in budget_vs_actual:
-            budget_vs_actual[category] = {'budgeted': 0.0, 'spent': 0.0, 'remaining': 0.0}
-        budget_vs_actual[category]['budgeted'] += float(item['amount'])
-
-    for item in expenses_data_raw:
-        category = item['category']
-        if category not in budget_vs_actual:
-            budget_vs_actual[category] = {'budgeted': 0.0, 'spent': 0.0, 'remaining': 0.0}
-        budget_vs_actual[category]['spent'] += float(item['amount'])
-
-    for category in budget_vs_actual:
-        budget_vs_actual[category]['remaining'] = budget_vs_actual[category]['budgeted'] - budget_vs_actual[category]['spent']
+    # Same rows as the debt list, so no separate SUM query
+    total_liabilities = sum(debt['current_balance'] for debt in debt_items)
 
     # --- Financial Health Score Calculation ---
-    num_months_expenses_result = execute_query_helper(db_instance,
-        "SELECT COUNT(DISTINCT TO_CHAR(date, 'YYYY-MM')) AS num_months FROM expenses WHERE user_id = :user_id",
-        {"user_id": user_id}, fetch_one=True)
-    num_months_expenses = num_months_expenses_result['num_months'] if num_months_expenses_result and num_months_expenses_result['num_months'] is not None else 0
-
     financial_health_score = 0
     score_details = []
 
@@ -261,315 +397,7 @@ def _get_all_financial_metrics(db_instance, user_id):
         "emergency_fund_target_3_months": emergency_fund_target, # New: for AI prompt
         "emergency_fund_coverage": emergency_fund_coverage, # New: for AI prompt
         "over_budget_categories": [cat for cat, data in budget_vs_actual.items() if data['remaining'] < 0],
+        # Monthly series, rolling averages and next-month forecasts for the AI prompt
+        "spending_trends": spending_trends(frame, last_complete_month()),
         "top_spending_categories_str": ", ".join([cat for cat, data in sorted(budget_vs_actual.items(), key=lambda item: item[1]['spent'], reverse=True)[:5] if data['spent'] > 0])
     }
-
-
-# Now accepts 'db_instance' as an argument
-def _generate_financial_alerts_list(db_instance, user_id):
-    """Generates a list of financial alert messages based on user data."""
-    # Pass db_instance to _get_all_financial_metrics
-    metrics = _get_all_financial_metrics(db_instance, user_id)
-    alerts = []
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-
-    dismissed_alerts_hashes = set()
-    dismissed_alerts_db = execute_query_helper(db_instance, "SELECT alert_hash FROM read_user_alerts WHERE user_id = :user_id", {"user_id": user_id})
-    if dismissed_alerts_db:
-        for row in dismissed_alerts_db:
-            dismissed_alerts_hashes.add(row['alert_hash'])
-
-    generated_alerts = []
-
-    # 1. Overbudget Alerts
-    for category, data in metrics["budget_vs_actual"].items():
-        message = None
-        if data['remaining'] < 0:
-            message = f"Heads up! You're **${abs(data['remaining']):.2f} over budget** for **{category}** this month. Time to adjust?"
-            alert_type = "warning"
-            icon = "fas fa-exclamation-triangle"
-        elif data['budgeted'] > 0 and data['remaining'] == data['budgeted'] and data['spent'] == 0: # Only if nothing spent
-            message = f"Great start! You've budgeted **${data['budgeted']:.2f}** for **{category}** and haven't spent anything yet."
-            alert_type = "info"
-            icon = "fas fa-check-circle"
-
-        if message:
-            alert_hash_base = f"budget_alert_{category}_{today.strftime('%Y-%m')}"
-            alert_hash = hashlib.md5(alert_hash_base.encode()).hexdigest()
-
-            if alert_hash not in dismissed_alerts_hashes:
-                generated_alerts.append({
-                    "type": alert_type,
-                    "message": message,
-                    "icon": icon,
-                    "alert_hash": alert_hash,
-                    "is_read": False
-                })
-
-    # 2. Debt Due Soon Alerts
-    for debt in metrics["debt_items"]:
-        message = None
-        alert_type = None
-        icon = None
-        if debt['due_date']: # Ensure due_date exists
-            try:
-                # Assuming debt['due_date'] might come as a datetime object directly from SQLAlchemy
-                # or as a string if using direct query and not converting.
-                # It's safer to ensure it's a datetime object.
-                if isinstance(debt['due_date'], str):
-                    due_date_dt = datetime.strptime(debt['due_date'], '%Y-%m-%d')
-                else: # Assume it's already a datetime object
-                    due_date_dt = debt['due_date']
-
-
-                time_diff = due_date_dt - today
-                diff_days = time_diff.days
-
-                if diff_days >= 0 and diff_days <= 7:
-                    message = f"Action Required: Your **{debt['debt_name']}** payment of **${debt['current_balance']:.2f}** is due in **{diff_days} day(s)**! Don't miss it!"
-                    alert_type = "danger"
-                    icon = "fas fa-calendar-times"
-                elif diff_days < 0 and abs(diff_days) < 30:
-                    message = f"Urgent: Your **{debt['debt_name']}** payment was due **{abs(diff_days)} day(s) ago**. Please address this promptly!"
-                    alert_type = "danger"
-                    icon = "fas fa-bell"
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Could not parse or process debt due date for debt ID {debt.get('id', 'N/A')}: {debt['due_date']} - Error: {e}")
-
-        if message:
-            alert_hash_base = f"debt_alert_{debt['id']}_{due_date_dt.strftime('%Y-%m-%d')}" # Use formatted date for hash
-            alert_hash = hashlib.md5(alert_hash_base.encode()).hexdigest()
-
-            if alert_hash not in dismissed_alerts_hashes:
-                generated_alerts.append({
-                    "type": alert_type,
-                    "message": message,
-                    "icon": icon,
-                    "alert_hash": alert_hash,
-                    "is_read": False
-                })
-
-
-    # 3. Savings Goal Progress Alerts
-    for goal in metrics["savings_goals"]:
-        message = None
-        alert_type = None
-        icon = None
-        savings_tier = "initial"
-
-        # Check if target_amount is valid and positive before comparison
-        if goal['target_amount'] is None or goal['target_amount'] <= 0:
-            savings_tier = "no_target"
-        elif goal['current_amount'] >= goal['target_amount']:
-            savings_tier = "smashed"
-        elif goal['progress_percentage'] >= 75:
-            savings_tier = "75_percent"
-        elif goal['progress_percentage'] >= 25:
-            savings_tier = "25_percent"
-        elif goal['current_amount'] > 0 and goal['progress_percentage'] < 25:
-             savings_tier = "initial_progress"
-
-
-        if savings_tier == "smashed":
-            message = f"Fantastic! You've **smashed your {goal['goal']} goal**! Consider setting a new one!"
-            alert_type = "success"
-            icon = "fas fa-trophy"
-        elif savings_tier == "75_percent":
-            message = f"Almost there! Your **{goal['goal']} goal is {goal['progress_percentage']:.0f}% complete**. Keep pushing!"
-            alert_type = "info"
-            icon = "fas fa-star"
-        elif savings_tier == "25_percent":
-            message = f"Good progress on **{goal['goal']}!** You're at **{goal['progress_percentage']:.0f}%** of your target."
-            alert_type = "info"
-            icon = "fas fa-piggy-bank"
-        elif savings_tier == "initial_progress":
-            message = f"Great start on your **{goal['goal']} goal**! You've already saved **${goal['current_amount']:.2f}**. Keep going!"
-            alert_type = "info"
-            icon = "fas fa-seedling"
-        elif savings_tier == "no_target":
-            message = f"Your savings goal '{goal['goal']}' doesn't have a target amount. Set one to track your progress!"
-            alert_type = "info"
-            icon = "fas fa-clipboard-list"
-
-        if message:
-            alert_hash_base = f"savings_alert_{goal['id']}_{savings_tier}"
-            alert_hash = hashlib.md5(alert_hash_base.encode()).hexdigest()
-
-            if alert_hash not in dismissed_alerts_hashes:
-                generated_alerts.append({
-                    "type": alert_type,
-                    "message": message,
-                    "icon": icon,
-                    "alert_hash": alert_hash,
-                    "is_read": False
-                })
-
-
-    # 4. Cash Flow Health Alerts
-    message = None
-    alert_type = None
-    icon = None
-    cash_flow_tier = "healthy"
-    if metrics["cash_flow"] < 0:
-        cash_flow_tier = "negative"
-    elif metrics["cash_flow"] >= 0 and metrics["cash_flow"] < 100:
-        cash_flow_tier = "tight"
-
-
-    if cash_flow_tier == "negative":
-        message = f"Warning! Your **net cash flow is negative (${abs(metrics['cash_flow']):.2f})**. Let's find ways to boost income or cut expenses."
-        alert_type = "danger"
-        icon = "fas fa-chart-line"
-    elif cash_flow_tier == "tight":
-        message = f"Your cash flow is a bit tight (**${metrics['cash_flow']:.2f}**). Small changes can make a big difference!"
-        alert_type = "warning"
-        icon = "fas fa-chart-bar"
-    elif cash_flow_tier == "healthy":
-        message = f"Excellent cash flow! You're adding **${metrics['cash_flow']:.2f}** to your financial cushion. Keep it up!"
-        alert_type = "success"
-        icon = "fas fa-dollar-sign"
-
-
-    if message:
-        alert_hash_base = f"cash_flow_alert_{cash_flow_tier}_{today.strftime('%Y-%m')}"
-        alert_hash = hashlib.md5(alert_hash_base.encode()).hexdigest()
-
-        if alert_hash not in dismissed_alerts_hashes:
-            generated_alerts.append({
-                "type": alert_type,
-                "message": message,
-                "icon": icon,
-                "alert_hash": alert_hash,
-                "is_read": False
-            })
-
-
-    # 5. Emergency Fund Status Alerts
-    message = None
-    alert_type = None
-    icon = None
-    emergency_fund_target = metrics["average_monthly_expenses"] * 3
-    emergency_fund_tier = "low" # Default if below 50%
-    # Use metrics["total_assets"] as total_current_savings for this calculation as defined in _get_all_financial_metrics
-    total_current_savings_for_ef = sum(g['current_amount'] for g in metrics["savings_goals"]) if metrics["savings_goals"] else 0.0
-
-    if metrics["average_monthly_expenses"] > 0:
-        if total_current_savings_for_ef >= emergency_fund_target:
-            emergency_fund_tier = "strong"
-        elif total_current_savings_for_ef >= emergency_fund_target * 0.5:
-            emergency_fund_tier = "growing"
-    else:
-        emergency_fund_tier = "no_expense_data"
-
-    if emergency_fund_tier == "strong":
-        message = f"Your **emergency fund is strong**! You have at least 3 months of expenses covered. Financial security unlocked!"
-        alert_type = "success"
-        icon = "fas fa-shield-alt"
-    elif emergency_fund_tier == "growing":
-        # Ensure division by zero is handled if emergency_fund_target is 0
-        progress_percent = (total_current_savings_for_ef / emergency_fund_target * 100) if emergency_fund_target > 0 else 0
-        message = f"Your **emergency fund is growing**! You're at {round(progress_percent, 0):.0f}% of your 3-month target. Keep saving!"
-        alert_type = "warning"
-        icon = "fas fa-hand-holding-usd"
-    elif emergency_fund_tier == "low":
-        message = f"Focus on your **emergency fund**. It's currently below 50% of your 3-month target (${emergency_fund_target:.2f})."
-        alert_type = "danger"
-        icon = "fas fa-fire"
-    elif emergency_fund_tier == "no_expense_data":
-        message = "To assess your emergency fund, please record some expenses first. Then we can calculate your target!"
-        alert_type = "info"
-        icon = "fas fa-clipboard"
-
-    if message:
-        alert_hash_base = f"emergency_fund_alert_{emergency_fund_tier}"
-        alert_hash = hashlib.md5(alert_hash_base.encode()).hexdigest()
-
-        if alert_hash not in dismissed_alerts_hashes:
-            generated_alerts.append({
-                "type": alert_type,
-                "message": message,
-                "icon": icon,
-                "alert_hash": alert_hash,
-                "is_read": False
-            })
-
-    # 6. High Debt Alert
-    message = None
-    alert_type = None
-    icon = None
-    HIGH_DEBT_THRESHOLD_WARNING = 5000 # Example
-    HIGH_DEBT_THRESHOLD_DANGER = 15000 # Example
-
-    debt_tier = "low_or_none"
-    if metrics["total_liabilities"] > HIGH_DEBT_THRESHOLD_DANGER:
-        debt_tier = "critical"
-    elif metrics["total_liabilities"] > HIGH_DEBT_THRESHOLD_WARNING:
-        debt_tier = "warning"
-    elif metrics["total_liabilities"] == 0 and metrics["all_total_income"] > 0:
-        debt_tier = "debt_free"
-
-    if debt_tier == "critical":
-        message = f"Critical Debt Alert! Your total liabilities are **${metrics['total_liabilities']:.2f}**. Let's strategize a robust repayment plan!"
-        alert_type = "danger"
-        icon = "fas fa-hand-holding-dollar"
-    elif debt_tier == "warning":
-        message = f"Your total debt is **${metrics['total_liabilities']:.2f}**. It's manageable, but keeping an eye on it is key!"
-        alert_type = "warning"
-        icon = "fas fa-chart-pie"
-    elif debt_tier == "debt_free":
-        message = "Congratulations! You are **debt-free**! That's a huge financial win!"
-        alert_type = "success"
-        icon = "fas fa-check-double"
-
-    if message:
-        alert_hash_base = f"debt_status_alert_{debt_tier}"
-        alert_hash = hashlib.md5(alert_hash_base.encode()).hexdigest()
-
-        if alert_hash not in dismissed_alerts_hashes:
-            generated_alerts.append({
-                "type": alert_type,
-                "message": message,
-                "icon": icon,
-                "alert_hash": alert_hash,
-                "is_read": False
-            })
-
-    # Add a general financial health summary (only if other specific alerts exist and not dismissed)
-    # The original logic checks `if generated_alerts` before adding this general one.
-    # We'll adjust it slightly to always show it if data exists and not dismissed.
-    general_health_message = f"Your overall financial health score is **{metrics['financial_health_score']}/100**. Click 'View Savings & Financial Health Overview' for details!"
-    health_score_tier = "general_info"
-    alert_hash_base_general = f"financial_health_summary_alert_{health_score_tier}"
-    alert_hash_general = hashlib.md5(alert_hash_base_general.encode()).hexdigest()
-
-    # Only add this if there is some financial data processed (not the "no data recorded yet" case)
-    # and it hasn't been dismissed.
-    if metrics["financial_health_score"] > 0 and alert_hash_general not in dismissed_alerts_hashes:
-        generated_alerts.append({
-            "type": "info",
-            "message": general_health_message,
-            "icon": "fas fa-heartbeat",
-            "alert_hash": alert_hash_general,
-            "is_read": False
-        })
-
-
-    # Sort alerts (e.g., critical first, then warnings, then info/success)
-    type_order = {"danger": 1, "warning": 2, "info": 3, "success": 4}
-    generated_alerts.sort(key=lambda x: type_order.get(x["type"], 99))
-
-    # If no active alerts were generated at all (after filtering dismissed ones AND adding general info),
-    # then show the "no alerts for now" message.
-    # This ensures "no alerts" message only appears if truly nothing else is relevant.
-    if not generated_alerts:
-        message = "You have no alerts for now."
-        alert_hash = hashlib.md5("no_alerts_message".encode()).hexdigest()
-        generated_alerts.append({
-            "type": "info",
-            "message": message,
-            "icon": "fas fa-check-circle",
-            "alert_hash": alert_hash,
-            "is_read": False
-        })
-
-    return generated_alerts
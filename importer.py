@@ -0,0 +1,141 @@
+from datetime import datetime
+import csv
+import io
+import json
+import re
+import time
+
+from ledger import LEDGER_TABLES, validate_entry, insert_entries
+
+
+# Bulk import of bank history into income or expenses.
+# Files are parsed into plain dicts, checked with the same rules as the forms
+# (ledger.validate_entry) and written with batched multi-row INSERTs in the
+# caller's transaction. Invalid rows are reported and skipped.
+
+IMPORTABLE_TABLES = ("income", "expenses")
+IMPORT_FORMATS = ("csv", "ofx", "json")
+
+# Per-row errors returned in the summary beyond which only the count is kept
+MAX_REPORTED_ERRORS = 100
+
+# OFX transactions: <STMTTRN> ... </STMTTRN>, tags with or without closing tags (SGML or XML)
+_OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", re.S | re.I)
+_OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def detect_format(filename=None, content_type=None):
+    """Guesses the import format from a file name or content type; None if unknown."""
+    if filename and "." in filename:
+        extension = filename.rsplit(".", 1)[1].lower()
+        if extension in IMPORT_FORMATS:
+            return extension
+        if extension == "qfx":
+            return "ofx"
+    content_type = (content_type or "").lower()
+    if "json" in content_type:
+        return "json"
+    if "csv" in content_type:
+        return "csv"
+    if "ofx" in content_type:
+        return "ofx"
+    return None
+
+
+def parse_csv(content, table):
+    """
+    Reads rows from CSV with a header row. Header names are matched case-insensitively;
+    the source/category column may also be called 'label' or 'description'.
+    """
+    label_column = LEDGER_TABLES[table]["label"]
+    reader = csv.DictReader(io.StringIO(content))
+    for record in reader:
+        record = {(key or "").strip().lower(): value for key, value in record.items()}
+        yield {
+            label_column: record.get(label_column) or record.get("label") or record.get("description"),
+            "amount": record.get("amount"),
+            "date": record.get("date"),
+        }
+
+
+def parse_json(content, table):
+    """Reads rows from a JSON array of objects (or an object holding it under 'rows')."""
+    data = json.loads(content) if isinstance(content, str) else content
+    if isinstance(data, dict):
+        data = data.get("rows")
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of rows")
+    for record in data:
+        yield record if isinstance(record, dict) else {}
+
+
+def parse_ofx(content, table):
+    """
+    Reads bank transactions from an OFX/QFX statement. Credits become income,
+    debits become expenses (as positive amounts); transactions of the other
+    direction are skipped (yielded as None).
+    """
+    label_column = LEDGER_TABLES[table]["label"]
+    for block in _OFX_TRANSACTION.findall(content):
+        fields = {tag.upper(): value.strip() for tag, value in _OFX_FIELD.findall(block)}
+        try:
+            amount = float(fields.get("TRNAMT", ""))
+        except ValueError:
+            amount = None
+        if amount is not None and (amount > 0) != (table == "income"):
+            yield None
+            continue
+        posted = fields.get("DTPOSTED", "")
+        yield {
+            label_column: fields.get("NAME") or fields.get("MEMO") or fields.get("TRNTYPE"),
+            "amount": abs(amount) if amount is not None else fields.get("TRNAMT"),
+            # DTPOSTED is YYYYMMDD optionally followed by a time and timezone
+            "date": posted[:8],
+            "date_format": "%Y%m%d",
+        }
+
+
+PARSERS = {"csv": parse_csv, "json": parse_json, "ofx": parse_ofx}
+
+
+def import_entries(db_instance, table, user_id, content, import_format):
+    """
+    Parses, validates and inserts an import file for 'user_id'. The caller commits.
+    Returns a summary with the received/imported/skipped/rejected counts,
+    per-row errors (row numbers start at 1) and the throughput.
+    Raises ValueError if the file itself cannot be parsed.
+    """
+    started = time.perf_counter()
+    valid_rows = []
+    errors = []
+    received = skipped = rejected = 0
+
+    try:
+        for row_number, record in enumerate(PARSERS[import_format](content, table), start=1):
+            received += 1
+            if record is None:
+                skipped += 1
+                continue
+            try:
+                valid_rows.append(validate_entry(table, record, record.get("date_format", "%Y-%m-%d")))
+            except ValueError as e:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": row_number, "error": str(e)})
+    except (ValueError, csv.Error) as e:
+        raise ValueError(f"Could not parse {import_format.upper()} file: {e}")
+
+    imported = len(insert_entries(db_instance, table, user_id, valid_rows))
+    elapsed = time.perf_counter() - started
+    return {
+        "entity": table,
+        "format": import_format,
+        "received": received,
+        "imported": imported,
+        "skipped": skipped,
+        "rejected": rejected,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(imported / elapsed, 1) if elapsed > 0 else imported,
+        "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
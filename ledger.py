@@ -0,0 +1,487 @@
+from datetime import datetime, date
+import math
+
+from sqlalchemy import event, text
+
+
+# Ledger tables written through this module.
+# 'columns' are the user-editable columns; 'kind'/'label' describe how each row
+# is folded into monthly_rollup (one row per user, month, kind and category/source).
+# Savings and debt have no date, so they are not rolled up.
+LEDGER_TABLES = {
+    "income": {"columns": ("source", "amount", "date"), "kind": "income", "label": "source"},
+    "expenses": {"columns": ("category", "amount", "date"), "kind": "expense", "label": "category"},
+    "budget": {"columns": ("category", "amount", "date"), "kind": "budget", "label": "category"},
+    "savings": {"columns": ("goal", "amount", "target_amount"), "kind": None, "label": None},
+    "debt": {"columns": ("debt_name", "debt_type", "current_balance", "due_date"), "kind": None, "label": None},
+}
+
+# Field names used in validation messages for the dated ledger tables
+ENTRY_LABEL_NAMES = {"income": "Income source", "expenses": "Category", "budget": "Category"}
+
+# Columns bound as dates in multi-row statements
+DATE_COLUMNS = {"date", "due_date"}
+
+# Rows per multi-row INSERT in insert_entries
+INSERT_BATCH_SIZE = 1000
+
+# Callbacks run once a transaction containing ledger writes has committed,
+# as callback(user_id, tables) with the set of tables that user wrote to.
+_commit_listeners = []
+# Callbacks run just before such a transaction commits, still inside it,
+# as callback(session, user_id, tables). Errors abort the commit.
+_before_commit_listeners = []
+
+# Allocates the user's next change sequence number (see sync.py). The upsert locks
+# the user's row until the transaction ends, so a user's transactions commit in
+# sequence order and a client that has seen number N has seen every change up to N.
+CHANGE_SEQ_SQL = """
+    INSERT INTO user_change_seq (user_id, seq) VALUES (:user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET seq = user_change_seq.seq + 1
+    RETURNING seq
+"""
+
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO monthly_rollup (user_id, month, kind, label, total, entry_count)
+    VALUES (:user_id, CAST(date_trunc('month', CAST(:entry_date AS date)) AS date), :kind, :label, :amount, :entry_count)
+    ON CONFLICT (user_id, month, kind, label) DO UPDATE
+    SET total = monthly_rollup.total + EXCLUDED.total,
+        entry_count = monthly_rollup.entry_count + EXCLUDED.entry_count
+"""
+
+# Full rebuild of the rollup from the raw tables. Values are assigned (not added)
+# so running it twice, or from two workers at once, gives the same result.
+ROLLUP_REBUILD_SQL = """
+    INSERT INTO monthly_rollup (user_id, month, kind, label, total, entry_count)
+    SELECT user_id, CAST(date_trunc('month', date) AS date), :kind, COALESCE({label}, ''), SUM(amount), COUNT(*)
+    FROM {table}
+    WHERE {user_filter}
+    GROUP BY user_id, CAST(date_trunc('month', date) AS date), COALESCE({label}, '')
+    ON CONFLICT (user_id, month, kind, label) DO UPDATE
+    SET total = EXCLUDED.total, entry_count = EXCLUDED.entry_count
+"""
+
+
+def _rollup_delta(spec, user_id, row, sign):
+    """Builds the ROLLUP_UPSERT_SQL parameters adding (sign=1) or removing (sign=-1) a row."""
+    return {
+        "user_id": user_id,
+        "entry_date": row["date"],
+        "kind": spec["kind"],
+        "label": row[spec["label"]] or "",
+        "amount": row["amount"] * sign,
+        "entry_count": sign,
+    }
+
+
+def _apply_rollup(db_instance, table, user_id, old_row=None, new_row=None):
+    """Moves a ledger row's amount out of its old rollup bucket and into its new one."""
+    spec = LEDGER_TABLES[table]
+    if spec["kind"] is None:
+        return
+    deltas = []
+    if old_row is not None:
+        deltas.append(_rollup_delta(spec, user_id, old_row, -1))
+    if new_row is not None:
+        deltas.append(_rollup_delta(spec, user_id, new_row, 1))
+    if deltas:
+        db_instance.session.execute(text(ROLLUP_UPSERT_SQL), deltas)
+
+
+def change_seq(db_instance, user_id):
+    """
+    The change sequence number stamped on every row 'user_id' writes in the
+    current transaction, allocated on the first write and reused afterwards.
+    """
+    sequences = db_instance.session.info.setdefault("change_seq", {})
+    user_id = int(user_id)
+    if user_id not in sequences:
+        sequences[user_id] = db_instance.session.execute(text(CHANGE_SEQ_SQL), {"user_id": user_id}).scalar()
+        if db_instance.session.in_nested_transaction():
+            # Rolling back the savepoint undoes the allocation too (see _after_rollback)
+            db_instance.session.info.setdefault("change_seq_in_savepoint", set()).add(user_id)
+    return sequences[user_id]
+
+
+def record_ledger_write(db_instance, user_id, tables):
+    """
+    Notes that 'user_id' wrote to 'tables' (a table name or an iterable of them)
+    in the current transaction. Listeners registered with on_ledger_commit are
+    told once the transaction commits. insert/update/delete_entry call this
+    themselves; other writers call it directly.
+    """
+    if isinstance(tables, str):
+        tables = (tables,)
+    pending = db_instance.session.info.setdefault("ledger_writes", {})
+    pending.setdefault(int(user_id), set()).update(tables)
+
+
+def on_ledger_commit(callback):
+    """Registers callback(user_id, tables) to run after ledger writes commit."""
+    _commit_listeners.append(callback)
+    return callback
+
+
+def before_ledger_commit(callback):
+    """
+    Registers callback(session, user_id, tables) to run inside the transaction,
+    right before ledger writes commit, once per user per transaction.
+    """
+    _before_commit_listeners.append(callback)
+    return callback
+
+
+def _before_commit(session):
+    pending = session.info.get("ledger_writes")
+    if not pending:
+        return
+    for user_id, tables in pending.items():
+        for callback in _before_commit_listeners:
+            callback(session, user_id, tables)
+
+
+def _after_commit(session):
+    session.info.pop("change_seq", None)
+    session.info.pop("change_seq_in_savepoint", None)
+    pending = session.info.pop("ledger_writes", None)
+    if not pending:
+        return
+    for user_id, tables in pending.items():
+        for callback in _commit_listeners:
+            try:
+                callback(user_id, tables)
+            except Exception as e:
+                print(f"Warning: ledger commit listener failed for user {user_id}: {e}")
+
+
+def _after_rollback(session):
+    if session.in_nested_transaction():
+        # Only a savepoint was rolled back; the transaction goes on and may still
+        # commit. Keep the recorded writes (notifying for a table whose rows were
+        # undone is harmless) and forget only the numbers allocated in savepoints.
+        sequences = session.info.get("change_seq", {})
+        for user_id in session.info.pop("change_seq_in_savepoint", ()):
+            sequences.pop(user_id, None)
+        return
+    session.info.pop("ledger_writes", None)
+    session.info.pop("change_seq", None)
+    session.info.pop("change_seq_in_savepoint", None)
+
+
+def register_ledger_events(db_instance):
+    """Hooks the session events that drive the before_ledger_commit/on_ledger_commit listeners."""
+    event.listen(db_instance.session, "before_commit", _before_commit)
+    event.listen(db_instance.session, "after_commit", _after_commit)
+    event.listen(db_instance.session, "after_rollback", _after_rollback)
+
+
+def insert_entry(db_instance, table, user_id, values):
+    """
+    Inserts a ledger row and updates monthly_rollup in the same transaction.
+    'values' must contain every column listed in LEDGER_TABLES[table].
+    The caller commits. Returns the new row id.
+    """
+    columns = LEDGER_TABLES[table]["columns"]
+    row = db_instance.session.execute(text(f"""
+        INSERT INTO {table} (user_id, change_seq, {', '.join(columns)})
+        VALUES (:user_id, :change_seq, {', '.join(':' + column for column in columns)})
+        RETURNING id, {', '.join(columns)}
+    """), {"user_id": user_id, "change_seq": change_seq(db_instance, user_id),
+           **{column: values[column] for column in columns}}).mappings().fetchone()
+    _apply_rollup(db_instance, table, user_id, new_row=row)
+    record_ledger_write(db_instance, user_id, table)
+    return row["id"]
+
+
+def update_entry(db_instance, table, item_id, user_id, values):
+    """
+    Updates a ledger row owned by 'user_id' and moves its amount between rollup
+    buckets in the same transaction. The caller commits.
+    Returns False if no such row exists for this user.
+    """
+    columns = LEDGER_TABLES[table]["columns"]
+    # The FROM subquery locks the row and still sees its pre-update values
+    row = db_instance.session.execute(text(f"""
+        UPDATE {table} AS t
+        SET {', '.join(f'{column} = :{column}' for column in columns)}, change_seq = :change_seq
+        FROM (
+            SELECT id, {', '.join(columns)} FROM {table}
+            WHERE id = :item_id AND user_id = :user_id
+            FOR UPDATE
+        ) AS old
+        WHERE t.id = old.id
+        RETURNING {', '.join(f'old.{column} AS old_{column}' for column in columns)},
+                  {', '.join(f't.{column} AS new_{column}' for column in columns)}
+    """), {"item_id": item_id, "user_id": user_id, "change_seq": change_seq(db_instance, user_id),
+           **{column: values[column] for column in columns}}).mappings().fetchone()
+    if row is None:
+        return False
+    old_row = {column: row[f"old_{column}"] for column in columns}
+    new_row = {column: row[f"new_{column}"] for column in columns}
+    _apply_rollup(db_instance, table, user_id, old_row=old_row, new_row=new_row)
+    record_ledger_write(db_instance, user_id, table)
+    return True
+
+
+def delete_entry(db_instance, table, item_id, user_id):
+    """
+    Deletes a ledger row owned by 'user_id', removes it from monthly_rollup and
+    leaves a tombstone for delta sync, in the same transaction. The caller commits.
+    Returns False if no such row exists for this user.
+    """
+    columns = LEDGER_TABLES[table]["columns"]
+    row = db_instance.session.execute(text(f"""
+        DELETE FROM {table}
+        WHERE id = :item_id AND user_id = :user_id
+        RETURNING {', '.join(columns)}
+    """), {"item_id": item_id, "user_id": user_id}).mappings().fetchone()
+    if row is None:
+        return False
+    _record_tombstones(db_instance, table, user_id, [item_id])
+    _apply_rollup(db_instance, table, user_id, old_row=row)
+    record_ledger_write(db_instance, user_id, table)
+    return True
+
+
+def validate_entry(table, values, date_format="%Y-%m-%d"):
+    """
+    Applies the form rules to an income/expenses/budget entry: a non-empty
+    source or category, a positive amount and a date in 'date_format'.
+    Returns the cleaned values; raises ValueError with a user-facing message.
+    """
+    label_column = LEDGER_TABLES[table]["label"]
+    label = values.get(label_column)
+    label = label.strip() if isinstance(label, str) else label
+    if not label:
+        raise ValueError(f"{ENTRY_LABEL_NAMES[table]} cannot be empty")
+
+    try:
+        amount = float(values.get("amount"))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid amount format")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("Amount must be a positive number")
+
+    entry_date = values.get("date")
+    if isinstance(entry_date, datetime):
+        entry_date = entry_date.date()
+    elif not isinstance(entry_date, date):
+        try:
+            entry_date = datetime.strptime(str(entry_date).strip(), date_format).date()
+        except ValueError:
+            raise ValueError("Invalid date format provided.")
+
+    return {label_column: label, "amount": amount, "date": entry_date}
+
+
+def _parse_amount(value, name, allow_zero):
+    try:
+        amount = float(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name} format")
+    if not math.isfinite(amount) or amount < 0 or (amount == 0 and not allow_zero):
+        raise ValueError(f"{name.capitalize()} must be a {'non-negative' if allow_zero else 'positive'} number")
+    return amount
+
+
+def validate_savings(values):
+    """The savings form rules: a goal, a non-negative amount and a positive target. Raises ValueError."""
+    goal = values.get("goal")
+    goal = goal.strip() if isinstance(goal, str) else goal
+    if not goal:
+        raise ValueError("Savings goal cannot be empty")
+    return {
+        "goal": goal,
+        "amount": _parse_amount(values.get("amount"), "current amount", allow_zero=True),
+        "target_amount": _parse_amount(values.get("target_amount"), "target amount", allow_zero=False),
+    }
+
+
+def validate_debt(values, date_format="%Y-%m-%d"):
+    """The debt form rules: name, type, a non-negative balance and an optional due date. Raises ValueError."""
+    debt_name, debt_type = values.get("debt_name"), values.get("debt_type")
+    if not debt_name or not debt_type:
+        raise ValueError("Missing required debt information: Name, Type, or Current Balance.")
+    due_date = values.get("due_date") or None
+    if due_date is not None and not isinstance(due_date, date):
+        try:
+            due_date = datetime.strptime(str(due_date).strip(), date_format).date()
+        except ValueError:
+            raise ValueError("Invalid due date format provided.")
+    return {
+        "debt_name": debt_name,
+        "debt_type": debt_type,
+        "current_balance": _parse_amount(values.get("current_balance"), "current balance", allow_zero=True),
+        "due_date": due_date,
+    }
+
+
+def validate_row(table, values):
+    """Applies the rules of 'table' (validate_entry, validate_savings or validate_debt). Raises ValueError."""
+    if table == "savings":
+        return validate_savings(values)
+    if table == "debt":
+        return validate_debt(values)
+    return validate_entry(table, values)
+
+
+def _apply_rollup_rows(db_instance, table, user_id, old_rows=(), new_rows=()):
+    """Like _apply_rollup for many rows at once: one upsert per month and label touched."""
+    spec = LEDGER_TABLES[table]
+    if spec["kind"] is None:
+        return
+    rollup = {}
+    for rows, sign in ((old_rows, -1), (new_rows, 1)):
+        for row in rows:
+            key = (row["date"].replace(day=1), row[spec["label"]] or "")
+            total, count = rollup.get(key, (0, 0))
+            rollup[key] = (total + row["amount"] * sign, count + sign)
+    if rollup:
+        db_instance.session.execute(text(ROLLUP_UPSERT_SQL), [
+            {"user_id": user_id, "entry_date": month, "kind": spec["kind"], "label": label,
+             "amount": total, "entry_count": count}
+            for (month, label), (total, count) in rollup.items()
+        ])
+
+
+def _record_tombstones(db_instance, table, user_id, item_ids):
+    db_instance.session.execute(text("""
+        INSERT INTO sync_tombstones (user_id, table_name, row_id, change_seq)
+        SELECT :user_id, :table_name, UNNEST(CAST(:row_ids AS INTEGER[])), :change_seq
+        ON CONFLICT (user_id, table_name, row_id) DO NOTHING
+    """), {"user_id": user_id, "table_name": table, "row_ids": list(item_ids),
+           "change_seq": change_seq(db_instance, user_id)})
+
+
+def _values_sql(columns, i):
+    # Untyped NULLs in VALUES would default to text, which a date column won't accept
+    return ", ".join(f"CAST(:{column}_{i} AS DATE)" if column in DATE_COLUMNS else f":{column}_{i}"
+                     for column in columns)
+
+
+def insert_entries(db_instance, table, user_id, rows):
+    """
+    Inserts many validated rows with multi-row INSERTs of INSERT_BATCH_SIZE rows
+    and applies their rollup deltas aggregated per month and label.
+    The caller commits. Returns the new row ids, in the order of 'rows'.
+    """
+    if not rows:
+        return []
+    columns = LEDGER_TABLES[table]["columns"]
+    seq = change_seq(db_instance, user_id)
+    inserted = []
+
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        params = {"user_id": user_id, "change_seq": seq}
+        placeholders = []
+        for i, row in enumerate(batch):
+            placeholders.append(f"(:user_id, :change_seq, {_values_sql(columns, i)})")
+            params.update({f"{column}_{i}": row[column] for column in columns})
+
+        # PostgreSQL returns the rows of a multi-row VALUES insert in VALUES order
+        inserted.extend(db_instance.session.execute(text(f"""
+            INSERT INTO {table} (user_id, change_seq, {', '.join(columns)}) VALUES {', '.join(placeholders)}
+            RETURNING id, {', '.join(columns)}
+        """), params).mappings().fetchall())
+
+    _apply_rollup_rows(db_instance, table, user_id, new_rows=inserted)
+    record_ledger_write(db_instance, user_id, table)
+    return [row["id"] for row in inserted]
+
+
+def update_entries(db_instance, table, user_id, updates):
+    """
+    Updates many rows owned by 'user_id' in one statement. 'updates' is a list of
+    (item_id, values) with distinct ids; rollup buckets are adjusted in one upsert
+    per month and label. The caller commits. Returns the set of ids updated
+    (ids that don't exist for this user are left out).
+    """
+    if not updates:
+        return set()
+    columns = LEDGER_TABLES[table]["columns"]
+    params = {"user_id": user_id, "change_seq": change_seq(db_instance, user_id),
+              "item_ids": [item_id for item_id, _ in updates]}
+    placeholders = []
+    for i, (item_id, values) in enumerate(updates):
+        placeholders.append(f"(CAST(:id_{i} AS INTEGER), {_values_sql(columns, i)})")
+        params[f"id_{i}"] = item_id
+        params.update({f"{column}_{i}": values[column] for column in columns})
+
+    # As in update_entry, the 'old' subquery locks the rows and still sees their previous values
+    rows = db_instance.session.execute(text(f"""
+        UPDATE {table} AS t
+        SET {', '.join(f'{column} = v.{column}' for column in columns)}, change_seq = :change_seq
+        FROM (VALUES {', '.join(placeholders)}) AS v (id, {', '.join(columns)}),
+             (
+                 SELECT id, {', '.join(columns)} FROM {table}
+                 WHERE user_id = :user_id AND id = ANY(:item_ids)
+                 FOR UPDATE
+             ) AS old
+        WHERE t.id = v.id AND old.id = v.id
+        RETURNING t.id AS id,
+                  {', '.join(f'old.{column} AS old_{column}' for column in columns)},
+                  {', '.join(f't.{column} AS new_{column}' for column in columns)}
+    """), params).mappings().fetchall()
+    if not rows:
+        return set()
+    _apply_rollup_rows(
+        db_instance, table, user_id,
+        old_rows=[{column: row[f"old_{column}"] for column in columns} for row in rows],
+        new_rows=[{column: row[f"new_{column}"] for column in columns} for row in rows],
+    )
+    record_ledger_write(db_instance, user_id, table)
+    return {row["id"] for row in rows}
+
+
+def delete_entries(db_instance, table, user_id, item_ids):
+    """
+    Deletes many rows owned by 'user_id' in one statement, with their tombstones
+    and rollup deltas. The caller commits. Returns the set of ids deleted.
+    """
+    if not item_ids:
+        return set()
+    columns = LEDGER_TABLES[table]["columns"]
+    rows = db_instance.session.execute(text(f"""
+        DELETE FROM {table}
+        WHERE user_id = :user_id AND id = ANY(:item_ids)
+        RETURNING id, {', '.join(columns)}
+    """), {"user_id": user_id, "item_ids": list(item_ids)}).mappings().fetchall()
+    if not rows:
+        return set()
+    deleted = [row["id"] for row in rows]
+    _record_tombstones(db_instance, table, user_id, deleted)
+    _apply_rollup_rows(db_instance, table, user_id, old_rows=rows)
+    record_ledger_write(db_instance, user_id, table)
+    return set(deleted)
+
+
+def rebuild_monthly_rollup(db_instance, user_id=None):
+    """
+    Recomputes monthly_rollup from the raw ledger tables, for one user or for
+    everyone. Used to backfill existing data. Commits when done.
+    """
+    params = {}
+    if user_id is None:
+        user_filter = "TRUE"
+        db_instance.session.execute(text("DELETE FROM monthly_rollup"))
+    else:
+        user_filter = "user_id = :user_id"
+        params["user_id"] = user_id
+        db_instance.session.execute(text("DELETE FROM monthly_rollup WHERE user_id = :user_id"), params)
+
+    for table, spec in LEDGER_TABLES.items():
+        if spec["kind"] is None:
+            continue
+        db_instance.session.execute(
+            text(ROLLUP_REBUILD_SQL.format(table=table, label=spec["label"], user_filter=user_filter)),
+            {"kind": spec["kind"], **params}
+        )
+    db_instance.session.commit()
+
+
+def monthly_rollup_is_empty(db_instance):
+    """True when monthly_rollup holds no rows yet, i.e. it still has to be built with rebuild_monthly_rollup."""
+    empty = db_instance.session.execute(text("SELECT 1 FROM monthly_rollup LIMIT 1")).fetchone() is None
+    db_instance.session.rollback()
+    return empty
@@ -0,0 +1,228 @@
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Shared HTTP client for the LLM provider (Gemini).
+# One keep-alive connection pool per process instead of a new TLS handshake per
+# call, explicit connect/read timeouts, jittered retries on transient failures,
+# and a circuit breaker that fails fast while the provider is down so requests
+# stop queueing behind a dead upstream.
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """The LLM call failed (after retries) or the response could not be used."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed: calls go through. After 'failure_threshold' failures in a row it
+    opens and rejects calls for 'reset_timeout' seconds, then lets one trial
+    call through (half-open): success closes it, failure opens it again.
+    A trial the provider answers with a client error (4xx) also closes it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may be made now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return True
+            # Open, or half-open with the trial call still in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """
+    POSTs JSON to the provider through a pooled requests.Session.
+    Thread-safe; one instance is shared by the request handlers and the advisor job pool.
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=60, max_retries=2, backoff_base=0.5,
+                 backoff_cap=8.0, pool_size=10, breaker=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # Retries are handled here (with jitter and the breaker), not by urllib3
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0}
+        self.observers = []
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to sleep before retry number 'attempt' (full jitter, honouring Retry-After)."""
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), self.backoff_cap)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def add_observer(self, observe):
+        """Registers observe(seconds, success), called after every completed or failed call."""
+        self.observers.append(observe)
+
+    def _send(self, url, payload, stream, started):
+        """
+        Sends the request, retrying connection errors, timeouts and RETRY_STATUSES.
+        Returns the successful response; the caller records the outcome on the breaker.
+        """
+        # Encoded first: once allow() has let a half-open trial through, every way out must _record it
+        body = json.dumps(payload)
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError("The AI provider is unavailable right now. Please try again shortly.")
+
+        self._count("requests")
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(url, data=body, headers={"Content-Type": "application/json"},
+                                             timeout=self.timeout, stream=stream)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = LLMError(f"AI provider returned HTTP {response.status_code}")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = LLMError(f"Could not reach the AI provider: {e}")
+            except requests.exceptions.RequestException as e:
+                # Other HTTP errors (400, 403, ...) won't get better by retrying, and they
+                # mean our request or key is wrong rather than the provider being down:
+                # an answer shows the provider is up, so it closes the breaker
+                if response is not None:
+                    response.close()
+                self._record(False, started, reachable=response is not None)
+                raise LLMError(f"AI provider rejected the request: {e}")
+
+            if response is not None:
+                response.close()
+            if attempt == self.max_retries:
+                break
+            self._count("retries")
+            time.sleep(self._backoff(attempt, response))
+
+        self._record(False, started)
+        raise error
+
+    def _record(self, success, started=None, reachable=False):
+        """
+        Counts a finished call and reports it to the breaker: a success or a failed
+        call the provider did answer ('reachable') closes it, any other failure counts
+        towards opening it. Either way a half-open trial call ends here.
+        """
+        if success or reachable:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        self._count("successes" if success else "failures")
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            for observe in self.observers:
+                observe(elapsed, success)
+
+    def post_json(self, url, payload):
+        """POSTs 'payload' and returns the decoded JSON response. Raises LLMError."""
+        started = time.perf_counter()
+        response = self._send(url, payload, stream=False, started=started)
+        try:
+            result = response.json()
+        except ValueError as e:
+            self._record(False, started)
+            raise LLMError(f"AI provider sent an invalid response: {e}")
+        self._record(True, started)
+        return result
+
+    def stream_lines(self, url, payload):
+        """
+        POSTs 'payload' and yields the response body line by line as it arrives.
+        Only the connection is retried: once lines have been yielded, a failure raises LLMError.
+        """
+        started = time.perf_counter()
+        response = self._send(url, payload, stream=True, started=started)
+        try:
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    yield line
+        except requests.exceptions.RequestException as e:
+            self._record(False, started)
+            raise LLMError(f"Lost the connection to the AI provider: {e}")
+        except GeneratorExit:
+            # Our client went away mid-stream; the provider itself was fine
+            self._record(True, started)
+            raise
+        self._record(True, started)
+
+    def metrics(self):
+        """Snapshot of the call counters and breaker state (latencies go to the observers)."""
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "circuit_state": self.breaker.state}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """
+    Returns the process-wide LLMClient, built on first use from the environment:
+    LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT (falls back to GEMINI_TIMEOUT), LLM_MAX_RETRIES,
+    LLM_POOL_SIZE, LLM_BREAKER_THRESHOLD and LLM_BREAKER_RESET (seconds).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient(
+                connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", 3.05)),
+                read_timeout=float(os.getenv("LLM_READ_TIMEOUT", os.getenv("GEMINI_TIMEOUT", 60))),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+                pool_size=int(os.getenv("LLM_POOL_SIZE", 10)),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", 5)),
+                    reset_timeout=float(os.getenv("LLM_BREAKER_RESET", 30)),
+                ),
+            )
+        return _client
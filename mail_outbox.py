@@ -0,0 +1,285 @@
+import os
+import random
+import smtplib
+import threading
+import time
+
+from flask_mail import Connection, Message
+from sqlalchemy import text
+
+
+# Durable outbound mail queue.
+# Requests only INSERT into mail_outbox; a sender thread in each process claims
+# due messages in batches (FOR UPDATE SKIP LOCKED, so workers never send the same
+# message twice) and sends them over one SMTP connection kept open between
+# batches. Failed messages are retried with exponential backoff and end up in
+# the 'dead' state after MAIL_OUTBOX_MAX_ATTEMPTS or on a permanent SMTP error.
+
+# Statuses: pending (waiting or due), sending (claimed by a sender), sent, dead
+OUTBOX_STATUSES = ("pending", "sending", "sent", "dead")
+
+
+class OutboxConnection(Connection):
+    """Flask-Mail connection whose SMTP socket has a timeout, so a stuck server can't hang the sender."""
+
+    def __init__(self, mail_state, timeout):
+        super().__init__(mail_state)
+        self.timeout = timeout
+
+    def configure_host(self):
+        if self.mail.use_ssl:
+            host = smtplib.SMTP_SSL(self.mail.server, self.mail.port, timeout=self.timeout)
+        else:
+            host = smtplib.SMTP(self.mail.server, self.mail.port, timeout=self.timeout)
+        host.set_debuglevel(int(self.mail.debug))
+        if self.mail.use_tls:
+            host.starttls()
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+        return host
+
+
+def _is_permanent(error):
+    """SMTP 5xx replies (also when refusing the recipient) won't succeed on a retry; 4xx ones may."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class MailOutbox:
+    """
+    Queues mail in the database and drains it from a background thread.
+    'app' gives the sender thread an application context; 'mail' is the Flask-Mail instance.
+    """
+
+    def __init__(self, app, db_instance, mail, batch_size=50, poll_interval=5.0, max_attempts=6,
+                 backoff_base=30.0, backoff_cap=3600.0, claim_timeout=300, idle_close=60.0,
+                 smtp_timeout=10.0, retention_days=7):
+        self.app = app
+        self.db = db_instance
+        self.mail = mail
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.claim_timeout = claim_timeout
+        self.idle_close = idle_close
+        self.smtp_timeout = smtp_timeout
+        self.retention_days = retention_days
+
+        self._wake = threading.Event()
+        self._thread = None
+        self._connection = None
+        self._last_used = 0.0
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"sent": 0, "retried": 0, "dead": 0, "reconnects": 0}
+        self.observers = []
+
+    # --- producer side ---
+    def enqueue(self, recipient, subject, body, sender=None):
+        """Stores a message for sending and commits. Returns the outbox id."""
+        message_id = self.db.session.execute(text("""
+            INSERT INTO mail_outbox (recipient, sender, subject, body)
+            VALUES (:recipient, :sender, :subject, :body)
+            RETURNING id
+        """), {"recipient": recipient, "sender": sender or self.app.config.get("MAIL_DEFAULT_SENDER"),
+               "subject": subject, "body": body}).scalar()
+        self.db.session.commit()
+        self._wake.set()
+        return message_id
+
+    # --- sender thread ---
+    def start(self):
+        """Starts this process's sender thread (once)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mail-outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            sent_any = False
+            try:
+                with self.app.app_context():
+                    try:
+                        sent_any = self.drain_once()
+                        self._purge_old()
+                    finally:
+                        self.db.session.remove()
+            except Exception as e:
+                print(f"Warning: mail outbox sender failed: {e}")
+            if not sent_any:
+                if self._connection is not None and time.monotonic() - self._last_used > self.idle_close:
+                    self._close()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim(self):
+        """Marks up to batch_size due messages as 'sending' and returns them (including stale claims)."""
+        rows = self.db.session.execute(text("""
+            UPDATE mail_outbox
+            SET status = 'sending', attempts = attempts + 1, claimed_at = NOW()
+            WHERE id IN (
+                SELECT id FROM mail_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                   OR (status = 'sending' AND claimed_at < NOW() - make_interval(secs => :claim_timeout))
+                ORDER BY id
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, recipient, sender, subject, body, attempts
+        """), {"batch_size": self.batch_size, "claim_timeout": self.claim_timeout}).mappings().fetchall()
+        self.db.session.commit()
+        return rows
+
+    def _renew_claim(self, row):
+        """
+        Moves the claim on 'row' to now, right before sending it, so it can't go
+        stale mid-send. False if the claim already went stale and another sender
+        took the message over (its attempts count moved on): then it's theirs to send.
+        """
+        renewed = self.db.session.execute(text("""
+            UPDATE mail_outbox SET claimed_at = NOW()
+            WHERE id = :id AND status = 'sending' AND attempts = :attempts
+            RETURNING id
+        """), {"id": row["id"], "attempts": row["attempts"]}).fetchone()
+        self.db.session.commit()
+        return renewed is not None
+
+    def drain_once(self):
+        """Claims and sends one batch. Returns True if there was anything to send."""
+        rows = self._claim()
+        for row in rows:
+            # A batch can take longer than claim_timeout to get through (each send may
+            # wait up to smtp_timeout), so the rows at its end may have been reclaimed
+            if not self._renew_claim(row):
+                continue
+            started = time.perf_counter()
+            try:
+                self._send(row)
+            except Exception as e:
+                self._observe(time.perf_counter() - started, False)
+                self._failed(row, e)
+                continue
+            self._observe(time.perf_counter() - started, True)
+            self.db.session.execute(text("""
+                UPDATE mail_outbox SET status = 'sent', sent_at = NOW(), last_error = NULL WHERE id = :id
+            """), {"id": row["id"]})
+            self.db.session.commit()
+            self._count("sent")
+        return bool(rows)
+
+    def _send(self, row):
+        message = Message(row["subject"], sender=row["sender"], recipients=[row["recipient"]], body=row["body"])
+        reused = self._connection is not None
+        try:
+            self._connect().send(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            if not reused:
+                raise
+            # The kept-open connection went stale (server idle timeout, network); reconnect once
+            self._close()
+            self._count("reconnects")
+            self._connect().send(message)
+        self._last_used = time.monotonic()
+
+    def _failed(self, row, error):
+        permanent = _is_permanent(error)
+        if permanent or row["attempts"] >= self.max_attempts:
+            self.db.session.execute(text("""
+                UPDATE mail_outbox SET status = 'dead', last_error = :error WHERE id = :id
+            """), {"id": row["id"], "error": str(error)[:1000]})
+            self._count("dead")
+            print(f"Warning: mail {row['id']} to {row['recipient']} dead-lettered after {row['attempts']} attempts: {error}")
+        else:
+            delay = random.uniform(0.5, 1.0) * min(self.backoff_cap, self.backoff_base * 2 ** (row["attempts"] - 1))
+            self.db.session.execute(text("""
+                UPDATE mail_outbox
+                SET status = 'pending', last_error = :error, next_attempt_at = NOW() + make_interval(secs => :delay)
+                WHERE id = :id
+            """), {"id": row["id"], "error": str(error)[:1000], "delay": delay})
+            self._count("retried")
+        self.db.session.commit()
+        if not permanent:
+            # Don't reuse a connection that just failed
+            self._close()
+
+    def _connect(self):
+        if self._connection is None:
+            connection = OutboxConnection(self.app.extensions["mail"], self.smtp_timeout)
+            self._connection = connection.__enter__()
+        return self._connection
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+
+    def _purge_old(self):
+        """Deletes sent messages older than the retention period (at most hourly)."""
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        self.db.session.execute(text("""
+            DELETE FROM mail_outbox WHERE status = 'sent' AND sent_at < NOW() - make_interval(days => :days)
+        """), {"days": self.retention_days})
+        self.db.session.commit()
+
+    # --- metrics ---
+    def add_observer(self, observe):
+        """Registers observe(seconds, success), called after each send attempt."""
+        self.observers.append(observe)
+
+    def _observe(self, seconds, success):
+        for observe in self.observers:
+            observe(seconds, success)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def queue_depth(self):
+        """
+        {status: message count} across all processes (sent messages are left out).
+        Reads on its own connection, so it is safe to call from request teardown
+        without touching the request's session.
+        """
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT status, COUNT(*) FROM mail_outbox WHERE status != 'sent' GROUP BY status
+            """)).fetchall()
+        depth = {status: 0 for status in OUTBOX_STATUSES if status != "sent"}
+        depth.update({status: count for status, count in rows})
+        return depth
+
+    def metrics(self):
+        """This process's send counters (send times go to the observers)."""
+        with self._lock:
+            return dict(self.counters)
+
+
+def create_mail_outbox(app, db_instance, mail):
+    """
+    Builds the outbox from the environment and starts its sender thread unless
+    MAIL_OUTBOX_SENDER is false. MAIL_OUTBOX_BATCH_SIZE, MAIL_OUTBOX_POLL_INTERVAL
+    (seconds), MAIL_OUTBOX_MAX_ATTEMPTS, MAIL_OUTBOX_BACKOFF (first retry delay,
+    doubling), MAIL_OUTBOX_IDLE_CLOSE (seconds an unused SMTP connection stays open),
+    MAIL_TIMEOUT (SMTP socket timeout) and MAIL_OUTBOX_RETENTION_DAYS.
+    """
+    outbox = MailOutbox(
+        app, db_instance, mail,
+        batch_size=int(os.getenv("MAIL_OUTBOX_BATCH_SIZE", 50)),
+        poll_interval=float(os.getenv("MAIL_OUTBOX_POLL_INTERVAL", 5)),
+        max_attempts=int(os.getenv("MAIL_OUTBOX_MAX_ATTEMPTS", 6)),
+        backoff_base=float(os.getenv("MAIL_OUTBOX_BACKOFF", 30)),
+        idle_close=float(os.getenv("MAIL_OUTBOX_IDLE_CLOSE", 60)),
+        smtp_timeout=float(os.getenv("MAIL_TIMEOUT", 10)),
+        retention_days=int(os.getenv("MAIL_OUTBOX_RETENTION_DAYS", 7)),
+    )
+    if os.getenv("MAIL_OUTBOX_SENDER", "True").lower() in ('true', '1', 't'):
+        outbox.start()
+    return outbox
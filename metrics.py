@@ -0,0 +1,253 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+# Application metrics in Prometheus text format.
+# Each process keeps its own counters and histograms. With several gunicorn
+# workers, set METRICS_DIR: every worker then writes its values to
+# METRICS_DIR/metrics-<pid>.json (at most every METRICS_FLUSH_INTERVAL seconds
+# and whenever /metrics is scraped) and /metrics adds up the files of all
+# workers, so any worker can answer a scrape with the totals.
+
+# Latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+MAIL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "cashcompass_http_requests_total": ("counter", "HTTP requests by route, method and status.", None),
+    "cashcompass_http_request_duration_seconds": ("histogram", "Time to produce a response, by route.", LATENCY_BUCKETS),
+    "cashcompass_db_time_seconds": ("histogram", "Time spent in SQL statements per request, by route.", LATENCY_BUCKETS),
+    "cashcompass_db_statements_total": ("counter", "SQL statements executed, by route.", None),
+    "cashcompass_metrics_cache_requests_total": ("counter", "Financial metrics cache lookups by result (hit/miss).", None),
+    "cashcompass_llm_request_duration_seconds": ("histogram", "AI provider call latency by outcome.", LLM_BUCKETS),
+    "cashcompass_llm_calls_total": ("counter", "AI provider calls by result (success, failure, retry, rejected).", None),
+    "cashcompass_llm_circuit_open": ("gauge", "1 while the AI provider circuit breaker is open or half-open.", None),
+    "cashcompass_db_pool_checked_out": ("gauge", "Database connections currently in use.", None),
+    "cashcompass_db_pool_overflow": ("gauge", "Database connections open above the pool size.", None),
+    "cashcompass_db_pool_size": ("gauge", "Configured database pool size.", None),
+    "cashcompass_db_pool_checkout_wait_seconds_total": ("counter", "Total time spent waiting for a pool connection.", None),
+    "cashcompass_db_pool_checkouts_total": ("counter", "Pool checkouts.", None),
+    "cashcompass_db_pool_timeouts_total": ("counter", "Checkouts that gave up after pool_timeout.", None),
+    "cashcompass_mail_outbox_messages": ("gauge", "Outbox messages by status (pending, sending, dead).", None),
+    "cashcompass_mail_send_results_total": ("counter", "Outbox send outcomes (sent, retried, dead).", None),
+    "cashcompass_mail_send_duration_seconds": ("histogram", "SMTP send time per message by outcome.", MAIL_BUCKETS),
+    "cashcompass_password_hash_duration_seconds": ("histogram", "Password hashing time by operation (check, generate).", HASH_BUCKETS),
+    "cashcompass_password_hash_queue_seconds": ("histogram", "Time password hashes waited for a hashing slot.", HASH_BUCKETS),
+    "cashcompass_password_hashes_total": ("counter", "Password hash operations (checks, generates, rehashes, busy).", None),
+    "cashcompass_password_hash_in_flight": ("gauge", "Password hashes queued or running in the hashing pool.", None),
+    "cashcompass_rate_limit_decisions_total": ("counter", "Rate limiter decisions by route class and result (allowed, limited).", None),
+    "cashcompass_rate_limit_checks_total": ("counter", "Rate limit checks.", None),
+    "cashcompass_rate_limit_check_seconds_total": ("counter", "Total time spent in rate limit checks (limiter overhead).", None),
+    "cashcompass_rate_limit_backend_errors_total": ("counter", "Rate limit checks that failed in the backend and let the request through.", None),
+}
+
+# Gauges describing shared state (the same value seen from every worker): merged with max, not summed
+SHARED_GAUGES = {"cashcompass_mail_outbox_messages"}
+
+# Gauges in other workers' files older than this are ignored (the worker is gone)
+GAUGE_STALE_SECONDS = 120
+
+
+class MetricsRegistry:
+    """Thread-safe per-process store of counters, gauges and histograms keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}  # name -> {labels tuple: value or [bucket counts..., sum, count]}
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            series = self.values.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def set(self, name, labels=(), value=0):
+        """Sets a gauge, or a counter maintained elsewhere (e.g. MetricsCache.hits)."""
+        with self._lock:
+            self.values.setdefault(name, {})[labels] = value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self._lock:
+            series = self.values.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def dump(self):
+        """JSON-serialisable copy: {name: [[labels, value], ...]}."""
+        with self._lock:
+            return {name: [[list(map(list, labels)), value] for labels, value in series.items()]
+                    for name, series in self.values.items()}
+
+
+def merge(dumps):
+    """Adds up dumps from several processes into {name: {labels tuple: value}}."""
+    merged = {}
+    for dump in dumps:
+        for name, series in dump.items():
+            target = merged.setdefault(name, {})
+            for labels, value in series:
+                labels = tuple(map(tuple, labels))
+                if isinstance(value, list):
+                    current = target.get(labels) or [0] * len(value)
+                    target[labels] = [a + b for a, b in zip(current, value)]
+                elif name in SHARED_GAUGES:
+                    target[labels] = max(target.get(labels, value), value)
+                else:
+                    target[labels] = target.get(labels, 0) + value
+    return merged
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = ",".join(f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                       for key, value in pairs)
+    return "{" + escaped + "}"
+
+
+def render(merged):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        series = merged.get(name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in sorted(series.items()):
+            if metric_type == "histogram":
+                # observe() increments every bucket whose bound fits, so counts are already cumulative
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class AppMetrics:
+    """Collects request, DB, cache, LLM and pool metrics for one process and serves /metrics."""
+
+    def __init__(self, metrics_dir=None, flush_interval=10):
+        self.registry = MetricsRegistry()
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._last_flush = 0.0
+        self._collectors = []
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+
+    def init_app(self, app, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def add_collector(self, collect):
+        """Registers collect(registry), called before each flush/scrape to copy values kept elsewhere."""
+        self._collectors.append(collect)
+        return collect
+
+    # --- request and DB timing ---
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_db_seconds = 0.0
+        g.metrics_db_statements = 0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "metrics_started" in g:
+            conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if started and has_request_context() and "metrics_started" in g:
+            g.metrics_db_seconds += time.perf_counter() - started.pop()
+            g.metrics_db_statements += 1
+
+    def _finish_request(self, response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        # The URL rule, not the path, keeps one series per route (/api/income/<int:item_id>)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        self.registry.inc("cashcompass_http_requests_total",
+                          (("route", route), ("method", request.method), ("status", str(response.status_code))))
+        self.registry.observe("cashcompass_http_request_duration_seconds", (("route", route),), time.perf_counter() - started)
+        self.registry.observe("cashcompass_db_time_seconds", (("route", route),), g.pop("metrics_db_seconds", 0.0))
+        self.registry.inc("cashcompass_db_statements_total", (("route", route),), g.pop("metrics_db_statements", 0))
+        if self.metrics_dir and time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+        return response
+
+    # --- LLM calls (see llm_client.on_llm_call) ---
+    def observe_llm_call(self, seconds, success):
+        self.registry.observe("cashcompass_llm_request_duration_seconds",
+                              (("outcome", "success" if success else "failure"),), seconds)
+
+    # --- export ---
+    def _collect(self):
+        for collect in self._collectors:
+            try:
+                collect(self.registry)
+            except Exception as e:
+                print(f"Warning: metrics collector failed: {e}")
+
+    def flush(self):
+        """Writes this process's values to METRICS_DIR (atomically, via rename)."""
+        self._collect()
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.metrics_dir, f"metrics-{os.getpid()}.json")
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.registry.dump(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Warning: could not write metrics file {path}: {e}")
+
+    def exposition(self):
+        """Prometheus text for all workers (or just this process without METRICS_DIR)."""
+        if not self.metrics_dir:
+            self._collect()
+            return render(merge([self.registry.dump()]))
+
+        self.flush()
+        dumps = []
+        now = time.time()
+        for path in glob.glob(os.path.join(self.metrics_dir, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    dump = json.load(f)
+                stale = now - os.path.getmtime(path) > GAUGE_STALE_SECONDS
+            except (OSError, ValueError):
+                continue
+            if stale:
+                # Counters of exited workers still count; their gauges no longer describe anything
+                dump = {name: series for name, series in dump.items() if METRICS.get(name, ("gauge",))[0] != "gauge"}
+            dumps.append(dump)
+        return render(merge(dumps))
+
+
+def create_app_metrics():
+    """Builds the metrics collector from METRICS_DIR and METRICS_FLUSH_INTERVAL (seconds)."""
+    return AppMetrics(
+        metrics_dir=os.getenv("METRICS_DIR") or None,
+        flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", 10)),
+    )
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+import copy
+import os
+import pickle
+import threading
+import time
+
+
+# Per-user cache for the _get_all_financial_metrics snapshot.
+# Entries expire after a TTL and are dropped explicitly whenever the user writes
+# to income, expenses, budget, savings or debt (see ledger.on_ledger_commit).
+# Each drop also moves the key's generation on: a snapshot computed from before
+# the drop carries the old generation and is never stored, so a compute racing
+# a write can't put stale totals back into the cache.
+
+class InProcessCacheBackend:
+    """
+    Thread-safe LRU cache with per-entry TTL, local to one worker process.
+    With several gunicorn workers each keeps its own copy, so an invalidation
+    only reaches the worker that handled the write; the TTL bounds staleness elsewhere.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generations = {}  # key -> generation given by its last delete
+        self._last_generation = 0
+        # Generation of the keys whose own one was forgotten, to keep _generations bounded
+        self._generation_floor = 0
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.get(key, self._generation_floor)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Hand out a copy so callers can't mutate the cached snapshot
+        return copy.deepcopy(value)
+
+    def set(self, key, value, ttl, generation=None):
+        """Stores 'value' unless the key was deleted since generation(key) returned 'generation'."""
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, self._generation_floor):
+                return
+            self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._last_generation += 1
+            self._generations[key] = self._last_generation
+            if len(self._generations) > self.max_entries:
+                # Forget the keys with nothing cached. The floor moves past their generations,
+                # so a compute that started before their last delete still can't store
+                forgotten = [key for key in self._generations if key not in self._entries]
+                self._generation_floor = max(self._generations.pop(key) for key in forgotten)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """
+    Cache stored in a Redis-compatible server (Redis, Valkey, KeyDB, ...) so every
+    gunicorn worker shares entries and invalidations. Eviction is left to the
+    server's maxmemory-policy (use allkeys-lru); TTLs are set per key.
+    Entries are stored with the generation they were computed at and read back
+    together with the current one, so a write from a worker that lost the race
+    with another worker's delete is ignored. Requires the optional 'redis' package.
+    """
+
+    # Seconds a generation counter outlives its last delete, far longer than any compute
+    GENERATION_TTL = 86400
+
+    def __init__(self, url, key_prefix="cashcompass:metrics:v2:"):
+        import redis  # Optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.key_prefix = key_prefix
+
+    def _generation_key(self, key):
+        return f"{self.key_prefix}generation:{key}"
+
+    def generation(self, key):
+        return int(self.client.get(self._generation_key(key)) or 0)
+
+    def get(self, key):
+        raw, generation = self.client.mget(self.key_prefix + key, self._generation_key(key))
+        if raw is None:
+            return None
+        stored_generation, value = pickle.loads(raw)
+        return value if stored_generation == int(generation or 0) else None
+
+    def set(self, key, value, ttl, generation=None):
+        if generation is None:
+            generation = self.generation(key)
+        self.client.set(self.key_prefix + key, pickle.dumps((generation, value)), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incr(self._generation_key(key))
+        pipeline.expire(self._generation_key(key), self.GENERATION_TTL)
+        pipeline.delete(self.key_prefix + key)
+        pipeline.execute()
+
+
+class MetricsCache:
+    """Get-or-compute wrapper around a cache backend, keyed by user id."""
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id):
+        # Session ids are ints, JWT identities are strings: normalise both
+        return str(int(user_id))
+
+    def get_or_compute(self, user_id, compute):
+        """Returns the cached snapshot for 'user_id', calling compute() on a miss."""
+        key = self._key(user_id)
+        generation = None
+        if self.backend is not None:
+            try:
+                value = self.backend.get(key)
+                if value is None:
+                    # Taken before computing: an invalidate() from here on keeps the result out
+                    generation = self.backend.generation(key)
+            except Exception as e:
+                print(f"Warning: metrics cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        value = compute()
+        if generation is not None:
+            try:
+                self.backend.set(key, value, self.ttl, generation)
+            except Exception as e:
+                print(f"Warning: metrics cache write failed: {e}")
+        return value
+
+    def invalidate(self, user_id):
+        """Drops the cached snapshot for 'user_id', along with any still being computed."""
+        if self.backend is None:
+            return
+        try:
+            self.backend.delete(self._key(user_id))
+        except Exception as e:
+            print(f"Warning: metrics cache invalidation failed: {e}")
+
+
+def create_metrics_cache():
+    """
+    Builds the metrics cache from the environment:
+    METRICS_CACHE_BACKEND ('memory', 'redis' or 'none'), METRICS_CACHE_URL,
+    METRICS_CACHE_TTL (seconds) and METRICS_CACHE_MAX_ENTRIES (memory backend).
+    """
+    backend_name = os.getenv("METRICS_CACHE_BACKEND", "memory").lower()
+    ttl = int(os.getenv("METRICS_CACHE_TTL", 60))
+    max_entries = int(os.getenv("METRICS_CACHE_MAX_ENTRIES", 1024))
+
+    backend = None
+    if backend_name == "redis":
+        try:
+            backend = RedisCacheBackend(os.getenv("METRICS_CACHE_URL", "redis://localhost:6379/0"))
+        except Exception as e:
+            print(f"Warning: Redis metrics cache unavailable ({e}), falling back to in-process cache.")
+            backend = InProcessCacheBackend(max_entries)
+    elif backend_name == "memory":
+        backend = InProcessCacheBackend(max_entries)
+
+    return MetricsCache(backend, ttl=ttl)
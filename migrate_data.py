@@ -1,9 +1,15 @@
-import sqlite3
+import argparse
+import json
 import os
-from dotenv import load_dotenv
-import psycopg2
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
-from datetime import datetime, date # Import date for handling Date objects
+
+from dotenv import load_dotenv
+
+from ledger import LEDGER_TABLES, ROLLUP_REBUILD_SQL
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,6 +17,9 @@ load_dotenv()
 # --- Configuration ---
 SQLITE_DB_PATH = 'budget.db' # Path to your existing SQLite database file
 POSTGRES_DATABASE_URL = os.getenv("DATABASE_URL")
+CHECKPOINT_PATH = 'migrate_checkpoint.json' # Progress of the last run, used to resume
+BATCH_SIZE = 5000 # Rows read from SQLite and written to the target per round trip
+WORKERS = 4 # Tables loaded at the same time once 'users' is done
 
 # Define the tables to migrate and their column names
 # IMPORTANT: These column names now precisely match your SQLite schema and the PostgreSQL DDL.
@@ -28,22 +37,37 @@ TABLE_SCHEMAS = {
     "read_user_alerts": ["user_id", "alert_hash", "read_at"],
 }
 
-# --- Connection Functions ---
-def connect_sqlite(db_path):
-    """Connects to the SQLite database."""
-    try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row # Allows accessing columns by name
-        print(f"Connected to SQLite database: {db_path}")
-        return conn
-    except sqlite3.Error as e:
-        print(f"Error connecting to SQLite: {e}")
-        return None
+# Every other table references users, so users is loaded first and the rest in parallel
+PARENT_TABLES = ["users"]
 
-def connect_postgres(db_url):
-    """Connects to the PostgreSQL database."""
-    try:
-        url = urlparse(db_url)
+# Re-running a batch after a crash relies on ON CONFLICT DO NOTHING,
+# which only skips rows the target can recognise: by id, or for tables without an id
+# by these columns, which must carry a unique index in the target (checked before loading).
+UNIQUE_KEYS = {
+    "read_user_alerts": ["user_id", "alert_hash"],
+}
+
+# Ledger tables folded into monthly_rollup, which the app reads its totals from (see ledger.py)
+ROLLUP_TABLES = [table for table, spec in LEDGER_TABLES.items() if spec["kind"] is not None]
+
+
+# --- Targets ---
+class PostgresTarget:
+    """
+    PostgreSQL destination. Batches go in with psycopg2's execute_values as one
+    multi-row INSERT ... ON CONFLICT DO NOTHING, so re-running a chunk after a
+    crash is harmless. Date strings and numbers are cast by PostgreSQL itself.
+    """
+
+    def __init__(self, db_url):
+        self.db_url = db_url
+
+    def __str__(self):
+        return f"PostgreSQL database {urlparse(self.db_url).path[1:]}"
+
+    def connect(self):
+        import psycopg2  # Only needed for PostgreSQL targets, so offline SQLite runs work without it
+        url = urlparse(self.db_url)
         conn = psycopg2.connect(
             database=url.path[1:], # remove leading '/'
             user=url.username,
@@ -52,120 +76,358 @@ def connect_postgres(db_url):
             port=url.port
         )
         conn.autocommit = False # We'll manage transactions manually
-        print(f"Connected to PostgreSQL database: {url.path[1:]}")
         return conn
-    except psycopg2.Error as e:
-        print(f"Error connecting to PostgreSQL: {e}")
-        return None
-
-# --- Data Migration Function ---
-def migrate_data():
-    """Migrates data from SQLite to PostgreSQL."""
-    sqlite_conn = None
-    pg_conn = None
+
+    def prepare_table(self, conn, table_name, create_sql):
+        """Tables are created by the schema script (see README)."""
+
+    def insert_batch(self, conn, table_name, columns, rows):
+        """Inserts rows and commits. Returns the number of rows actually inserted."""
+        from psycopg2.extras import execute_values
+        insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s ON CONFLICT DO NOTHING"
+        with conn.cursor() as cur:
+            # A single page, so rowcount covers the whole batch
+            execute_values(cur, insert_sql, rows, page_size=len(rows))
+            inserted = cur.rowcount
+        conn.commit()
+        return inserted
+
+    def insert_rows_one_by_one(self, conn, table_name, columns, rows):
+        """
+        Fallback for a batch that failed: each row in its own savepoint, so a bad
+        row is reported and skipped without losing the rows around it.
+        Returns (inserted, rejected).
+        """
+        placeholders = ', '.join(['%s'] * len(columns))
+        insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT DO NOTHING"
+        inserted = rejected = 0
+        with conn.cursor() as cur:
+            for row in rows:
+                cur.execute("SAVEPOINT migrate_row")
+                try:
+                    cur.execute(insert_sql, row)
+                    inserted += cur.rowcount
+                    cur.execute("RELEASE SAVEPOINT migrate_row")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT migrate_row")
+                    rejected += 1
+                    print(f"  Warning: Skipped row {row[:2]}... in {table_name}: {str(e).strip()}")
+        conn.commit()
+        return inserted, rejected
+
+    def has_unique_index(self, conn, table_name, columns):
+        """True if the table has a unique index (or primary key) on exactly 'columns'."""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT 1 FROM pg_index i
+                WHERE i.indrelid = %s::regclass AND i.indisunique
+                  AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text) FROM pg_attribute a
+                       WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)) = %s
+            """, (table_name, sorted(columns)))
+            found = cur.fetchone() is not None
+        conn.commit()
+        return found
+
+    def reset_sequence(self, conn, table_name):
+        """Moves the id sequence past the migrated ids so new rows don't collide."""
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL)
+                FROM {table_name}
+            """)
+        conn.commit()
+
+    def rebuild_monthly_rollup(self, conn, user_ids):
+        """Recomputes monthly_rollup for 'user_ids' from their ledger rows, like ledger.rebuild_monthly_rollup."""
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM monthly_rollup WHERE user_id = ANY(%(user_ids)s)", {"user_ids": user_ids})
+            for table in ROLLUP_TABLES:
+                spec = LEDGER_TABLES[table]
+                # Same statement as the app's, with psycopg2's parameter style
+                rebuild_sql = ROLLUP_REBUILD_SQL.format(
+                    table=table, label=spec["label"], user_filter="user_id = ANY(%(user_ids)s)"
+                ).replace(":kind", "%(kind)s")
+                cur.execute(rebuild_sql, {"kind": spec["kind"], "user_ids": user_ids})
+        conn.commit()
+        return True
+
+
+class SQLiteTarget:
+    """
+    SQLite destination, for offline runs and tests. Missing tables are created
+    from the source's own CREATE TABLE statements. Inserts use ON CONFLICT DO
+    NOTHING as for PostgreSQL (not INSERT OR IGNORE, which would also drop rows
+    failing NOT NULL or CHECK constraints without reporting them). SQLite tracks
+    AUTOINCREMENT ids itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return f"SQLite database {self.path}"
+
+    def connect(self):
+        # Several workers share the file; wait for the write lock instead of failing
+        return sqlite3.connect(self.path, timeout=60)
+
+    def prepare_table(self, conn, table_name, create_sql):
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+        if not exists and create_sql:
+            conn.execute(create_sql)
+            conn.commit()
+
+    def insert_batch(self, conn, table_name, columns, rows):
+        placeholders = ', '.join(['?'] * len(columns))
+        before = conn.total_changes
+        conn.executemany(f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT DO NOTHING", rows)
+        conn.commit()
+        return conn.total_changes - before
+
+    def insert_rows_one_by_one(self, conn, table_name, columns, rows):
+        placeholders = ', '.join(['?'] * len(columns))
+        insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT DO NOTHING"
+        inserted = rejected = 0
+        for row in rows:
+            try:
+                inserted += conn.execute(insert_sql, row).rowcount
+            except sqlite3.Error as e:
+                rejected += 1
+                print(f"  Warning: Skipped row {row[:2]}... in {table_name}: {e}")
+        conn.commit()
+        return inserted, rejected
+
+    def has_unique_index(self, conn, table_name, columns):
+        # An INTEGER PRIMARY KEY is the rowid itself and has no entry in index_list
+        primary_key = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall() if row[5]]
+        if sorted(primary_key) == sorted(columns):
+            return True
+        for _, index_name, unique, *_ in conn.execute(f"PRAGMA index_list({table_name})").fetchall():
+            indexed = [row[2] for row in conn.execute(f"PRAGMA index_info({index_name})").fetchall()]
+            if unique and sorted(indexed) == sorted(columns):
+                return True
+        return False
+
+    def reset_sequence(self, conn, table_name):
+        """Nothing to do: SQLite derives the next id from the table."""
+
+    def rebuild_monthly_rollup(self, conn, user_ids):
+        """Nothing to do: an offline copy has no monthly_rollup. Returns False."""
+        return False
+
+
+def make_target(target):
+    """PostgreSQL for postgres:// URLs, SQLite for sqlite:/// URLs or plain file paths."""
+    if target.startswith(("postgres://", "postgresql://")):
+        return PostgresTarget(target)
+    if target.startswith("sqlite:///"):
+        return SQLiteTarget(target[len("sqlite:///"):])
+    return SQLiteTarget(target)
+
+
+# --- Checkpoints ---
+class Checkpoint:
+    """
+    Per-table progress (last SQLite rowid committed to the target, row counts),
+    saved to a JSON file after every batch so an interrupted run can resume.
+    """
+
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.state = {}
+        self._lock = threading.Lock()
+        if not reset and path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+            print(f"Resuming from checkpoint {path}")
+
+    def table(self, table_name):
+        with self._lock:
+            return dict(self.state.get(table_name, {"last_rowid": 0, "inserted": 0, "rejected": 0, "done": False}))
+
+    def update(self, table_name, **progress):
+        with self._lock:
+            self.state.setdefault(table_name, {"last_rowid": 0, "inserted": 0, "rejected": 0, "done": False}).update(progress)
+            if not self.path:
+                return
+            # Write then rename, so a crash never leaves a half-written checkpoint
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+# --- Data Migration Functions ---
+def rollup_user_ids(source_path, tables):
+    """Users with rows in the given tables that feed monthly_rollup, read from the SQLite source."""
+    source_conn = sqlite3.connect(source_path)
     try:
-        # 1. Connect to databases
-        sqlite_conn = connect_sqlite(SQLITE_DB_PATH)
-        if not sqlite_conn:
-            print("Failed to connect to SQLite. Exiting.")
-            return
+        user_ids = set()
+        for table_name in [t for t in tables if t in ROLLUP_TABLES]:
+            try:
+                user_ids.update(row[0] for row in source_conn.execute(f"SELECT DISTINCT user_id FROM {table_name}"))
+            except sqlite3.OperationalError:
+                pass  # Not in the source, nothing migrated
+        return sorted(user_ids)
+    finally:
+        source_conn.close()
+
 
-        pg_conn = connect_postgres(POSTGRES_DATABASE_URL)
-        if not pg_conn:
-            print("Failed to connect to PostgreSQL. Exiting.")
-            return
+def rebuild_rollups(source_path, target, tables):
+    """
+    Rebuilds monthly_rollup for the users whose income, expenses or budget were
+    migrated: the rows went in without the app, so their monthly totals were
+    never updated. Returns True when done, False when it is left to `flask rebuild-rollups`.
+    """
+    user_ids = rollup_user_ids(source_path, tables)
+    if not user_ids:
+        return True
+    conn = target.connect()
+    try:
+        rebuilt = target.rebuild_monthly_rollup(conn, user_ids)
+        if rebuilt:
+            print(f"monthly_rollup rebuilt for {len(user_ids)} users.")
+        return rebuilt
+    except Exception as e:
+        print(f"Warning: could not rebuild monthly_rollup: {str(e).strip()}")
+        return False
+    finally:
+        conn.close()
 
-        pg_cur = pg_conn.cursor()
 
-        # 2. Iterate through tables and migrate data
-        for table_name, columns in TABLE_SCHEMAS.items():
-            print(f"\n--- Migrating data for table: {table_name} ---")
-            sqlite_cur = sqlite_conn.cursor()
+def migrate_table(source_path, target, table_name, columns, checkpoint, batch_size):
+    """
+    Streams one table from SQLite in rowid order, batch_size rows at a time,
+    and writes each batch to the target in its own transaction.
+    Returns (inserted, rejected, seconds).
+    """
+    progress = checkpoint.table(table_name)
+    if progress["done"]:
+        print(f"[{table_name}] already migrated, skipping.")
+        return progress["inserted"], progress["rejected"], 0.0
 
+    # Connections are per thread: sqlite3 and psycopg2 connections aren't shared across workers
+    source_conn = sqlite3.connect(source_path)
+    target_conn = target.connect()
+    started = time.perf_counter()
+    inserted, rejected, last_rowid = progress["inserted"], progress["rejected"], progress["last_rowid"]
+    try:
+        create_sql = source_conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+        ).fetchone()
+        if create_sql is None:
+            print(f"[{table_name}] not found in SQLite. Skipping.")
+            return 0, 0, 0.0
+        target.prepare_table(target_conn, table_name, create_sql[0])
+        unique_key = UNIQUE_KEYS.get(table_name, ["id"])
+        if not target.has_unique_index(target_conn, table_name, unique_key):
+            raise ValueError(f"{table_name} in {target} has no unique index on ({', '.join(unique_key)}); "
+                             f"resuming or re-running would insert duplicate rows")
+
+        while True:
+            # Keyset over rowid: each chunk is an index range, however far into the table
+            batch = source_conn.execute(
+                f"SELECT rowid, {', '.join(columns)} FROM {table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, batch_size)
+            ).fetchall()
+            if not batch:
+                break
+            rows = [row[1:] for row in batch]
             try:
-                # Fetch data from SQLite
-                sqlite_cur.execute(f"SELECT {', '.join(columns)} FROM {table_name}")
-                rows = sqlite_cur.fetchall()
-
-                if not rows:
-                    print(f"No data found in SQLite table '{table_name}'. Skipping.")
-                    continue
-
-                # Prepare INSERT statement for PostgreSQL
-                placeholders = ', '.join(['%s'] * len(columns)) # PostgreSQL uses %s placeholders
-                insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-
-                # Execute inserts into PostgreSQL
-                inserted_count = 0
-                for row in rows:
-                    data = list(row) # Convert Row object to list
-
-                    processed_data = []
-                    for col_name, value in zip(columns, data):
-                        # Convert date/datetime strings to datetime/date objects for PostgreSQL
-                        if 'date' in col_name and value:
-                            try:
-                                # SQLite's DATETIME and TIMESTAMP often store as 'YYYY-MM-DD HH:MM:SS'
-                                # SQLite's DATE often stores as 'YYYY-MM-DD'
-                                # SQLite's TEXT DEFAULT CURRENT_TIMESTAMP for 'date' in income/savings can be 'YYYY-MM-DD HH:MM:SS'
-                                if len(value) >= 19 and '-' in value and ':' in value: # YYYY-MM-DD HH:MM:SS
-                                    processed_data.append(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'))
-                                elif len(value) == 10 and '-' in value: # YYYY-MM-DD
-                                    processed_data.append(datetime.strptime(value, '%Y-%m-%d').date()) # Store as date object
-                                else:
-                                    processed_data.append(value) # Keep as is if unparsable date format
-                            except (ValueError, TypeError) as e:
-                                print(f"  Warning: Could not parse date value '{value}' for column '{col_name}'. Keeping as is. Error: {e}")
-                                processed_data.append(value)
-                        # Ensure numeric values are floats/decimals for PostgreSQL NUMERIC columns
-                        elif col_name in ['amount', 'current_balance', 'original_amount',
-                                          'interest_rate', 'minimum_payment', 'target_amount']:
-                            try:
-                                processed_data.append(float(value) if value is not None else None)
-                            except (ValueError, TypeError) as e:
-                                print(f"  Warning: Could not convert numeric value '{value}' for column '{col_name}' to float. Keeping as is. Error: {e}")
-                                processed_data.append(value)
-                        else:
-                            processed_data.append(value)
-
-                    try:
-                        pg_cur.execute(insert_sql, processed_data)
-                        inserted_count += 1
-                    except psycopg2.IntegrityError as e:
-                        # Handle duplicate key errors (e.g., for 'users' table 'id' or 'username')
-                        # or other constraint violations.
-                        print(f"  Warning: Skipped row due to IntegrityError (e.g., duplicate key, data type mismatch, or null violation) in {table_name}: {e}")
-                        pg_conn.rollback() # Rollback the problematic statement, but continue with others
-                    except Exception as e:
-                        print(f"  Error inserting row into {table_name}: {e}")
-                        pg_conn.rollback() # Rollback current transaction on other errors
-                        raise # Re-raise to stop migration for this table if critical
-
-                pg_conn.commit() # Commit after each table is successfully migrated
-                print(f"Successfully inserted {inserted_count} rows into '{table_name}'.")
+                inserted += target.insert_batch(target_conn, table_name, columns, rows)
+            except Exception as e:
+                target_conn.rollback()
+                print(f"[{table_name}] batch after rowid {last_rowid} failed ({str(e).strip()}), retrying row by row.")
+                batch_inserted, batch_rejected = target.insert_rows_one_by_one(target_conn, table_name, columns, rows)
+                inserted += batch_inserted
+                rejected += batch_rejected
+            last_rowid = batch[-1][0]
+            checkpoint.update(table_name, last_rowid=last_rowid, inserted=inserted, rejected=rejected)
+
+        if "id" in columns:
+            target.reset_sequence(target_conn, table_name)
+        checkpoint.update(table_name, done=True)
+    finally:
+        source_conn.close()
+        target_conn.close()
+
+    elapsed = time.perf_counter() - started
+    rate = (inserted - progress["inserted"]) / elapsed if elapsed > 0 else 0
+    print(f"[{table_name}] {inserted} rows inserted, {rejected} rejected in {elapsed:.1f}s ({rate:,.0f} rows/sec).")
+    return inserted, rejected, elapsed
+
+
+def migrate_data(source_path=SQLITE_DB_PATH, target_url=POSTGRES_DATABASE_URL, tables=None,
+                 batch_size=BATCH_SIZE, workers=WORKERS, checkpoint_path=CHECKPOINT_PATH, reset=False):
+    """
+    Migrates data from SQLite to PostgreSQL (or another SQLite file).
+    Parent tables load first, the independent tables after them in parallel.
+    Returns {table: (inserted, rejected)}.
+    """
+    if not os.path.exists(source_path):
+        print(f"SQLite database not found: {source_path}. Exiting.")
+        return {}
+    if not target_url:
+        print("No target database configured (set DATABASE_URL or pass --target). Exiting.")
+        return {}
+
+    target = make_target(target_url)
+    checkpoint = Checkpoint(checkpoint_path, reset=reset)
+    tables = tables or list(TABLE_SCHEMAS)
+    print(f"Migrating {', '.join(tables)} from SQLite database {source_path} to {target}")
 
+    results = {}
+    started = time.perf_counter()
+
+    for table_name in [t for t in PARENT_TABLES if t in tables]:
+        inserted, rejected, _ = migrate_table(source_path, target, table_name, TABLE_SCHEMAS[table_name], checkpoint, batch_size)
+        results[table_name] = (inserted, rejected)
+
+    independent = [t for t in tables if t not in PARENT_TABLES]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(migrate_table, source_path, target, table_name, TABLE_SCHEMAS[table_name], checkpoint, batch_size): table_name
+            for table_name in independent
+        }
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                inserted, rejected, _ = future.result()
+                results[table_name] = (inserted, rejected)
             except Exception as e:
+                # Progress so far is in the checkpoint; the next run picks the table up again
                 print(f"Error migrating table '{table_name}': {e}")
-                pg_conn.rollback() # Ensure rollback if an error occurs for the whole table
-                print("Transaction rolled back for current table.")
-                # You might want to break here if one table's failure should stop all migration
-                # For now, it will try the next table.
 
-    except Exception as e:
-        print(f"An unexpected error occurred during migration: {e}")
-        if pg_conn:
-            pg_conn.rollback() # Final rollback if something goes wrong overall
-            print("PostgreSQL transaction rolled back.")
-    finally:
-        # Close connections
-        if sqlite_conn:
-            sqlite_conn.close()
-            print("SQLite connection closed.")
-        if pg_conn:
-            pg_conn.close()
-            print("PostgreSQL connection closed.")
+    elapsed = time.perf_counter() - started
+    total = sum(inserted for inserted, _ in results.values())
+    print(f"\nMigrated {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed > 0 else 0:,.0f} rows/sec).")
+    failed = [t for t in tables if t not in results]
+    if failed:
+        print(f"Incomplete tables: {', '.join(failed)}. Run again to resume from {checkpoint_path}.")
+    else:
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        if not rebuild_rollups(source_path, target, tables):
+            print("Run `flask rebuild-rollups` against the PostgreSQL database before starting the app, "
+                  "or its dashboards will show no totals for the migrated data.")
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate CashCompass data from SQLite to PostgreSQL.")
+    parser.add_argument("--source", default=SQLITE_DB_PATH, help="SQLite database to read (default: %(default)s)")
+    parser.add_argument("--target", default=POSTGRES_DATABASE_URL,
+                        help="postgresql:// URL, or sqlite:///path / a file path for an offline SQLite target (default: DATABASE_URL)")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLE_SCHEMAS), help="Only migrate these tables")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Progress file used to resume (default: %(default)s)")
+    parser.add_argument("--reset", action="store_true", help="Ignore an existing checkpoint and start over")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_args()
     print("Starting data migration from SQLite to PostgreSQL...")
-    migrate_data()
+    migrate_data(args.source, args.target, args.tables, args.batch_size, args.workers, args.checkpoint, args.reset)
     print("\nMigration process completed.")
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, date
+import base64
+import json
+
+from sqlalchemy import text
+
+from helpers import period_filter
+
+
+# Keyset pagination for the JSON ledger listings (/api/income, /api/expenses).
+# Pages are ordered by (date, id); the cursor encodes the last row returned, so
+# each page is one index range scan from where the previous one stopped instead
+# of an OFFSET that re-reads every earlier row.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Columns a client may ask for with ?fields=, per table
+PAGEABLE_FIELDS = {
+    "income": ("id", "user_id", "source", "amount", "date"),
+    "expenses": ("id", "user_id", "category", "amount", "date"),
+}
+
+# Query arguments that switch a listing from "every row" to paged mode
+PAGING_ARGS = ("limit", "cursor")
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just after 'row' (needs its 'date' and 'id')."""
+    row_date = row["date"]
+    if isinstance(row_date, datetime):
+        row_date = row_date.date()
+    raw = json.dumps([row_date.isoformat(), row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns the (date, id) encoded by encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_date, cursor_id = json.loads(raw)
+        return date.fromisoformat(cursor_date), int(cursor_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"{name} must be a YYYY-MM-DD date")
+
+
+def list_ledger_rows(db_instance, table, user_id, args):
+    """
+    Lists a user's rows from a pageable ledger table, driven by the request
+    query arguments:
+      month / year          - the existing period filter
+      start_date / end_date - inclusive YYYY-MM-DD bounds
+      fields                - comma separated subset of PAGEABLE_FIELDS[table]
+      limit / cursor        - keyset paging; without either, every matching row is returned
+    Returns (rows, next_cursor); next_cursor is None on the last page or when not paging.
+    Raises ValueError on invalid arguments.
+    """
+    allowed = PAGEABLE_FIELDS[table]
+
+    fields = allowed
+    if args.get("fields"):
+        fields = tuple(field.strip() for field in args["fields"].split(",") if field.strip())
+        unknown = [field for field in fields if field not in allowed]
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    # The cursor is built from date and id, so they are always read
+    select_columns = [column for column in allowed if column in fields or column in ("id", "date")]
+
+    period_sql, params = period_filter(args.get("month"), args.get("year"))
+    params["user_id"] = user_id
+    where_sql = "user_id = :user_id" + period_sql
+
+    if args.get("start_date"):
+        where_sql += " AND date >= :from_date"
+        params["from_date"] = _parse_date(args["start_date"], "start_date")
+    if args.get("end_date"):
+        where_sql += " AND date < :to_date"
+        params["to_date"] = _parse_date(args["end_date"], "end_date") + timedelta(days=1)
+
+    paging = any(args.get(arg) for arg in PAGING_ARGS)
+    limit_sql = ""
+    if paging:
+        try:
+            limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if args.get("cursor"):
+            params["cursor_date"], params["cursor_id"] = decode_cursor(args["cursor"])
+            where_sql += " AND (date, id) > (:cursor_date, :cursor_id)"
+        # One extra row tells us whether another page follows
+        limit_sql = " LIMIT :limit_plus_one"
+        params["limit_plus_one"] = limit + 1
+
+    result = db_instance.session.execute(text(f"""
+        SELECT {', '.join(select_columns)} FROM {table}
+        WHERE {where_sql}
+        ORDER BY date, id{limit_sql}
+    """), params)
+    rows = [dict(row) for row in result.mappings()]
+
+    next_cursor = None
+    if paging and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+
+    if set(select_columns) != set(fields):
+        rows = [{field: row[field] for field in fields} for row in rows]
+    return rows, next_cursor
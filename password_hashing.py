@@ -0,0 +1,146 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Password hashing off the request threads.
+# Hashing is deliberately slow CPU work; run on a request thread it holds the
+# GIL and stalls every other request on the worker. PasswordHasher sends it to
+# a small process pool instead, caps how many hashes may be queued or running
+# at once (callers wait at most PASSWORD_HASH_QUEUE_TIMEOUT for a slot, then get
+# HashingBusy), and tells login code when a stored hash uses outdated
+# parameters so it can be upgraded transparently.
+
+
+class HashingBusy(Exception):
+    """Every hashing slot stayed taken for the whole queue timeout."""
+
+
+def _hash_method(password_hash):
+    """'scrypt:32768:8:1' from 'scrypt:32768:8:1$salt$hash'."""
+    return password_hash.split("$", 1)[0]
+
+
+class PasswordHasher:
+    """
+    Runs check_password_hash/generate_password_hash on a process pool.
+    workers=0 hashes on the calling thread (still within the concurrency cap).
+    """
+
+    def __init__(self, workers=2, max_in_flight=8, queue_timeout=5.0, method="scrypt"):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.method = method
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._current_method = None
+        self.counters = {"checks": 0, "generates": 0, "rehashes": 0, "busy": 0}
+        self.in_flight = 0
+        self.observers = []
+
+    def _executor(self):
+        # Created on first use in each process: gunicorn forks workers after import,
+        # and a pool inherited across fork would point at the parent's processes
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                # spawn, not fork: forking a multi-threaded worker can copy held locks.
+                # Spawned children re-import the __main__ script, so start the app with
+                # gunicorn or `flask run`, not `python app.py`
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, operation, function, *args):
+        queued = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count("busy")
+            raise HashingBusy("Too many sign-ins at once. Please try again in a moment.")
+        started = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            if self.workers > 0:
+                return self._executor().submit(function, *args).result()
+            return function(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            self._observe(operation, started - queued, time.perf_counter() - started)
+
+    def check(self, password_hash, password):
+        """check_password_hash on the pool. Raises HashingBusy."""
+        self._count("checks")
+        return self._run("check", check_password_hash, password_hash, password)
+
+    def generate(self, password):
+        """generate_password_hash with the configured method on the pool. Raises HashingBusy."""
+        self._count("generates")
+        return self._run("generate", generate_password_hash, password, self.method)
+
+    def current_method(self):
+        """Full parameter string new hashes get (e.g. 'scrypt:32768:8:1'), worked out once."""
+        if self._current_method is None:
+            self._current_method = _hash_method(generate_password_hash("", self.method))
+        return self._current_method
+
+    def needs_rehash(self, password_hash):
+        """True when 'password_hash' was made with other parameters than new hashes get."""
+        return _hash_method(password_hash) != self.current_method()
+
+    def verify_and_upgrade(self, password_hash, password, save_hash):
+        """
+        Checks a login password; when it matches but the stored hash is outdated,
+        computes a new one and passes it to save_hash(new_hash). Upgrade failures
+        are logged, never turned into a failed login.
+        """
+        if not self.check(password_hash, password):
+            return False
+        if self.needs_rehash(password_hash):
+            try:
+                save_hash(self.generate(password))
+                self._count("rehashes")
+            except Exception as e:
+                print(f"Warning: could not upgrade password hash: {e}")
+        return True
+
+    # --- metrics ---
+    def add_observer(self, observe):
+        """Registers observe(operation, queue_seconds, hash_seconds), called after each hash."""
+        self.observers.append(observe)
+
+    def _observe(self, operation, queue_seconds, hash_seconds):
+        for observe in self.observers:
+            observe(operation, queue_seconds, hash_seconds)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def metrics(self):
+        """Counters and hashes in progress (queue and hash times go to the observers)."""
+        with self._lock:
+            return {**self.counters, "in_flight": self.in_flight}
+
+
+def create_password_hasher():
+    """
+    Builds the hasher from the environment: PASSWORD_HASH_WORKERS (processes,
+    0 = hash on the request thread), PASSWORD_HASH_MAX_IN_FLIGHT (hashes queued or
+    running per process), PASSWORD_HASH_QUEUE_TIMEOUT (seconds to wait for a slot)
+    and PASSWORD_HASH_METHOD (werkzeug method string, e.g. 'scrypt' or 'pbkdf2:sha256:600000').
+    """
+    return PasswordHasher(
+        workers=int(os.getenv("PASSWORD_HASH_WORKERS", 2)),
+        max_in_flight=int(os.getenv("PASSWORD_HASH_MAX_IN_FLIGHT", 8)),
+        queue_timeout=float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 5)),
+        method=os.getenv("PASSWORD_HASH_METHOD", "scrypt"),
+    )
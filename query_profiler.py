@@ -0,0 +1,160 @@
+from collections import deque, Counter
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+# Opt-in per-request SQL profiler.
+# With QUERY_PROFILER on, every sampled request records each statement it runs
+# (through the ORM session, execute_query_helper or the ledger/alerts modules alike,
+# since they all reach the cursor), then reports the statement count, DB time,
+# slowest statements and repeated statement shapes (N+1 patterns) as a
+# Server-Timing header, one structured log line, and on the /debug/queries page.
+
+# Statements kept per request for the slowest-statement list
+SLOWEST_KEPT = 5
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_BIND_LISTS = re.compile(r"\((?:\s*(?:%\(\w+\)s|\?|:\w+)\s*,?)+\)")
+_REPEATED_ROWS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_THIS_FILE = os.path.abspath(__file__)
+_APP_DIR = os.path.dirname(_THIS_FILE)
+
+
+def fingerprint(statement):
+    """Shape of a statement: literals and bind lists replaced, whitespace collapsed."""
+    statement = _LITERALS.sub("?", statement)
+    statement = _BIND_LISTS.sub("(?)", statement)
+    statement = _REPEATED_ROWS.sub("(?), ...", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _call_site():
+    """file:line of the innermost app frame (outside SQLAlchemy and this module) issuing the statement."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and filename != _THIS_FILE and "site-packages" not in filename:
+            return f"{os.path.basename(filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return None
+
+
+class RequestProfile:
+    """Statements observed during one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statement_count = 0
+        self.db_seconds = 0.0
+        self.fingerprints = Counter()
+        self.call_sites = {}
+        self.slowest = []
+
+    def record(self, statement, seconds, call_site):
+        shape = fingerprint(statement)
+        self.statement_count += 1
+        self.db_seconds += seconds
+        self.fingerprints[shape] += 1
+        self.call_sites.setdefault(shape, call_site)
+        self.slowest.append((seconds, shape, call_site))
+        if len(self.slowest) > SLOWEST_KEPT * 4:
+            self.slowest = sorted(self.slowest, reverse=True)[:SLOWEST_KEPT]
+
+    def summary(self, repeat_threshold):
+        total_seconds = time.perf_counter() - self.started
+        return {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "statements": self.statement_count,
+            "db_ms": round(self.db_seconds * 1000, 2),
+            "total_ms": round(total_seconds * 1000, 2),
+            "slowest": [
+                {"ms": round(seconds * 1000, 2), "statement": shape, "call_site": call_site}
+                for seconds, shape, call_site in sorted(self.slowest, reverse=True)[:SLOWEST_KEPT]
+            ],
+            "repeated": [
+                {"count": count, "statement": shape, "call_site": self.call_sites.get(shape)}
+                for shape, count in self.fingerprints.most_common()
+                if count >= repeat_threshold
+            ],
+        }
+
+
+class QueryProfiler:
+    """Installs the engine listeners and request hooks; keeps recent profiles for the debug page."""
+
+    def __init__(self, sample_rate=1.0, repeat_threshold=5, history=100):
+        self.sample_rate = sample_rate
+        self.repeat_threshold = repeat_threshold
+        self.recent = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    @staticmethod
+    def _current():
+        return g.get("query_profile") if has_request_context() else None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._current() is not None:
+            conn.info.setdefault("query_profiler_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = self._current()
+        started = conn.info.get("query_profiler_started")
+        if profile is None or not started:
+            return
+        profile.record(statement, time.perf_counter() - started.pop(), _call_site())
+
+    def _start_request(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g.query_profile = RequestProfile()
+
+    def _finish_request(self, response):
+        profile = g.pop("query_profile", None)
+        if profile is None:
+            return response
+        summary = profile.summary(self.repeat_threshold)
+
+        response.headers.add("Server-Timing", f'db;dur={summary["db_ms"]};desc="{summary["statements"]} statements"')
+        response.headers.add("Server-Timing", f'app;dur={summary["total_ms"]}')
+        print("query_profile " + json.dumps({**summary, "status": response.status_code}))
+        with self._lock:
+            self.recent.appendleft({**summary, "status": response.status_code, "at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        return response
+
+    def recent_profiles(self):
+        with self._lock:
+            return list(self.recent)
+
+
+def init_query_profiler(app, engine):
+    """
+    Enables the profiler when QUERY_PROFILER is true. QUERY_PROFILER_SAMPLE is the
+    fraction of requests profiled (0-1), QUERY_PROFILER_REPEAT the count at which a
+    repeated statement is flagged as N+1, QUERY_PROFILER_HISTORY the requests kept
+    for /debug/queries. Returns the profiler, or None when disabled.
+    """
+    if os.getenv("QUERY_PROFILER", "False").lower() not in ('true', '1', 't'):
+        return None
+    profiler = QueryProfiler(
+        sample_rate=float(os.getenv("QUERY_PROFILER_SAMPLE", 1.0)),
+        repeat_threshold=int(os.getenv("QUERY_PROFILER_REPEAT", 5)),
+        history=int(os.getenv("QUERY_PROFILER_HISTORY", 100)),
+    )
+    profiler.init_app(app, engine)
+    return profiler
@@ -0,0 +1,225 @@
+from collections import OrderedDict
+from functools import wraps
+import math
+import os
+import threading
+import time
+
+from flask import jsonify, make_response, request, session
+from flask_jwt_extended import get_jwt_identity
+
+from helpers import apology
+
+
+# Token-bucket rate limiting per client and route class.
+# Each route class (auth, ai, read) has a bucket per client that holds up to
+# 'capacity' requests and refills evenly over 'period' seconds. A request takes
+# one token; when the bucket is empty it is answered 429 with Retry-After.
+# Auth routes are keyed by client IP, the others by the signed-in user.
+
+# Route class -> default "<requests>/<seconds>" (override with RATE_LIMIT_<CLASS>)
+ROUTE_CLASSES = {
+    "auth": "10/60",   # login, registration, password reset: per IP
+    "ai": "5/60",      # AI advisor generations: per user
+    "read": "120/60",  # dashboards and alert polling: per user
+}
+
+
+def parse_limit(spec):
+    """'10/60' -> (capacity 10, 10/60 tokens per second). None for '', '0' or 'off' (no limit)."""
+    if not spec or spec.strip().lower() in ("0", "off", "none"):
+        return None
+    count, _, seconds = spec.partition("/")
+    capacity = int(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+class InProcessRateLimitBackend:
+    """
+    Buckets in a dict local to one worker process (a few microseconds per check).
+    With N gunicorn workers a client can get up to N times the limit, depending
+    on how requests are spread; use the redis backend for an exact shared limit.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated at)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate):
+        """Takes a token. Returns 0 when allowed, else the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+                # Least recently used buckets are the ones most likely to be full again
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+                self._buckets.move_to_end(key)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+        return (1 - tokens) / refill_rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# KEYS[1] bucket, ARGV capacity and refill rate (tokens per ms); returns the wait in ms (0 = allowed).
+# Uses the server clock so every worker refills the same bucket at the same rate.
+_TAKE_TOKEN_SCRIPT = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + (now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return wait
+"""
+
+
+class RedisRateLimitBackend:
+    """
+    Buckets in a Redis-compatible server, updated atomically by a Lua script, so
+    the limit holds across all gunicorn workers and hosts. Costs one round trip
+    per limited request. Requires the optional 'redis' package.
+    """
+
+    def __init__(self, url, key_prefix="cashcompass:ratelimit:"):
+        import redis  # Optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.key_prefix = key_prefix
+        self._take = self.client.register_script(_TAKE_TOKEN_SCRIPT)
+
+    def take(self, key, capacity, refill_rate):
+        wait_ms = self._take(keys=[self.key_prefix + key], args=[capacity, refill_rate / 1000])
+        return int(wait_ms) / 1000
+
+
+class RateLimiter:
+    """
+    Applies the route class limits through the limit() decorator and counts its
+    decisions and its own overhead. A failing backend lets requests through.
+    """
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits  # route class -> (capacity, refill rate) or None
+        self._lock = threading.Lock()
+        self.decisions = {}  # (route class, 'allowed'/'limited') -> count
+        self.checks = 0
+        self.check_ns = 0
+        self.backend_errors = 0
+
+    def client_key(self, identity):
+        """'user:<id>' for 'jwt'/'session' identities (IP when signed out), 'ip:<address>' otherwise."""
+        if identity == "jwt":
+            user_id = get_jwt_identity()
+        elif identity == "session":
+            user_id = session.get("user_id")
+        else:
+            user_id = None
+        return f"user:{user_id}" if user_id is not None else f"ip:{request.remote_addr}"
+
+    def check(self, route_class, identity):
+        """Seconds the current request must wait (0 when it may proceed)."""
+        started = time.perf_counter_ns()
+        limit = self.limits.get(route_class)
+        wait = 0
+        if limit is not None and self.backend is not None:
+            try:
+                wait = self.backend.take(f"{route_class}:{self.client_key(identity)}", *limit)
+            except Exception as e:
+                print(f"Warning: rate limiter backend failed, allowing request: {e}")
+                with self._lock:
+                    self.backend_errors += 1
+        elapsed = time.perf_counter_ns() - started
+        decision = (route_class, "limited" if wait else "allowed")
+        with self._lock:
+            self.checks += 1
+            self.check_ns += elapsed
+            self.decisions[decision] = self.decisions.get(decision, 0) + 1
+        return wait
+
+    def limit(self, route_class, identity="ip", methods=None):
+        """
+        Decorate views to rate limit them under 'route_class'. 'identity' is 'ip',
+        'jwt' (place below @jwt_required()) or 'session' (place below @login_required).
+        'methods' restricts the limit to those HTTP methods (e.g. only POST of a form page).
+        """
+
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    wait = self.check(route_class, identity)
+                    if wait:
+                        return too_many_requests(wait)
+                return f(*args, **kwargs)
+
+            return decorated_function
+
+        return decorator
+
+    def metrics(self):
+        """Decision counts per route class, checks and the time spent in them."""
+        with self._lock:
+            return {
+                "decisions": dict(self.decisions),
+                "checks": self.checks,
+                "check_seconds": self.check_ns / 1e9,
+                "mean_check_us": self.check_ns / self.checks / 1000 if self.checks else None,
+                "backend_errors": self.backend_errors,
+            }
+
+
+def too_many_requests(wait):
+    """429 with Retry-After: JSON for the API, the apology page for the web pages."""
+    message = "Too many requests. Please try again in a moment."
+    if request.path.startswith("/api/"):
+        response = make_response(jsonify({"msg": message}), 429)
+    else:
+        response = make_response(apology(message, 429))
+    response.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def create_rate_limiter():
+    """
+    Builds the limiter from the environment: RATE_LIMIT_BACKEND ('memory', 'redis'
+    or 'none'), RATE_LIMIT_URL (redis backend), RATE_LIMIT_MAX_KEYS (memory backend)
+    and RATE_LIMIT_AUTH / RATE_LIMIT_AI / RATE_LIMIT_READ ("<requests>/<seconds>", or 'off').
+    """
+    backend_name = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    limits = {name: parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+              for name, default in ROUTE_CLASSES.items()}
+
+    backend = None
+    if backend_name == "redis":
+        try:
+            backend = RedisRateLimitBackend(os.getenv("RATE_LIMIT_URL", "redis://localhost:6379/0"))
+        except Exception as e:
+            print(f"Warning: Redis rate limiter unavailable ({e}), falling back to in-process buckets.")
+            backend = InProcessRateLimitBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000)))
+    elif backend_name == "memory":
+        backend = InProcessRateLimitBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000)))
+
+    return RateLimiter(backend, limits)
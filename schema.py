@@ -0,0 +1,173 @@
+from sqlalchemy import text
+
+from ledger import LEDGER_TABLES
+
+
+# Idempotent DDL applied when the app starts.
+# The base tables (users, income, expenses, ...) are created by hand (see README);
+# this list only holds the support tables and columns the app manages itself.
+# Indexes are in INDEXES below: they are built by `flask ensure-indexes`, not at startup.
+SCHEMA_STATEMENTS = [
+    # Per-user monthly totals maintained on every ledger write (see ledger.py)
+    """
+    CREATE TABLE IF NOT EXISTS monthly_rollup (
+        user_id INTEGER NOT NULL,
+        month DATE NOT NULL,
+        kind TEXT NOT NULL,
+        label TEXT NOT NULL,
+        total NUMERIC NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, kind, label)
+    )
+    """,
+    # Materialised alerts per user and rule family (see alerts.py)
+    """
+    CREATE TABLE IF NOT EXISTS user_alert_state (
+        user_id INTEGER NOT NULL,
+        rule TEXT NOT NULL,
+        alerts TEXT NOT NULL,
+        computed_on DATE NOT NULL,
+        PRIMARY KEY (user_id, rule)
+    )
+    """,
+    # The user's data version the stored alerts were computed at
+    "ALTER TABLE user_alert_state ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0",
+    # Per-user data version behind the JSON API ETags (see etags.py)
+    """
+    CREATE TABLE IF NOT EXISTS user_data_version (
+        user_id INTEGER PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    # Background AI advisor jobs and the advice cache keyed by prompt hash (see advisor.py)
+    """
+    CREATE TABLE IF NOT EXISTS advisor_jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        prompt_hash TEXT NOT NULL,
+        status TEXT NOT NULL,
+        advice TEXT,
+        error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        finished_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS advisor_cache (
+        prompt_hash TEXT PRIMARY KEY,
+        advice TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    # Delta sync (see sync.py): every ledger row carries the change sequence number of
+    # the transaction that last wrote it. Adding a column with a constant default only
+    # touches the catalog (PostgreSQL 11+); existing rows read as 0.
+    *[f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0"
+      for table in LEDGER_TABLES],
+    # Last change sequence number per user, and the highest one whose tombstones were purged
+    """
+    CREATE TABLE IF NOT EXISTS user_change_seq (
+        user_id INTEGER PRIMARY KEY,
+        seq BIGINT NOT NULL DEFAULT 0,
+        purged_seq BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    # Deleted ledger rows, so sync clients learn about deletes
+    """
+    CREATE TABLE IF NOT EXISTS sync_tombstones (
+        user_id INTEGER NOT NULL,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        change_seq BIGINT NOT NULL,
+        deleted_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (user_id, table_name, row_id)
+    )
+    """,
+    # Durable outbound mail queue drained by a background sender (see mail_outbox.py)
+    """
+    CREATE TABLE IF NOT EXISTS mail_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        recipient TEXT NOT NULL,
+        sender TEXT,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        claimed_at TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        sent_at TIMESTAMP
+    )
+    """,
+]
+
+
+# Indexes the app relies on, by name: "<table> (<columns>)".
+# Built with CREATE INDEX CONCURRENTLY so a deploy never blocks writes on large ledgers,
+# which can take minutes, so they run from the release step (see Procfile), once per deploy.
+INDEXES = {
+    # Month/year scoped ledger queries filter on (user_id, date) ranges (see helpers.DATE_RANGE_SQL)
+    "idx_income_user_date": "income (user_id, date)",
+    "idx_expenses_user_date": "expenses (user_id, date)",
+    "idx_budget_user_date": "budget (user_id, date)",
+    "idx_advisor_jobs_user_prompt": "advisor_jobs (user_id, prompt_hash)",
+    # Delta sync reads each ledger table by change sequence number (see sync.py)
+    **{f"idx_{table}_user_change_seq": f"{table} (user_id, change_seq)" for table in LEDGER_TABLES},
+    "idx_sync_tombstones_user_seq": "sync_tombstones (user_id, change_seq)",
+    "idx_mail_outbox_due": "mail_outbox (status, next_attempt_at)",
+}
+
+# Which of the given indexes exist, and whether they are valid. A CONCURRENTLY build that
+# fails or is interrupted leaves an INVALID index behind, which IF NOT EXISTS would then skip.
+INDEX_STATE_SQL = """
+    SELECT c.relname AS name, i.indisvalid AS valid
+    FROM pg_class c
+    JOIN pg_index i ON i.indexrelid = c.oid
+    WHERE c.relname = ANY(:names) AND pg_catalog.pg_table_is_visible(c.oid)
+"""
+
+
+def ensure_schema(db_instance):
+    """
+    Applies SCHEMA_STATEMENTS, one statement at a time in autocommit mode.
+    A failing statement (e.g. another gunicorn worker racing on the same table)
+    is logged and skipped so it never prevents the app from starting.
+    """
+    with db_instance.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in SCHEMA_STATEMENTS:
+            try:
+                conn.execute(text(statement))
+            except Exception as e:
+                print(f"Warning: schema statement failed: {statement.strip().splitlines()[0]} - Error: {e}")
+
+
+def index_problems(db_instance):
+    """Names of the INDEXES that are missing or invalid, {name: 'missing' | 'invalid'}."""
+    with db_instance.engine.connect() as conn:
+        valid = {row.name: row.valid for row in conn.execute(text(INDEX_STATE_SQL), {"names": list(INDEXES)})}
+    return {name: "missing" if name not in valid else "invalid"
+            for name in INDEXES if not valid.get(name)}
+
+
+def ensure_indexes(db_instance):
+    """
+    Builds the INDEXES that are missing and rebuilds the invalid ones, concurrently.
+    Meant to run from one process at a time (the release step): an index another
+    session is still building also reads as invalid. Returns the names that failed.
+    """
+    problems = index_problems(db_instance)
+    failed = []
+    with db_instance.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, definition in INDEXES.items():
+            if name not in problems:
+                continue
+            try:
+                if problems[name] == "invalid":
+                    print(f"Rebuilding invalid index {name}")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+            except Exception as e:
+                print(f"Warning: could not build index {name} - Error: {e}")
+                failed.append(name)
+    return failed
@@ -0,0 +1,224 @@
+from collections import OrderedDict
+import os
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+# Session storage.
+# SESSION_BACKEND picks where the session lives:
+#   filesystem - Flask-Session files on this host (the default)
+#   memory     - server-side, in this process (LRU + TTL, swept by a background thread)
+#   redis      - server-side in a Redis-compatible server shared by every worker and host
+#   cookie     - Flask's signed cookie; nothing stored server-side, works across any number of workers
+# Server-side backends only keep a random session id in the cookie, so logging out
+# deletes the session for good. A signed cookie can't be revoked: a copy taken
+# before logout stays valid until it expires, which is why cookie is opt-in.
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict tracking modifications, stored under 'sid'."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid or new_session_id()
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def clear(self):
+        # Login and logout clear the session: issue a fresh id so an old one can't be reused (session fixation)
+        if self.replaced_sid is None and not self.new:
+            self.replaced_sid = self.sid
+        self.sid = new_session_id()
+        super().clear()
+
+
+class MemorySessionBackend:
+    """
+    Sessions in a process-local LRU with per-entry expiry. Only suitable for a
+    single worker process (threads are fine): other processes can't see them.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return data
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._entries[sid] = (time.monotonic() + ttl, data)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def sweep(self):
+        """Drops expired sessions. Returns how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._entries.items() if expires_at < now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+
+class RedisSessionBackend:
+    """
+    Sessions in a Redis-compatible server (Redis, Valkey, KeyDB, ...); the server
+    expires keys itself. Requires the optional 'redis' package.
+    """
+
+    def __init__(self, url, key_prefix="cashcompass:session:"):
+        import redis  # Optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.key_prefix = key_prefix
+
+    def get(self, sid):
+        raw = self.client.get(self.key_prefix + sid)
+        return raw.decode() if raw is not None else None
+
+    def set(self, sid, data, ttl):
+        self.client.set(self.key_prefix + sid, data, ex=max(1, int(ttl)))
+
+    def delete(self, sid):
+        self.client.delete(self.key_prefix + sid)
+
+    def sweep(self):
+        return 0
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface over a get/set/delete backend. Sessions are written
+    only when modified (or when permanent sessions refresh), so a plain page view
+    costs one backend read.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, backend, ttl=7 * 24 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if sid:
+            try:
+                data = self.backend.get(sid)
+            except Exception as e:
+                print(f"Warning: session backend read failed: {e}")
+                data = None
+            if data is not None:
+                return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession(new=True)
+
+    def save_session(self, app, session, response):
+        cookie_name = app.config["SESSION_COOKIE_NAME"]
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        try:
+            if session.replaced_sid:
+                self.backend.delete(session.replaced_sid)
+
+            if not session:
+                if session.modified:
+                    self.backend.delete(session.sid)
+                    response.delete_cookie(cookie_name, domain=domain, path=path)
+                return
+
+            if not self.should_set_cookie(app, session):
+                return
+            self.backend.set(session.sid, self.serializer.dumps(dict(session)), self.ttl)
+        except Exception as e:
+            print(f"Warning: session backend write failed: {e}")
+            return
+
+        response.vary.add("Cookie")
+        response.set_cookie(
+            cookie_name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def start_sweeper(backend, interval):
+    """Runs backend.sweep() every 'interval' seconds on a daemon thread."""
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                backend.sweep()
+            except Exception as e:
+                print(f"Warning: session sweep failed: {e}")
+
+    thread = threading.Thread(target=run, name="session-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def _use_filesystem_sessions(app):
+    from flask_session import Session
+    app.config["SESSION_TYPE"] = "filesystem"
+    Session(app)
+
+
+def configure_sessions(app):
+    """
+    Installs the session backend chosen by the environment:
+    SESSION_BACKEND ('filesystem', 'memory', 'redis' or 'cookie'), SESSION_REDIS_URL,
+    SESSION_TTL (seconds a server-side session lives after its last change),
+    SESSION_MAX_ENTRIES and SESSION_SWEEP_INTERVAL (memory backend).
+    """
+    backend_name = os.getenv("SESSION_BACKEND", "filesystem").lower()
+    ttl = int(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+
+    if backend_name == "cookie":
+        return  # Flask's default signed-cookie interface stays in place
+
+    backend = None
+    if backend_name == "redis":
+        try:
+            backend = RedisSessionBackend(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"))
+        except Exception as e:
+            print(f"Warning: Redis session store unavailable ({e}), falling back to filesystem sessions.")
+    elif backend_name == "memory":
+        backend = MemorySessionBackend(int(os.getenv("SESSION_MAX_ENTRIES", 10000)))
+        start_sweeper(backend, int(os.getenv("SESSION_SWEEP_INTERVAL", 300)))
+
+    if backend is not None:
+        app.session_interface = ServerSideSessionInterface(backend, ttl=ttl)
+    else:
+        _use_filesystem_sessions(app)
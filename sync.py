@@ -0,0 +1,119 @@
+from sqlalchemy import text
+
+from ledger import LEDGER_TABLES
+
+
+# Delta sync for the mobile clients.
+# Every ledger write stamps the rows it touches with the user's next change
+# sequence number (ledger.change_seq) and every delete leaves a tombstone, so
+# "what changed since N" is an index range scan on (user_id, change_seq) per
+# table: the work grows with the number of changes, not the size of the ledger.
+
+SYNC_TABLES = tuple(LEDGER_TABLES)
+
+DEFAULT_SYNC_PAGE_SIZE = 1000
+MAX_SYNC_PAGE_SIZE = 5000
+
+# Days tombstones are kept; clients that last synced before that get a full reset
+TOMBSTONE_RETENTION_DAYS = 90
+
+
+def _sync_position(db_instance, user_id):
+    """(last committed change sequence number, highest purged tombstone number) for the user."""
+    row = db_instance.session.execute(text(
+        "SELECT seq, purged_seq FROM user_change_seq WHERE user_id = :user_id"
+    ), {"user_id": user_id}).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def _page_end(db_instance, params, limit, include_tombstones):
+    """
+    Highest change sequence number to return so a page holds about 'limit' changes.
+    Rows written by one transaction share a number and are never split across pages.
+    Returns (end, has_more).
+    """
+    sources = list(SYNC_TABLES) + (["sync_tombstones"] if include_tombstones else [])
+    branches = " UNION ALL ".join(f"""
+        (SELECT change_seq FROM {source}
+         WHERE user_id = :user_id AND change_seq > :since AND change_seq <= :current
+         ORDER BY change_seq LIMIT :probe)""" for source in sources)
+    sequence_numbers = db_instance.session.execute(text(f"""
+        SELECT change_seq FROM ({branches}) AS changes ORDER BY change_seq LIMIT :probe
+    """), {**params, "probe": limit + 1}).scalars().all()
+    if len(sequence_numbers) <= limit:
+        return params["current"], False
+    cutoff = sequence_numbers[limit]
+    # Stop before the transaction that would overflow the page, unless it is the first one
+    return (cutoff - 1 if cutoff > sequence_numbers[0] else cutoff), True
+
+
+def changes_since(db_instance, user_id, since=None, limit=DEFAULT_SYNC_PAGE_SIZE):
+    """
+    The user's ledger changes after change sequence number 'since':
+      changes    - {table: rows written (inserted or updated) since then}
+      deleted    - {table: ids of rows deleted since then}
+      next_since - the number to send as ?since= next time
+      has_more   - True when the page was cut at 'limit' changes; fetch again with next_since
+      reset      - True when this is a full snapshot (no 'since', or its tombstones were
+                   purged): the client drops its copy before applying this page
+    """
+    user_id = int(user_id)
+    # Read first: rows with numbers up to 'current' are all committed (see ledger.CHANGE_SEQ_SQL)
+    current, purged = _sync_position(db_instance, user_id)
+    reset = since is None or since < purged or since > current
+    # Rows written before sync existed carry 0, so a snapshot starts below it
+    params = {"user_id": user_id, "since": -1 if reset else since, "current": current}
+
+    end, has_more = _page_end(db_instance, params, limit, include_tombstones=not reset)
+    params["end"] = end
+
+    changes = {}
+    for table in SYNC_TABLES:
+        columns = LEDGER_TABLES[table]["columns"]
+        result = db_instance.session.execute(text(f"""
+            SELECT id, {', '.join(columns)}, change_seq FROM {table}
+            WHERE user_id = :user_id AND change_seq > :since AND change_seq <= :end
+            ORDER BY change_seq, id
+        """), params)
+        changes[table] = [dict(row) for row in result.mappings()]
+
+    deleted = {table: [] for table in SYNC_TABLES}
+    if not reset:
+        for table_name, row_id in db_instance.session.execute(text("""
+            SELECT table_name, row_id FROM sync_tombstones
+            WHERE user_id = :user_id AND change_seq > :since AND change_seq <= :end
+            ORDER BY change_seq
+        """), params):
+            deleted[table_name].append(row_id)
+
+    return {
+        "since": since,
+        "next_since": end,
+        "has_more": has_more,
+        "reset": reset,
+        "changes": changes,
+        "deleted": deleted,
+    }
+
+
+def purge_tombstones(db_instance, retention_days=TOMBSTONE_RETENTION_DAYS):
+    """
+    Deletes tombstones older than 'retention_days' and remembers per user the
+    highest number purged, so older ?since= values get a full reset. Commits.
+    Returns the number of tombstones deleted.
+    """
+    purged = db_instance.session.execute(text("""
+        WITH purged AS (
+            DELETE FROM sync_tombstones
+            WHERE deleted_at < NOW() - make_interval(days => :days)
+            RETURNING user_id, change_seq
+        ), marked AS (
+            UPDATE user_change_seq AS u
+            SET purged_seq = GREATEST(u.purged_seq, p.max_seq)
+            FROM (SELECT user_id, MAX(change_seq) AS max_seq FROM purged GROUP BY user_id) AS p
+            WHERE u.user_id = p.user_id
+        )
+        SELECT COUNT(*) FROM purged
+    """), {"days": retention_days}).scalar()
+    db_instance.session.commit()
+    return purged
@@ -0,0 +1,67 @@
+import os
+import sys
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_client
+from stub_server import StubServer
+
+
+# Tests that need PostgreSQL run against TEST_DATABASE_URL (a scratch database
+# holding the base schema from the README; the app only adds its support tables)
+# and are skipped when it isn't set.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# Per-user tables cleaned up after a test user is removed
+USER_TABLES = ("income", "expenses", "budget", "savings", "debt", "monthly_rollup",
+               "sync_tombstones", "user_change_seq", "user_data_version", "user_alert_state",
+               "advisor_jobs")
+
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """The app module, imported against TEST_DATABASE_URL."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    import app
+    return app
+
+
+@pytest.fixture
+def user_id(app_module):
+    """A fresh user, removed with all their rows afterwards."""
+    db = app_module.db
+    with app_module.app.app_context():
+        new_id = db.session.execute(text(
+            "INSERT INTO users (username, password_hash) VALUES (:username, 'x') RETURNING id"
+        ), {"username": f"test_{uuid.uuid4().hex[:12]}"}).scalar()
+        db.session.commit()
+    yield new_id
+    with app_module.app.app_context():
+        db.session.rollback()
+        for table in USER_TABLES:
+            db.session.execute(text(f"DELETE FROM {table} WHERE user_id = :user_id"), {"user_id": new_id})
+        db.session.execute(text("DELETE FROM users WHERE id = :user_id"), {"user_id": new_id})
+        db.session.commit()
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """
+    A stub Gemini (see stub_server.py) behind GEMINI_API_BASE, and a fresh LLM
+    client with short timeouts and no backoff sleeps in place of the shared one.
+    """
+    with StubServer() as server:
+        monkeypatch.setenv("GEMINI_API_BASE", server.url)
+        monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+        monkeypatch.setenv("GEMINI_MODEL", "test-model")
+        monkeypatch.setattr(llm_client, "_client", llm_client.LLMClient(
+            connect_timeout=1, read_timeout=2, max_retries=1, backoff_base=0.001, backoff_cap=0.001))
+        yield server
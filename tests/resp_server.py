@@ -0,0 +1,104 @@
+import socketserver
+import threading
+import time
+
+
+# Minimal Redis-compatible server for the session and metrics cache backend
+# tests, used when TEST_REDIS_URL doesn't point at a real server. It understands
+# the commands RedisSessionBackend and RedisCacheBackend send: GET, MGET, SET
+# (with EX), DEL, INCR(BY), EXPIRE, PING and TTL, with key expiry, plus the
+# HELLO handshake. Anything else gets an error reply, which redis-py ignores
+# for the rest of its handshake (CLIENT SETINFO).
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        resp3 = False
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            resp3 = resp3 or command[0].upper() == b"HELLO"
+            self.wfile.write(self.server.store.execute(command, null=b"_\r\n" if resp3 else b"$-1\r\n"))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line.startswith(b"*"):
+            return None
+        arguments = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+
+class _Store:
+    def __init__(self):
+        self.data = {}  # key -> (value, expires at or None)
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, command, null):
+        name, args = command[0].upper(), command[1:]
+        with self.lock:
+            if name == b"PING":
+                return b"+PONG\r\n"
+            if name == b"HELLO":
+                # Current redis-py opens with HELLO 3; the connection then gets RESP3 nulls
+                return b"%2\r\n$6\r\nserver\r\n$5\r\nredis\r\n$5\r\nproto\r\n:3\r\n"
+            if name in (b"GET", b"MGET"):
+                replies = []
+                for key in args:
+                    entry = self._live(key)
+                    replies.append(null if entry is None else b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0]))
+                return replies[0] if name == b"GET" else b"*%d\r\n" % len(replies) + b"".join(replies)
+            if name == b"SET":
+                expires_at = None
+                if len(args) >= 4 and args[2].upper() == b"EX":
+                    expires_at = time.monotonic() + int(args[3])
+                self.data[args[0]] = (args[1], expires_at)
+                return b"+OK\r\n"
+            if name == b"DEL":
+                deleted = sum(1 for key in args if self._live(key) is not None and self.data.pop(key))
+                return b":%d\r\n" % deleted
+            if name in (b"INCR", b"INCRBY"):
+                entry = self._live(args[0])
+                value = (int(entry[0]) if entry else 0) + (int(args[1]) if name == b"INCRBY" else 1)
+                self.data[args[0]] = (b"%d" % value, entry[1] if entry else None)
+                return b":%d\r\n" % value
+            if name == b"EXPIRE":
+                entry = self._live(args[0])
+                if entry is None:
+                    return b":0\r\n"
+                self.data[args[0]] = (entry[0], time.monotonic() + int(args[1]))
+                return b":1\r\n"
+            if name == b"TTL":
+                entry = self._live(args[0])
+                if entry is None:
+                    return b":-2\r\n"
+                return b":-1\r\n" if entry[1] is None else b":%d\r\n" % round(entry[1] - time.monotonic())
+        return b"-ERR unknown command\r\n"
+
+
+class RespServer:
+    """Serves on 127.0.0.1 (random port) from a thread. Use as a context manager."""
+
+    def __init__(self):
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.store = _Store()
+        self.url = f"redis://127.0.0.1:{self._server.server_address[1]}/0"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
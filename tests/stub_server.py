@@ -0,0 +1,90 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+
+# Fault-injecting HTTP upstream for the LLM client and advisor tests.
+# Each request takes the next scripted reply from 'replies' (a plain 200 {} once
+# they run out). A reply is a dict with any of:
+#   status   - HTTP status (default 200)
+#   headers  - extra response headers
+#   delay    - seconds to wait before answering (to trigger read timeouts)
+#   json     - body to send as JSON
+#   sse      - list of SSE data payloads (dicts), sent as separate chunks
+#   drop     - with 'sse': close the connection after that many events, mid-body
+#   event_delay - with 'sse': seconds to wait after each event
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        stub = self.server.stub
+        reply = stub.next_reply(self.path, body)
+        time.sleep(reply.get("delay", 0))
+        try:
+            if "sse" in reply:
+                self._send_events(reply)
+            else:
+                self._send_json(reply)
+        except (BrokenPipeError, ConnectionResetError):
+            stub.client_disconnects += 1
+
+    def _send_json(self, reply):
+        payload = json.dumps(reply.get("json", {})).encode()
+        self.send_response(reply.get("status", 200))
+        for name, value in reply.get("headers", {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_events(self, reply):
+        self.send_response(reply.get("status", 200))
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for number, event in enumerate(reply["sse"]):
+            if number == reply.get("drop"):
+                # No terminating chunk: the client sees the body cut short
+                self.close_connection = True
+                return
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(reply.get("event_delay", 0))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class StubServer:
+    """A local upstream on 127.0.0.1 (random port), served from a thread. Use as a context manager."""
+
+    def __init__(self, replies=()):
+        self.replies = deque(replies)
+        self.requests = []  # (path, decoded JSON body) per request received
+        self.client_disconnects = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def next_reply(self, path, body):
+        with self._lock:
+            self.requests.append((path, json.loads(body) if body else None))
+            return self.replies.popleft() if self.replies else {}
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
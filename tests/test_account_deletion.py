@@ -0,0 +1,47 @@
+from datetime import date
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import text
+
+from ledger import insert_entry
+from conftest import requires_postgres, USER_TABLES
+
+
+def delete_via_api(app_module, client, user_id):
+    with app_module.app.app_context():
+        token = create_access_token(identity=str(user_id))
+    return client.post("/api/delete_account", json={"password": "secret"},
+                       headers={"Authorization": f"Bearer {token}"})
+
+
+def delete_via_web(app_module, client, user_id):
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client.post("/profile/delete_account", data={"password": "secret"})
+
+
+@requires_postgres
+@pytest.mark.parametrize("delete", [delete_via_api, delete_via_web])
+def test_account_deletion_removes_every_per_user_row(app_module, user_id, delete):
+    db = app_module.db
+    client = app_module.app.test_client()
+    with app_module.app.app_context():
+        db.session.execute(text("UPDATE users SET password_hash = :hash WHERE id = :user_id"),
+                           {"hash": app_module.password_hasher.generate("secret"), "user_id": user_id})
+        insert_entry(db, "income", user_id, {"source": "Salary", "amount": 100, "date": date.today()})
+        db.session.commit()
+        # Materialise alerts and fill the metrics cache
+        app_module.get_financial_alerts(db, user_id, lambda: app_module.get_financial_metrics(user_id))
+
+    response = delete(app_module, client, user_id)
+    assert response.status_code in (200, 302)
+
+    with app_module.app.app_context():
+        for table in USER_TABLES:
+            count = db.session.execute(text(f"SELECT COUNT(*) FROM {table} WHERE user_id = :user_id"),
+                                       {"user_id": user_id}).scalar()
+            assert count == 0, table
+        assert db.session.execute(text("SELECT COUNT(*) FROM users WHERE id = :user_id"),
+                                  {"user_id": user_id}).scalar() == 0
+    assert app_module.metrics_cache.backend.get(str(user_id)) is None
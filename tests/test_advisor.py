@@ -0,0 +1,130 @@
+import hashlib
+import time
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from advisor import AdvisorJobs, AdvisorError, generate_advice, prompt_hash
+from conftest import requires_postgres
+
+
+def answer(advice):
+    return {"json": {"candidates": [{"content": {"parts": [{"text": advice}]}}]}}
+
+
+def test_generate_advice_calls_the_configured_model(gemini):
+    gemini.replies.append(answer("Spend less on coffee."))
+
+    assert generate_advice("How am I doing?") == "Spend less on coffee."
+    path, body = gemini.requests[0]
+    assert path == "/models/test-model:generateContent?key=test-key"
+    assert body["contents"][0]["parts"][0]["text"] == "How am I doing?"
+
+
+@pytest.mark.parametrize("reply, error", [
+    ({"json": {"candidates": []}}, "did not generate"),
+    ({"status": 400}, "rejected"),
+    ({"status": 503}, "HTTP 503"),
+])
+def test_generate_advice_failures(gemini, reply, error):
+    gemini.replies.extend([reply, reply])
+    with pytest.raises(AdvisorError, match=error):
+        generate_advice("How am I doing?")
+
+
+def test_prompt_hash_covers_model_and_prompt(monkeypatch):
+    monkeypatch.setenv("GEMINI_MODEL", "model-a")
+    assert prompt_hash("prompt") == hashlib.sha256(b"model-a\nprompt").hexdigest()
+    monkeypatch.setenv("GEMINI_MODEL", "model-b")
+    assert prompt_hash("prompt") != hashlib.sha256(b"model-a\nprompt").hexdigest()
+
+
+@pytest.fixture
+def jobs(app_module):
+    """An AdvisorJobs runner on the test database; drops the advice it cached afterwards."""
+    runner = AdvisorJobs(app_module.app, app_module.db, workers=2, job_timeout=60)
+    runner.prompts = []
+    yield runner
+    runner.executor.shutdown(wait=True)
+    with app_module.app.app_context():
+        app_module.db.session.execute(text("DELETE FROM advisor_cache WHERE prompt_hash = ANY(:hashes)"),
+                                      {"hashes": [prompt_hash(prompt) for prompt in runner.prompts]})
+        app_module.db.session.commit()
+
+
+def new_prompt(jobs):
+    prompt = f"Advise me ({uuid.uuid4().hex})"
+    jobs.prompts.append(prompt)
+    return prompt
+
+
+def wait_for(jobs, job_id, user_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = jobs.get(job_id, user_id)
+        jobs.db.session.rollback()
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+@requires_postgres
+def test_job_is_queued_then_done_and_cached(app_module, user_id, jobs, gemini):
+    gemini.replies.append(answer("Build an emergency fund."))
+    prompt = new_prompt(jobs)
+    with app_module.app.app_context():
+        job = jobs.submit(user_id, prompt)
+        assert job["status"] in ("queued", "running")
+        job = wait_for(jobs, job["id"], user_id)
+        assert job == {"id": job["id"], "status": "done", "advice": "Build an emergency fund.", "error": None}
+
+        # Same prompt and model: answered from advisor_cache, without calling Gemini again
+        cached = jobs.submit(user_id, prompt)
+        assert cached["id"] != job["id"]
+        assert cached["status"] == "done" and cached["advice"] == "Build an emergency fund."
+        assert len(gemini.requests) == 1
+        assert jobs.cached_advice(prompt_hash(prompt)) == "Build an emergency fund."
+
+
+@requires_postgres
+def test_identical_job_in_flight_is_reused(app_module, user_id, jobs, gemini):
+    gemini.replies.append({**answer("Slow answer."), "delay": 0.5})
+    prompt = new_prompt(jobs)
+    with app_module.app.app_context():
+        first = jobs.submit(user_id, prompt)
+        second = jobs.submit(user_id, prompt)
+        assert second["id"] == first["id"]
+        assert wait_for(jobs, first["id"], user_id)["status"] == "done"
+    assert len(gemini.requests) == 1
+
+
+@requires_postgres
+@pytest.mark.parametrize("reply, error", [
+    ({"json": {"candidates": []}}, "AI did not generate a valid response."),
+    ({"status": 403}, "rejected"),
+])
+def test_failed_generation_fails_the_job_and_caches_nothing(app_module, user_id, jobs, gemini, reply, error):
+    gemini.replies.append(reply)
+    prompt = new_prompt(jobs)
+    with app_module.app.app_context():
+        job = wait_for(jobs, jobs.submit(user_id, prompt)["id"], user_id)
+        assert job["status"] == "failed"
+        assert error in job["error"]
+        assert job["advice"] is None
+        assert jobs.cached_advice(prompt_hash(prompt)) is None
+
+
+@requires_postgres
+def test_job_past_the_timeout_is_reported_failed(app_module, user_id, jobs):
+    with app_module.app.app_context():
+        app_module.db.session.execute(text("""
+            INSERT INTO advisor_jobs (id, user_id, prompt_hash, status, created_at)
+            VALUES ('stuck-job', :user_id, 'x', 'running', NOW() - INTERVAL '2 minutes')
+        """), {"user_id": user_id})
+        app_module.db.session.commit()
+
+        job = jobs.get("stuck-job", user_id)
+        assert job["status"] == "failed"
+        assert "too long" in job["error"]
+        assert jobs.get("stuck-job", user_id + 1) is None
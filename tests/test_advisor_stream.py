@@ -0,0 +1,134 @@
+import json
+import time
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import text
+
+import llm_client
+from advisor import AdvisorError, stream_advice, prompt_hash
+from conftest import requires_postgres
+
+
+def event(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def wait_for_disconnect(server, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not server.client_disconnects and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return server.client_disconnects
+
+
+def test_stream_yields_chunks_as_they_arrive(gemini):
+    gemini.replies.append({"sse": [event("Save "), {"candidates": []}, event("more.")]})
+
+    assert list(stream_advice("prompt")) == ["Save ", "more."]
+    assert gemini.requests[0][0] == "/models/test-model:streamGenerateContent?alt=sse&key=test-key"
+    assert llm_client.get_llm_client().counters["successes"] == 1
+
+
+def test_stream_without_text_fails(gemini):
+    gemini.replies.append({"sse": [{"candidates": []}]})
+    with pytest.raises(AdvisorError, match="did not generate"):
+        list(stream_advice("prompt"))
+
+
+def test_upstream_disconnect_mid_stream_raises_after_the_chunks_received(gemini):
+    gemini.replies.append({"sse": [event("Save "), event("more"), event(".")], "drop": 2})
+
+    chunks = []
+    with pytest.raises(AdvisorError, match="Lost the connection"):
+        for chunk in stream_advice("prompt"):
+            chunks.append(chunk)
+    assert chunks == ["Save ", "more"]
+    # Not retried: part of the answer had already been passed on
+    assert len(gemini.requests) == 1
+    assert llm_client.get_llm_client().counters["failures"] == 1
+
+
+def test_client_disconnect_closes_the_upstream_stream(gemini):
+    gemini.replies.append({"sse": [event(f"part {n} ") for n in range(40)], "event_delay": 0.05})
+
+    chunks = stream_advice("prompt")
+    assert next(chunks) == "part 0 "
+    chunks.close()
+
+    assert wait_for_disconnect(gemini)
+    # The provider did nothing wrong, so it isn't held against the breaker
+    client = llm_client.get_llm_client()
+    assert client.counters["successes"] == 1 and client.breaker.state == "closed"
+
+
+@pytest.fixture
+def stream_request(app_module, user_id, gemini):
+    """GET /api/ai_advisor/stream as the test user, with no cached advice for their prompt."""
+    app = app_module.app
+    with app.app_context():
+        key = prompt_hash(app_module.build_ai_prompt(app_module.get_financial_metrics(user_id)))
+        headers = {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+    clear_cache = lambda: _delete_cached_advice(app_module, key)
+    clear_cache()
+    client = app.test_client()
+    yield lambda **kwargs: client.get("/api/ai_advisor/stream", headers=headers, **kwargs)
+    clear_cache()
+
+
+def _delete_cached_advice(app_module, key):
+    with app_module.app.app_context():
+        app_module.db.session.execute(text("DELETE FROM advisor_cache WHERE prompt_hash = :key"), {"key": key})
+        app_module.db.session.commit()
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@requires_postgres
+def test_sse_route_streams_then_serves_the_cache(stream_request, gemini):
+    gemini.replies.append({"sse": [event("Save "), event("more.")]})
+
+    response = stream_request()
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert parse_events(response.get_data(as_text=True)) == [
+        ("chunk", {"text": "Save "}), ("chunk", {"text": "more."}), ("done", {"cached": False}),
+    ]
+
+    assert parse_events(stream_request().get_data(as_text=True)) == [
+        ("chunk", {"text": "Save more."}), ("done", {"cached": True}),
+    ]
+    assert len(gemini.requests) == 1
+
+
+@requires_postgres
+def test_sse_route_reports_an_upstream_disconnect(stream_request, gemini):
+    gemini.replies.append({"sse": [event("Save "), event("more.")], "drop": 1})
+
+    events = parse_events(stream_request().get_data(as_text=True))
+    assert events[0] == ("chunk", {"text": "Save "})
+    assert events[1][0] == "error" and "Lost the connection" in events[1][1]["error"]
+    assert len(events) == 2
+
+    # Nothing was cached: the next request calls Gemini again
+    gemini.replies.append({"sse": [event("Retry.")]})
+    assert parse_events(stream_request().get_data(as_text=True))[-1] == ("done", {"cached": False})
+
+
+@requires_postgres
+def test_sse_route_client_disconnect_stops_the_upstream(stream_request, gemini):
+    gemini.replies.append({"sse": [event(f"part {n} ") for n in range(40)], "event_delay": 0.05})
+
+    response = stream_request(buffered=False)
+    first = next(iter(response.response))
+    assert b"part 0" in (first if isinstance(first, bytes) else first.encode())
+    response.close()
+
+    assert wait_for_disconnect(gemini)
+    gemini.replies.append({"sse": [event("Fresh.")]})
+    assert parse_events(stream_request().get_data(as_text=True))[-1] == ("done", {"cached": False})
@@ -0,0 +1,73 @@
+from datetime import date
+
+from sqlalchemy import text
+
+from alerts import get_financial_alerts
+from helpers import _get_all_financial_metrics
+from ledger import insert_entry
+from conftest import requires_postgres
+
+
+def _write(app_module, user_id, table, values):
+    insert_entry(app_module.db, table, user_id, values)
+    app_module.db.session.commit()
+
+
+def _poll(client):
+    response = client.get("/api/financial_alerts_data")
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _cash_flow_messages(alerts):
+    return [alert["message"] for alert in alerts if "cash flow" in alert["message"].lower()]
+
+
+@requires_postgres
+def test_poll_after_a_write_ignores_a_stale_metrics_cache(app_module, user_id):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    today = date.today()
+
+    with app_module.app.app_context():
+        _write(app_module, user_id, "expenses", {"category": "Rent", "amount": 500, "date": today})
+        assert any("negative" in message for message in _cash_flow_messages(_poll(client)))
+        stale = app_module.get_financial_metrics(user_id)
+
+        _write(app_module, user_id, "income", {"source": "Salary", "amount": 5000, "date": today})
+        # Another worker's cache still holds the snapshot from before the write
+        app_module.metrics_cache.backend.set(str(user_id), stale, 60)
+
+        for _ in range(2):  # Evaluated, then read back from user_alert_state
+            messages = _cash_flow_messages(_poll(client))
+            assert any("Excellent cash flow" in message for message in messages)
+            assert not any("negative" in message for message in messages)
+
+
+@requires_postgres
+def test_alerts_are_not_stored_when_a_write_commits_during_evaluation(app_module, user_id):
+    db = app_module.db
+
+    def load_metrics_racing_a_write():
+        metrics = _get_all_financial_metrics(db, user_id)
+        with db.engine.begin() as other_worker:
+            other_worker.execute(text("""
+                INSERT INTO user_data_version (user_id, version) VALUES (:user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = user_data_version.version + 1
+            """), {"user_id": user_id})
+        return metrics
+
+    with app_module.app.app_context():
+        alerts = get_financial_alerts(db, user_id, load_metrics_racing_a_write)
+        assert alerts
+        stored = db.session.execute(text(
+            "SELECT COUNT(*) FROM user_alert_state WHERE user_id = :user_id"
+        ), {"user_id": user_id}).scalar()
+        assert stored == 0
+
+        get_financial_alerts(db, user_id, lambda: _get_all_financial_metrics(db, user_id))
+        stored_versions = db.session.execute(text(
+            "SELECT DISTINCT data_version FROM user_alert_state WHERE user_id = :user_id"
+        ), {"user_id": user_id}).scalars().all()
+        assert stored_versions == [1]
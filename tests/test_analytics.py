@@ -0,0 +1,144 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from analytics import LedgerFrame, month_ordinal, ordinal_to_month, spending_trends, _series_trends
+
+
+def rows(*entries):
+    """(YYYY-MM, kind, label, total) entries as LedgerFrame.from_rows input."""
+    return [(month_ordinal(date(int(month[:4]), int(month[5:]), 1)), kind, label, total)
+            for month, kind, label, total in entries]
+
+
+@pytest.fixture
+def frame():
+    return LedgerFrame.from_rows(rows(
+        ("2024-01", "income", "Salary", 3000.0),
+        ("2024-03", "income", "Salary", 3000.0),
+        ("2024-03", "income", "Bonus", 500.0),
+        ("2024-01", "expense", "Rent", 1200.0),
+        ("2024-01", "expense", "Food", 300.0),
+        ("2024-03", "expense", "Food", 250.0),
+        ("2024-03", "budget", "Food", 280.0),
+        ("2024-03", "budget", "Travel", 100.0),
+    ))
+
+
+def test_month_ordinals_round_trip():
+    assert month_ordinal(date(2024, 1, 15)) == 2024 * 12
+    assert month_ordinal(date(2024, 12, 1)) + 1 == month_ordinal(date(2025, 1, 1))
+    assert ordinal_to_month(month_ordinal(date(2024, 12, 31))) == date(2024, 12, 1)
+
+
+def test_empty_frame():
+    frame = LedgerFrame.from_rows([])
+    assert len(frame) == 0
+    assert frame.total("income") == 0.0
+    assert frame.distinct_months("expense") == 0
+    assert frame.monthly_average("expense") == 0.0
+    assert frame.by_label("expense") == {}
+    assert frame.budget_vs_actual(date(2024, 3, 1)) == {}
+    assert list(frame.monthly_series("income", date(2024, 1, 1), date(2024, 3, 1))) == [0.0, 0.0, 0.0]
+
+
+def test_totals_and_monthly_averages(frame):
+    assert len(frame) == 8
+    assert frame.total("income") == 6500.0
+    assert frame.total("expense") == 1750.0
+    # February has no entries, so it doesn't count towards the average
+    assert frame.distinct_months("income") == 2
+    assert frame.monthly_average("income") == 3250.0
+    assert frame.distinct_months("budget") == 1
+
+
+def test_by_label(frame):
+    assert frame.by_label("expense") == {"Rent": 1200.0, "Food": 550.0}
+    assert frame.by_label("expense", date(2024, 3, 1)) == {"Food": 250.0}
+    assert frame.by_label("income", date(2024, 2, 1)) == {}
+
+
+def test_monthly_series_is_dense(frame):
+    first, last = date(2023, 12, 1), date(2024, 4, 1)
+    assert list(frame.monthly_series("income", first, last)) == [0.0, 3000.0, 0.0, 3500.0, 0.0]
+    assert list(frame.monthly_series("expense", first, last, label="Food")) == [0.0, 300.0, 0.0, 250.0, 0.0]
+    # Labels of another kind, or unknown ones, give an all-zero series
+    assert list(frame.monthly_series("expense", first, last, label="Salary")) == [0.0] * 5
+    assert list(frame.monthly_series("expense", first, last, label="Nope")) == [0.0] * 5
+
+
+def test_budget_vs_actual_covers_budgeted_and_spent_categories(frame):
+    assert frame.budget_vs_actual(date(2024, 3, 1)) == {
+        "Food": {"budgeted": 280.0, "spent": 250.0, "remaining": 30.0},
+        "Travel": {"budgeted": 100.0, "spent": 0.0, "remaining": 100.0},
+    }
+    assert frame.budget_vs_actual(date(2024, 1, 1)) == {
+        "Rent": {"budgeted": 0.0, "spent": 1200.0, "remaining": -1200.0},
+        "Food": {"budgeted": 0.0, "spent": 300.0, "remaining": -300.0},
+    }
+
+
+def test_series_trends_forecast_and_rolling_averages():
+    matrix = np.array([[0.0, 0.0, 10.0, 20.0, 30.0, 40.0], [5.0, 5.0, 5.0, 5.0, 5.0, 5.0]])
+    rising, flat = _series_trends(matrix, active_months=4)
+
+    # Smoothing starts at the first active month: 10 -> 15 -> 22.5 -> 31.25
+    assert rising["forecast"] == 31.25
+    assert rising["current"] == 40.0 and rising["previous"] == 30.0
+    assert rising["mom_delta"] == 10.0 and rising["mom_delta_pct"] == 33.3
+    # Windows longer than the active months average over the active months only
+    assert rising["rolling_average"] == {"3": 30.0, "6": 25.0, "12": 25.0}
+    assert rising["series"] == [0.0, 0.0, 10.0, 20.0, 30.0, 40.0]
+    assert flat["forecast"] == 5.0 and flat["mom_delta_pct"] == 0.0
+
+
+def test_series_trends_with_one_active_month():
+    (trend,) = _series_trends(np.array([[0.0, 0.0, 12.0]]), active_months=1)
+    assert trend["forecast"] == 12.0
+    assert trend["previous"] == 0.0 and trend["mom_delta"] == 12.0
+    assert trend["mom_delta_pct"] is None  # no previous month to compare with
+    assert trend["rolling_average"] == {"3": 12.0, "6": 12.0, "12": 12.0}
+
+
+def test_spending_trends_of_an_empty_ledger():
+    trends = spending_trends(LedgerFrame.from_rows([]), date(2024, 3, 1), history_months=3)
+    assert trends["months"] == ["2024-01", "2024-02", "2024-03"]
+    assert trends["forecast_month"] == "2024-04"
+    assert trends["active_months"] == 1
+    assert trends["categories"] == []
+    assert trends["income"]["series"] == [0.0, 0.0, 0.0] and trends["income"]["forecast"] == 0.0
+    assert trends["expenses"]["rolling_average"] == {"3": 0.0, "6": 0.0, "12": 0.0}
+
+
+def test_spending_trends_counts_months_from_the_first_entry(frame):
+    trends = spending_trends(frame, date(2024, 3, 1), history_months=12)
+    assert trends["months"][0] == "2023-04" and trends["end_month"] == "2024-03"
+    # History starts in 2024-01, so the 12-month window averages over three months
+    assert trends["active_months"] == 3
+    assert trends["income"]["series"][-3:] == [3000.0, 0.0, 3500.0]
+    assert trends["income"]["rolling_average"] == {"3": 2166.67, "6": 2166.67, "12": 2166.67}
+    # 3000 -> 1500 -> 2500
+    assert trends["income"]["forecast"] == 2500.0
+    assert trends["expenses"]["forecast"] == 0.5 * 250 + 0.25 * 0 + 0.25 * 1500
+
+    categories = {item["category"]: item for item in trends["categories"]}
+    assert set(categories) == {"Food", "Rent"}
+    assert categories["Food"]["series"][-3:] == [300.0, 0.0, 250.0]
+    assert categories["Food"]["forecast"] == 200.0
+    # Sorted by forecast, highest first
+    assert [item["category"] for item in trends["categories"]] == ["Rent", "Food"]
+
+
+def test_spending_trends_leaves_out_categories_without_rows_in_the_window(frame):
+    # 2024-03 alone: Rent only has entries in January
+    trends = spending_trends(frame, date(2024, 3, 1), history_months=1)
+    assert trends["active_months"] == 1
+    assert [item["category"] for item in trends["categories"]] == ["Food"]
+    assert trends["expenses"]["series"] == [250.0]
+    assert trends["expenses"]["previous"] == 0.0
+
+    # Before any entry: an empty window, whatever the rest of the ledger holds
+    trends = spending_trends(frame, date(2023, 12, 1), history_months=6)
+    assert trends["categories"] == [] and trends["active_months"] == 1
+    assert trends["income"]["series"] == [0.0] * 6
@@ -0,0 +1,35 @@
+from sqlalchemy import text
+
+import batch
+from etags import get_data_version
+from conftest import requires_postgres
+
+
+def _income(source, amount=10):
+    return {"op": "create", "entity": "income", "data": {"source": source, "amount": amount, "date": "2024-05-01"}}
+
+
+@requires_postgres
+def test_partially_failing_batch_still_bumps_data_version(app_module, user_id, monkeypatch):
+    apply_group = batch._apply_group
+
+    def failing_apply_group(db_instance, user, group):
+        results = apply_group(db_instance, user, group)
+        # Fail after the statement ran, so its savepoint has real work to undo
+        if any(values["source"] == "bad" for *_, values in group):
+            raise RuntimeError("injected failure")
+        return results
+
+    monkeypatch.setattr(batch, "_apply_group", failing_apply_group)
+    db = app_module.db
+    with app_module.app.app_context():
+        before = get_data_version(db, user_id)
+        results, applied = batch.apply_batch(db, user_id, [_income("salary"), _income("bad"), _income("bonus")])
+
+        assert applied
+        assert [result["status"] for result in results] == ["created", "error", "created"]
+        assert get_data_version(db, user_id) == before + 1
+        sources = db.session.execute(text(
+            "SELECT source FROM income WHERE user_id = :user_id ORDER BY id"
+        ), {"user_id": user_id}).scalars().all()
+        assert sources == ["salary", "bonus"]
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import ledger
+from etags import bump_data_version, get_data_version
+
+
+@pytest.fixture
+def db():
+    """A SQLite session with the ledger events and the data version listener hooked up."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE user_change_seq (user_id INTEGER PRIMARY KEY, seq INTEGER NOT NULL)"))
+        conn.execute(text("CREATE TABLE user_data_version (user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"))
+    db_instance = SimpleNamespace(session=Session(engine))
+    ledger.register_ledger_events(db_instance)
+    committed = []
+    before = ledger.before_ledger_commit(lambda session, user_id, tables: bump_data_version(session, user_id))
+    after = ledger.on_ledger_commit(lambda user_id, tables: committed.append((user_id, set(tables))))
+    db_instance.committed = committed
+    yield db_instance
+    ledger._before_commit_listeners.remove(before)
+    ledger._commit_listeners.remove(after)
+    db_instance.session.close()
+
+
+def _failing_savepoint(db, user_id, table):
+    try:
+        with db.session.begin_nested():
+            ledger.record_ledger_write(db, user_id, table)
+            raise RuntimeError("statement failed")
+    except RuntimeError:
+        pass
+
+
+def test_savepoint_rollback_keeps_recorded_writes(db):
+    ledger.record_ledger_write(db, 1, "income")
+    _failing_savepoint(db, 1, "expenses")
+    db.session.commit()
+
+    assert get_data_version(db, 1) == 1
+    assert db.committed == [(1, {"income", "expenses"})]
+
+
+def test_writes_recorded_only_inside_a_rolled_back_savepoint_still_notify(db):
+    _failing_savepoint(db, 1, "income")
+    with db.session.begin_nested():
+        ledger.record_ledger_write(db, 1, "budget")
+    db.session.commit()
+
+    assert get_data_version(db, 1) == 1
+    assert db.committed == [(1, {"income", "budget"})]
+
+
+def test_root_rollback_drops_recorded_writes(db):
+    ledger.change_seq(db, 1)
+    ledger.record_ledger_write(db, 1, "income")
+    db.session.rollback()
+    db.session.commit()
+
+    assert get_data_version(db, 1) == 0
+    assert db.committed == []
+
+
+def test_change_seq_survives_savepoint_rollback_when_taken_before(db):
+    seq = ledger.change_seq(db, 1)
+    _failing_savepoint(db, 1, "income")
+    assert ledger.change_seq(db, 1) == seq
+
+
+def test_change_seq_taken_in_rolled_back_savepoint_is_reallocated(db):
+    try:
+        with db.session.begin_nested():
+            ledger.change_seq(db, 1)
+            raise RuntimeError("statement failed")
+    except RuntimeError:
+        pass
+    # The savepoint undid the allocation, so the number must come from the table again
+    seq = ledger.change_seq(db, 1)
+    db.session.commit()
+    assert db.session.execute(text("SELECT seq FROM user_change_seq WHERE user_id = 1")).scalar() == seq
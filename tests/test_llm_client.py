@@ -0,0 +1,127 @@
+import time
+
+import pytest
+
+from llm_client import LLMClient, CircuitBreaker, LLMError, CircuitOpenError
+from stub_server import StubServer
+
+
+def make_client(read_timeout=5, max_retries=2, failure_threshold=3, reset_timeout=0.2):
+    # No real backoff sleeps: jitter up to 1 ms, Retry-After capped at 1 ms
+    return LLMClient(connect_timeout=1, read_timeout=read_timeout, max_retries=max_retries,
+                     backoff_base=0.001, backoff_cap=0.001,
+                     breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout))
+
+
+def test_retries_rate_limiting_then_succeeds():
+    client = make_client()
+    with StubServer([{"status": 429, "headers": {"Retry-After": "5"}}, {"json": {"ok": True}}]) as server:
+        assert client.post_json(server.url + "/generate", {"prompt": "hi"}) == {"ok": True}
+    assert len(server.requests) == 2
+    assert server.requests[0] == ("/generate", {"prompt": "hi"})
+    assert client.counters["retries"] == 1
+    assert client.counters["successes"] == 1
+
+
+def test_gives_up_after_retrying_server_errors():
+    client = make_client(max_retries=2)
+    with StubServer([{"status": 503}, {"status": 500}, {"status": 502}, {"json": {"ok": True}}]) as server:
+        with pytest.raises(LLMError, match="HTTP 502"):
+            client.post_json(server.url, {})
+    assert len(server.requests) == 3
+    assert client.counters["failures"] == 1
+    assert client.breaker.state == "closed"
+
+
+def test_retries_read_timeouts():
+    client = make_client(read_timeout=0.2)
+    with StubServer([{"delay": 0.5}, {"json": {"ok": True}}]) as server:
+        assert client.post_json(server.url, {}) == {"ok": True}
+    assert client.counters["retries"] == 1
+
+
+def test_client_errors_are_not_retried_and_do_not_trip_the_breaker():
+    client = make_client(failure_threshold=1)
+    with StubServer([{"status": 400}, {"json": {"ok": True}}]) as server:
+        with pytest.raises(LLMError, match="rejected"):
+            client.post_json(server.url, {})
+        assert len(server.requests) == 1
+        assert client.breaker.state == "closed"
+        assert client.post_json(server.url, {}) == {"ok": True}
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast():
+    client = make_client(max_retries=0, failure_threshold=3, reset_timeout=60)
+    with StubServer([{"status": 500}] * 3) as server:
+        for _ in range(3):
+            with pytest.raises(LLMError, match="HTTP 500"):
+                client.post_json(server.url, {})
+        assert client.breaker.state == "open"
+
+        with pytest.raises(CircuitOpenError):
+            client.post_json(server.url, {})
+    assert len(server.requests) == 3
+    assert client.counters["rejected"] == 1
+
+
+def _open_breaker(client, server):
+    server.replies.extend([{"status": 500}] * client.breaker.failure_threshold)
+    for _ in range(client.breaker.failure_threshold):
+        with pytest.raises(LLMError):
+            client.post_json(server.url, {})
+    assert client.breaker.state == "open"
+    time.sleep(client.breaker.reset_timeout)
+
+
+def test_half_open_trial_success_closes_the_breaker():
+    client = make_client(max_retries=0)
+    with StubServer() as server:
+        _open_breaker(client, server)
+        server.replies.append({"json": {"ok": True}})
+        assert client.post_json(server.url, {}) == {"ok": True}
+        assert client.breaker.state == "closed"
+
+
+def test_half_open_trial_failure_reopens_the_breaker():
+    client = make_client(max_retries=0)
+    with StubServer() as server:
+        _open_breaker(client, server)
+        server.replies.append({"status": 503})
+        with pytest.raises(LLMError, match="HTTP 503"):
+            client.post_json(server.url, {})
+        assert client.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            client.post_json(server.url, {})
+
+
+def test_half_open_trial_answered_with_client_error_closes_the_breaker():
+    client = make_client(max_retries=0)
+    with StubServer() as server:
+        _open_breaker(client, server)
+        server.replies.append({"status": 400})
+        with pytest.raises(LLMError, match="rejected"):
+            client.post_json(server.url, {})
+        # The provider answered, so the next call goes through instead of being stuck half-open
+        assert client.breaker.state == "closed"
+        assert client.post_json(server.url, {}) == {}
+
+
+def test_half_open_trial_timing_out_reopens_the_breaker():
+    client = make_client(max_retries=0, read_timeout=0.2)
+    with StubServer() as server:
+        _open_breaker(client, server)
+        server.replies.append({"delay": 0.5})
+        with pytest.raises(LLMError, match="Could not reach"):
+            client.post_json(server.url, {})
+        assert client.breaker.state == "open"
+
+
+def test_unreachable_provider_opens_the_breaker():
+    client = make_client(max_retries=0, failure_threshold=2)
+    with StubServer() as server:
+        url = server.url
+    # The server is gone: connections are refused
+    for _ in range(2):
+        with pytest.raises(LLMError, match="Could not reach"):
+            client.post_json(url, {})
+    assert client.breaker.state == "open"
@@ -0,0 +1,244 @@
+import smtplib
+import socket
+import time
+import uuid
+
+import pytest
+from flask import Flask
+from flask_mail import Mail
+from sqlalchemy import text
+
+from mail_outbox import MailOutbox, _is_permanent
+from conftest import requires_postgres
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+
+class Sink:
+    """aiosmtpd handler that keeps accepted messages; scripted replies reject RCPT or DATA."""
+
+    def __init__(self):
+        self.messages = []
+        self.rcpt_replies = []
+        self.data_replies = []
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.rcpt_replies:
+            return self.rcpt_replies.pop(0)
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.data_replies:
+            return self.data_replies.pop(0)
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def smtp():
+    """A local SMTP sink that drops connections idle for more than 0.3 s."""
+    sink = Sink()
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        sink.port = probe.getsockname()[1]
+    controller = aiosmtpd_controller.Controller(sink, hostname="127.0.0.1", port=sink.port, timeout=0.3)
+    controller.start()
+    yield sink
+    controller.stop()
+
+
+def mail_app(smtp, app=None):
+    app = app or Flask(__name__)
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=smtp.port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                      MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_DEFAULT_SENDER="noreply@example.com")
+    return app, Mail(app)
+
+
+def message(recipient="user@example.com"):
+    return {"id": 1, "recipient": recipient, "sender": "noreply@example.com",
+            "subject": "Password reset", "body": "Follow the link.", "attempts": 1}
+
+
+def test_send_reuses_one_connection(smtp):
+    app, mail = mail_app(smtp)
+    outbox = MailOutbox(app, None, mail, smtp_timeout=2)
+    with app.app_context():
+        outbox._send(message("a@example.com"))
+        outbox._send(message("b@example.com"))
+    outbox._close()
+
+    assert [envelope.rcpt_tos for envelope in smtp.messages] == [["a@example.com"], ["b@example.com"]]
+    assert smtp.connections == 1
+
+
+def test_stale_connection_is_reopened_once(smtp):
+    app, mail = mail_app(smtp)
+    outbox = MailOutbox(app, None, mail, smtp_timeout=2)
+    with app.app_context():
+        outbox._send(message("a@example.com"))
+        time.sleep(0.6)  # The server hangs up on the idle connection
+        outbox._send(message("b@example.com"))
+    outbox._close()
+
+    assert len(smtp.messages) == 2
+    assert outbox.counters["reconnects"] == 1
+    assert smtp.connections == 2
+
+
+@pytest.mark.parametrize("rcpt_reply, data_reply, permanent", [
+    ("450 Mailbox busy", None, False),
+    ("550 No such user", None, True),
+    (None, "451 Try again later", False),
+    (None, "554 Rejected as spam", True),
+])
+def test_smtp_replies_are_classified(smtp, rcpt_reply, data_reply, permanent):
+    if rcpt_reply:
+        smtp.rcpt_replies.append(rcpt_reply)
+    if data_reply:
+        smtp.data_replies.append(data_reply)
+    app, mail = mail_app(smtp)
+    outbox = MailOutbox(app, None, mail, smtp_timeout=2)
+    with app.app_context():
+        with pytest.raises(smtplib.SMTPException) as error:
+            outbox._send(message())
+    outbox._close()
+
+    assert _is_permanent(error.value) is permanent
+    assert smtp.messages == []
+
+
+@pytest.fixture
+def outbox_for(app_module):
+    """Builds MailOutbox instances on the test database, pointed at an SMTP sink; cleans up their mail."""
+    recipients = []
+    outboxes = []
+
+    def build(smtp):
+        app, mail = mail_app(smtp, app_module.app)
+        outbox = MailOutbox(app, app_module.db, mail, smtp_timeout=2, backoff_base=30)
+        outbox.recipient = f"{uuid.uuid4().hex}@example.com"
+        recipients.append(outbox.recipient)
+        outboxes.append(outbox)
+        return outbox
+
+    with app_module.app.app_context():
+        yield build
+        for outbox in outboxes:
+            outbox._close()
+        app_module.db.session.rollback()
+        app_module.db.session.execute(text("DELETE FROM mail_outbox WHERE recipient = ANY(:recipients)"),
+                                      {"recipients": recipients})
+        app_module.db.session.commit()
+
+
+def outbox_row(outbox, message_id):
+    row = outbox.db.session.execute(text("""
+        SELECT status, attempts, last_error, next_attempt_at > NOW() AS backing_off
+        FROM mail_outbox WHERE id = :id
+    """), {"id": message_id}).mappings().fetchone()
+    outbox.db.session.rollback()
+    return row
+
+
+def drain(outbox, message_id):
+    """Drains only this test's message, so mail queued by anything else is left alone."""
+    outbox.db.session.execute(text("""
+        UPDATE mail_outbox SET next_attempt_at = NOW() + INTERVAL '1 hour'
+        WHERE status = 'pending' AND id != :id
+    """), {"id": message_id})
+    outbox.db.session.commit()
+    return outbox.drain_once()
+
+
+@requires_postgres
+def test_enqueued_mail_is_sent(outbox_for, smtp):
+    outbox = outbox_for(smtp)
+    message_id = outbox.enqueue(outbox.recipient, "Password reset", "Follow the link.")
+    assert outbox_row(outbox, message_id)["status"] == "pending"
+
+    assert drain(outbox, message_id)
+    assert outbox_row(outbox, message_id)["status"] == "sent"
+    assert [envelope.rcpt_tos for envelope in smtp.messages] == [[outbox.recipient]]
+
+
+@requires_postgres
+def test_temporary_failure_is_retried_with_backoff(outbox_for, smtp):
+    outbox = outbox_for(smtp)
+    smtp.data_replies.append("451 Try again later")
+    message_id = outbox.enqueue(outbox.recipient, "Password reset", "Follow the link.")
+
+    drain(outbox, message_id)
+    row = outbox_row(outbox, message_id)
+    assert row["status"] == "pending" and row["attempts"] == 1 and row["backing_off"]
+    assert "451" in row["last_error"]
+    assert outbox.counters["retried"] == 1
+
+    # Not due yet: nothing is sent until the backoff is over
+    drain(outbox, message_id)
+    assert smtp.messages == []
+    outbox.db.session.execute(text("UPDATE mail_outbox SET next_attempt_at = NOW() WHERE id = :id"), {"id": message_id})
+    outbox.db.session.commit()
+    drain(outbox, message_id)
+    assert outbox_row(outbox, message_id)["status"] == "sent"
+    assert len(smtp.messages) == 1
+
+
+@requires_postgres
+def test_queue_depth_leaves_the_callers_session_alone(outbox_for, smtp):
+    outbox = outbox_for(smtp)
+    session = outbox.db.session
+    depth_before = outbox.queue_depth()
+    # A request's transaction with an uncommitted write, as when /metrics collectors run
+    session.execute(text("""
+        INSERT INTO mail_outbox (recipient, subject, body) VALUES (:recipient, 'Uncommitted', 'x')
+    """), {"recipient": outbox.recipient})
+
+    assert outbox.queue_depth() == depth_before  # read on another connection
+    assert session.in_transaction()
+    session.commit()
+    assert outbox.queue_depth()["pending"] == depth_before["pending"] + 1
+
+
+@requires_postgres
+def test_permanent_failure_is_dead_lettered(outbox_for, smtp):
+    outbox = outbox_for(smtp)
+    smtp.rcpt_replies.append("550 No such user")
+    message_id = outbox.enqueue(outbox.recipient, "Password reset", "Follow the link.")
+
+    drain(outbox, message_id)
+    row = outbox_row(outbox, message_id)
+    assert row["status"] == "dead" and row["attempts"] == 1
+    assert "550" in row["last_error"]
+    assert outbox.counters["dead"] == 1
+
+
+@requires_postgres
+def test_stale_claim_taken_over_by_another_sender_is_not_sent_twice(outbox_for, smtp, monkeypatch):
+    slow, other = outbox_for(smtp), outbox_for(smtp)
+    message_id = slow.enqueue(slow.recipient, "Password reset", "Follow the link.")
+    slow.db.session.execute(text("""
+        UPDATE mail_outbox SET next_attempt_at = NOW() + INTERVAL '1 hour' WHERE status = 'pending' AND id != :id
+    """), {"id": message_id})
+    slow.db.session.commit()
+
+    # The slow sender claims the message but is still busy with its batch past claim_timeout
+    claimed = slow._claim()
+    assert [row["id"] for row in claimed] == [message_id]
+    slow.db.session.execute(text(
+        "UPDATE mail_outbox SET claimed_at = NOW() - INTERVAL '1 hour' WHERE id = :id"), {"id": message_id})
+    slow.db.session.commit()
+
+    assert drain(other, message_id)
+    assert outbox_row(other, message_id)["status"] == "sent"
+
+    monkeypatch.setattr(slow, "_claim", lambda: claimed)
+    slow.drain_once()
+    assert len(smtp.messages) == 1
+    assert outbox_row(slow, message_id)["attempts"] == 2
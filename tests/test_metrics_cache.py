@@ -0,0 +1,116 @@
+import os
+import uuid
+
+import pytest
+
+from metrics_cache import InProcessCacheBackend, MetricsCache, RedisCacheBackend
+from resp_server import RespServer
+
+
+@pytest.fixture
+def redis_backend():
+    """RedisCacheBackend on TEST_REDIS_URL, or on a local RESP server without one."""
+    pytest.importorskip("redis")
+    url = os.getenv("TEST_REDIS_URL")
+    if url:
+        yield RedisCacheBackend(url, key_prefix=f"cashcompass:test:{uuid.uuid4().hex}:")
+        return
+    with RespServer() as server:
+        yield RedisCacheBackend(server.url)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return InProcessCacheBackend()
+    return request.getfixturevalue("redis_backend")
+
+
+def test_least_recently_used_entries_are_evicted():
+    backend = InProcessCacheBackend(max_entries=2)
+    backend.set("1", {"user": 1}, 60)
+    backend.set("2", {"user": 2}, 60)
+    assert backend.get("1") == {"user": 1}  # 2 is now the least recently used
+    backend.set("3", {"user": 3}, 60)
+
+    assert len(backend) == 2
+    assert backend.get("2") is None
+    assert backend.get("1") == {"user": 1} and backend.get("3") == {"user": 3}
+
+
+def test_expired_entries_are_misses():
+    backend = InProcessCacheBackend()
+    backend.set("1", {"user": 1}, -1)
+    assert backend.get("1") is None
+    assert len(backend) == 0
+
+
+def test_callers_get_copies_of_the_cached_snapshot():
+    backend = InProcessCacheBackend()
+    snapshot = {"categories": ["Food"]}
+    backend.set("1", snapshot, 60)
+    snapshot["categories"].append("Rent")
+
+    cached = backend.get("1")
+    assert cached == {"categories": ["Food"]}
+    cached["categories"].append("Travel")
+    assert backend.get("1") == {"categories": ["Food"]}
+
+
+def test_get_or_compute_caches_until_invalidated(backend):
+    cache = MetricsCache(backend, ttl=60)
+    computed = []
+
+    def compute():
+        computed.append(len(computed))
+        return {"version": len(computed)}
+
+    assert cache.get_or_compute(7, compute) == {"version": 1}
+    # Session ids are ints and JWT identities strings: both hit the same entry
+    assert cache.get_or_compute("7", compute) == {"version": 1}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.invalidate(7)
+    assert cache.get_or_compute(7, compute) == {"version": 2}
+    assert len(computed) == 2
+
+
+def test_snapshot_computed_across_an_invalidation_is_not_stored(backend):
+    cache = MetricsCache(backend, ttl=60)
+
+    def compute_racing_a_write():
+        # The ledger write commits, and invalidates, while the old totals are being computed
+        cache.invalidate(7)
+        return {"balance": "stale"}
+
+    assert cache.get_or_compute(7, compute_racing_a_write) == {"balance": "stale"}
+    assert backend.get("7") is None
+    assert cache.get_or_compute(7, lambda: {"balance": "fresh"}) == {"balance": "fresh"}
+    assert backend.get("7") == {"balance": "fresh"}
+
+
+def test_write_from_before_a_delete_is_ignored(backend):
+    generation = backend.generation("7")
+    backend.delete("7")
+    backend.set("7", {"balance": "stale"}, 60, generation)
+    assert backend.get("7") is None
+
+    backend.set("7", {"balance": "fresh"}, 60, backend.generation("7"))
+    assert backend.get("7") == {"balance": "fresh"}
+
+
+def test_forgotten_generations_still_keep_stale_writes_out():
+    backend = InProcessCacheBackend(max_entries=2)
+    generation = backend.generation("1")
+    for key in ("1", "2", "3"):  # The third delete forgets the generations of all three
+        backend.delete(key)
+    backend.set("1", {"balance": "stale"}, 60, generation)
+    assert backend.get("1") is None
+
+
+def test_without_a_backend_every_call_computes():
+    cache = MetricsCache(None)
+    assert cache.get_or_compute(7, lambda: {"n": 1}) == {"n": 1}
+    assert cache.get_or_compute(7, lambda: {"n": 2}) == {"n": 2}
+    cache.invalidate(7)
+    assert cache.misses == 2
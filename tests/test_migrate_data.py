@@ -0,0 +1,182 @@
+import json
+import sqlite3
+
+import pytest
+
+import migrate_data
+from migrate_data import migrate_data as run_migration, SQLiteTarget
+
+
+SOURCE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    email TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE income (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    amount NUMERIC NOT NULL,
+    date TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE read_user_alerts (
+    user_id INTEGER NOT NULL,
+    alert_hash TEXT NOT NULL,
+    read_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, alert_hash)
+);
+"""
+
+TABLES = ["users", "income", "read_user_alerts"]
+
+
+class Crash(BaseException):
+    """Stands in for the process dying: not caught by the migration's error handling."""
+
+
+@pytest.fixture
+def source(tmp_path):
+    """A small budget.db: 3 users, 12 income rows (one with a negative amount), 7 read alerts."""
+    path = tmp_path / "budget.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(SOURCE_SCHEMA)
+    conn.executemany("INSERT INTO users (username, password_hash) VALUES (?, 'hash')",
+                     [(f"user{n}",) for n in range(3)])
+    conn.executemany("INSERT INTO income (user_id, source, amount, date) VALUES (?, ?, ?, '2024-01-15')",
+                     [(n % 3 + 1, f"source{n}", -5 if n == 6 else 100 + n) for n in range(12)])
+    conn.executemany("INSERT INTO read_user_alerts (user_id, alert_hash) VALUES (?, ?)",
+                     [(n % 3 + 1, f"hash{n}") for n in range(7)])
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def target(tmp_path):
+    return str(tmp_path / "target.db")
+
+
+def migrate(source, target, checkpoint, **kwargs):
+    return run_migration(source, target, TABLES, batch_size=4, workers=2, checkpoint_path=checkpoint, **kwargs)
+
+
+def rows(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+    finally:
+        conn.close()
+
+
+def test_migrates_every_table_and_removes_the_checkpoint(source, target, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    results = migrate(source, target, str(checkpoint))
+
+    assert results == {"users": (3, 0), "income": (12, 0), "read_user_alerts": (7, 0)}
+    for table in TABLES:
+        assert rows(target, table) == rows(source, table)
+    assert not checkpoint.exists()
+
+
+def test_resumes_from_the_checkpoint_after_a_crash(source, target, tmp_path, monkeypatch):
+    checkpoint = tmp_path / "checkpoint.json"
+    insert_batch = SQLiteTarget.insert_batch
+    calls = {}
+
+    def crashing_insert_batch(self, conn, table_name, columns, batch):
+        calls[table_name] = calls.get(table_name, 0) + 1
+        if table_name in ("income", "read_user_alerts") and calls[table_name] == 2:
+            raise Crash()
+        return insert_batch(self, conn, table_name, columns, batch)
+
+    monkeypatch.setattr(SQLiteTarget, "insert_batch", crashing_insert_batch)
+    with pytest.raises(Crash):
+        migrate(source, target, str(checkpoint))
+    state = json.loads(checkpoint.read_text())
+    assert state["users"]["done"]
+    assert state["income"] == {"last_rowid": 4, "inserted": 4, "rejected": 0, "done": False}
+    assert state["read_user_alerts"]["last_rowid"] == 4
+    assert len(rows(target, "income")) == 4
+
+    resumed = []
+
+    def recording_insert_batch(self, conn, table_name, columns, batch):
+        resumed.append((table_name, batch[0]))
+        return insert_batch(self, conn, table_name, columns, batch)
+
+    monkeypatch.setattr(SQLiteTarget, "insert_batch", recording_insert_batch)
+    results = migrate(source, target, str(checkpoint))
+
+    assert results == {"users": (3, 0), "income": (12, 0), "read_user_alerts": (7, 0)}
+    # Only the tables and rows after the checkpoint were read again
+    assert ("users" not in {table for table, _ in resumed})
+    assert [first[0] for table, first in resumed if table == "income"] == [5, 9]
+    for table in TABLES:
+        assert rows(target, table) == rows(source, table)
+
+
+def test_bad_row_is_rejected_without_losing_its_batch(source, target, tmp_path):
+    # The target refuses negative amounts, so the batch holding income id 7 fails
+    conn = sqlite3.connect(target)
+    conn.execute("""
+        CREATE TABLE income (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            amount NUMERIC NOT NULL CHECK (amount >= 0),
+            date TEXT
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+    results = migrate(source, target, str(tmp_path / "checkpoint.json"))
+
+    assert results["income"] == (11, 1)
+    assert [row[0] for row in rows(target, "income")] == [n for n in range(1, 13) if n != 7]
+
+
+def test_rerun_inserts_no_duplicates(source, target, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    migrate(source, target, checkpoint)
+    before = {table: rows(target, table) for table in TABLES}
+
+    results = migrate(source, target, checkpoint, reset=True)
+
+    assert results == {"users": (0, 0), "income": (0, 0), "read_user_alerts": (0, 0)}
+    assert {table: rows(target, table) for table in TABLES} == before
+
+
+def test_table_without_id_needs_a_unique_key_in_the_target(source, target, tmp_path):
+    conn = sqlite3.connect(target)
+    conn.execute("CREATE TABLE read_user_alerts (user_id INTEGER NOT NULL, alert_hash TEXT NOT NULL, read_at DATETIME)")
+    conn.commit()
+    conn.close()
+
+    results = migrate(source, target, str(tmp_path / "checkpoint.json"))
+
+    assert "read_user_alerts" not in results
+    assert rows(target, "read_user_alerts") == []
+    assert migrate_data.UNIQUE_KEYS["read_user_alerts"] == ["user_id", "alert_hash"]
+
+
+def test_rollups_are_rebuilt_for_the_users_with_migrated_ledger_rows(source, target, tmp_path, monkeypatch, capsys):
+    rebuilt = []
+    monkeypatch.setattr(SQLiteTarget, "rebuild_monthly_rollup", lambda self, conn, user_ids: rebuilt.append(user_ids) or True)
+
+    migrate(source, target, str(tmp_path / "checkpoint.json"))
+
+    assert rebuilt == [[1, 2, 3]]
+    assert "monthly_rollup rebuilt for 3 users" in capsys.readouterr().out
+
+
+def test_offline_target_leaves_the_rollup_rebuild_to_flask(source, target, tmp_path, capsys):
+    migrate(source, target, str(tmp_path / "checkpoint.json"))
+    assert "flask rebuild-rollups" in capsys.readouterr().out
+
+    # Nothing to rebuild without ledger rows
+    run_migration(source, target, ["users", "read_user_alerts"], checkpoint_path=str(tmp_path / "other.json"))
+    assert "flask rebuild-rollups" not in capsys.readouterr().out
@@ -0,0 +1,58 @@
+import pytest
+from flask import Flask
+
+from helpers import metrics_token_required
+from conftest import requires_postgres
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+
+    @app.route("/debug/thing")
+    @metrics_token_required
+    def thing():
+        return "internals"
+
+    return app.test_client()
+
+
+def test_disabled_without_a_configured_token(client, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    assert client.get("/debug/thing").status_code == 403
+    assert client.get("/debug/thing", headers={"Authorization": "Bearer "}).status_code == 403
+
+
+def test_requires_the_configured_token(client, monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "s3cret")
+    assert client.get("/debug/thing").status_code == 401
+    assert client.get("/debug/thing", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/debug/thing", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200 and response.text == "internals"
+
+
+@requires_postgres
+def test_query_profiles_page_fails_closed(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    assert client.get("/debug/queries").status_code == 403
+
+    monkeypatch.setenv("METRICS_TOKEN", "s3cret")
+    assert client.get("/debug/queries").status_code == 401
+    # 404 when the profiler is off: past the token check either way
+    assert client.get("/debug/queries", headers={"Authorization": "Bearer s3cret"}).status_code in (200, 404)
+
+
+@requires_postgres
+@pytest.mark.parametrize("path", ["/metrics", "/metrics/db_pool"])
+def test_metrics_fail_closed(app_module, monkeypatch, path):
+    client = app_module.app.test_client()
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    assert client.get(path).status_code == 403
+
+    monkeypatch.setenv("METRICS_TOKEN", "s3cret")
+    assert client.get(path).status_code == 401
+    response = client.get(path, headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    if path == "/metrics":
+        assert "cashcompass_http_requests_total" in response.text
@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from password_hashing import HashingBusy, PasswordHasher
+from conftest import requires_postgres
+
+# Cheap parameters so the tests don't spend their time hashing
+METHOD = "pbkdf2:sha256:1000"
+OLD_METHOD = "pbkdf2:sha256:500"
+
+
+def hasher(max_in_flight=1, queue_timeout=0.05):
+    return PasswordHasher(workers=0, max_in_flight=max_in_flight, queue_timeout=queue_timeout, method=METHOD)
+
+
+def hold_slots(password_hasher, count):
+    """Starts 'count' hashes that block until the returned event is set."""
+    release, started = threading.Event(), threading.Semaphore(0)
+
+    def blocking_hash(*args):
+        started.release()
+        release.wait(5)
+        return True
+
+    threads = [threading.Thread(target=password_hasher._run, args=("check", blocking_hash)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        assert started.acquire(timeout=5)
+    return release, threads
+
+
+def test_hashes_beyond_the_cap_are_refused_as_busy():
+    password_hasher = hasher(max_in_flight=2)
+    release, threads = hold_slots(password_hasher, 2)
+    try:
+        assert password_hasher.metrics()["in_flight"] == 2
+        with pytest.raises(HashingBusy):
+            password_hasher.generate("secret")
+        assert password_hasher.counters["busy"] == 1
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    # Slots are given back once the running hashes finish
+    assert password_hasher.metrics()["in_flight"] == 0
+    assert password_hasher.check(password_hasher.generate("secret"), "secret")
+
+
+def test_needs_rehash_compares_the_full_parameters():
+    password_hasher = hasher()
+    assert password_hasher.current_method() == METHOD
+    assert not password_hasher.needs_rehash(generate_password_hash("secret", METHOD))
+    assert password_hasher.needs_rehash(generate_password_hash("secret", OLD_METHOD))
+    assert password_hasher.needs_rehash(generate_password_hash("secret", "scrypt"))
+
+
+def test_outdated_hash_is_upgraded_on_a_correct_password():
+    password_hasher = hasher()
+    saved = []
+    old_hash = generate_password_hash("secret", OLD_METHOD)
+
+    assert not password_hasher.verify_and_upgrade(old_hash, "wrong", saved.append)
+    assert saved == []
+
+    assert password_hasher.verify_and_upgrade(old_hash, "secret", saved.append)
+    assert len(saved) == 1 and not password_hasher.needs_rehash(saved[0])
+    assert password_hasher.check(saved[0], "secret")
+    assert password_hasher.counters["rehashes"] == 1
+
+    # Current hashes are left alone
+    assert password_hasher.verify_and_upgrade(saved[0], "secret", saved.append)
+    assert len(saved) == 1
+
+
+def test_failed_upgrade_does_not_fail_the_login():
+    def broken_save(new_hash):
+        raise RuntimeError("database is down")
+
+    password_hasher = hasher()
+    assert password_hasher.verify_and_upgrade(generate_password_hash("secret", OLD_METHOD), "secret", broken_save)
+    assert password_hasher.counters["rehashes"] == 0
+
+
+@pytest.fixture
+def login(app_module, user_id, monkeypatch):
+    """Sets the test user's password hash and returns an /api/login caller, with the auth limit off."""
+    db = app_module.db
+    monkeypatch.setattr(app_module, "password_hasher", hasher())
+    monkeypatch.setitem(app_module.rate_limiter.limits, "auth", None)
+    with app_module.app.app_context():
+        username = db.session.execute(text("""
+            UPDATE users SET password_hash = :password_hash WHERE id = :user_id RETURNING username
+        """), {"password_hash": generate_password_hash("secret", OLD_METHOD), "user_id": user_id}).scalar()
+        db.session.commit()
+
+    client = app_module.app.test_client()
+    return lambda: client.post("/api/login", json={"username": username, "password": "secret"})
+
+
+def stored_hash(app_module, user_id):
+    with app_module.app.app_context():
+        password_hash = app_module.db.session.execute(
+            text("SELECT password_hash FROM users WHERE id = :user_id"), {"user_id": user_id}
+        ).scalar()
+        app_module.db.session.rollback()
+    return password_hash
+
+
+@requires_postgres
+def test_login_upgrades_an_outdated_hash(app_module, user_id, login):
+    assert login().status_code == 200
+    new_hash = stored_hash(app_module, user_id)
+    assert new_hash.startswith(METHOD + "$")
+    assert login().status_code == 200
+    assert stored_hash(app_module, user_id) == new_hash
+
+
+@requires_postgres
+def test_login_when_hashing_is_busy_is_503_with_retry_after(app_module, login):
+    release, threads = hold_slots(app_module.password_hasher, 1)
+    try:
+        response = login()
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert login().status_code == 200
+
+
+@requires_postgres
+def test_failed_hash_save_leaves_the_session_usable(app_module, user_id):
+    db = app_module.db
+    with app_module.app.test_request_context():
+        save = app_module.save_password_hash(user_id)
+        # password_hash is NOT NULL, so the UPDATE fails
+        with pytest.raises(Exception):
+            save(None)
+        assert db.session.execute(text("SELECT 1")).scalar() == 1
+        db.session.rollback()
@@ -0,0 +1,48 @@
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+import schema
+from conftest import requires_postgres
+
+
+@pytest.fixture
+def scratch_table(app_module, monkeypatch):
+    """A throwaway table with duplicate rows, and INDEXES pointed at one index on it."""
+    table = f"test_schema_{uuid.uuid4().hex[:12]}"
+    index = f"idx_{table}_a"
+    engine = app_module.db.engine
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"CREATE TABLE {table} (a INTEGER)"))
+        conn.execute(text(f"INSERT INTO {table} (a) VALUES (1), (1)"))
+    monkeypatch.setattr(schema, "INDEXES", {index: f"{table} (a)"})
+    yield table, index
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+@requires_postgres
+def test_ensure_indexes_builds_missing_indexes(app_module, scratch_table):
+    table, index = scratch_table
+    db = app_module.db
+    assert schema.index_problems(db) == {index: "missing"}
+
+    assert schema.ensure_indexes(db) == []
+    assert schema.index_problems(db) == {}
+    # Nothing left to do on the next run
+    assert schema.ensure_indexes(db) == []
+
+
+@requires_postgres
+def test_ensure_indexes_rebuilds_an_index_left_invalid(app_module, scratch_table):
+    table, index = scratch_table
+    db = app_module.db
+    # A concurrent build that fails (here on the duplicates) leaves an INVALID index behind
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        with pytest.raises(Exception):
+            conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY {index} ON {table} (a)"))
+    assert schema.index_problems(db) == {index: "invalid"}
+
+    assert schema.ensure_indexes(db) == []
+    assert schema.index_problems(db) == {}
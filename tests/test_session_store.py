@@ -0,0 +1,134 @@
+import os
+import time
+import uuid
+
+import pytest
+from flask import Flask, session
+
+from session_store import MemorySessionBackend, RedisSessionBackend, ServerSideSessionInterface, start_sweeper
+from resp_server import RespServer
+
+
+@pytest.fixture
+def redis_backend():
+    """RedisSessionBackend on TEST_REDIS_URL, or on a local RESP server without one."""
+    pytest.importorskip("redis")
+    url = os.getenv("TEST_REDIS_URL")
+    if url:
+        yield RedisSessionBackend(url, key_prefix=f"cashcompass:test:{uuid.uuid4().hex}:")
+        return
+    with RespServer() as server:
+        yield RedisSessionBackend(server.url)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return MemorySessionBackend()
+    return request.getfixturevalue("redis_backend")
+
+
+def session_app(backend, ttl=3600):
+    """An app with the login/logout pattern of app.py on a server-side session backend."""
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = ServerSideSessionInterface(backend, ttl=ttl)
+
+    @app.route("/theme")
+    def theme():
+        session["theme"] = "dark"
+        return ""
+
+    @app.route("/login")
+    def login():
+        session.clear()
+        session["user_id"] = 1
+        return ""
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return ""
+
+    @app.route("/whoami")
+    def whoami():
+        return str(session.get("user_id"))
+
+    return app
+
+
+def session_id(client):
+    cookie = client.get_cookie("session")
+    return cookie.value if cookie else None
+
+
+def test_session_id_rotates_on_login_and_logout(backend):
+    client = session_app(backend).test_client()
+    client.get("/theme")
+    anonymous_sid = session_id(client)
+    assert backend.get(anonymous_sid) is not None
+
+    client.get("/login")
+    user_sid = session_id(client)
+    assert user_sid != anonymous_sid
+    assert backend.get(anonymous_sid) is None
+    assert client.get("/whoami").text == "1"
+
+    client.get("/logout")
+    assert session_id(client) is None
+    assert backend.get(user_sid) is None
+
+
+def test_logout_revokes_a_copied_session_cookie(backend):
+    app = session_app(backend)
+    client = app.test_client()
+    client.get("/login")
+    stolen_sid = session_id(client)
+    client.get("/logout")
+
+    attacker = app.test_client()
+    attacker.set_cookie("session", stolen_sid)
+    assert attacker.get("/whoami").text == "None"
+
+
+def test_redis_sessions_expire_after_the_ttl(redis_backend):
+    client = session_app(redis_backend, ttl=1).test_client()
+    client.get("/login")
+    sid = session_id(client)
+    assert redis_backend.client.ttl(redis_backend.key_prefix + sid) == 1
+    assert client.get("/whoami").text == "1"
+
+    time.sleep(1.2)
+    assert redis_backend.get(sid) is None
+    assert client.get("/whoami").text == "None"
+
+
+def test_memory_sessions_expire_after_the_ttl():
+    backend = MemorySessionBackend()
+    backend.set("sid", "{}", ttl=0.05)
+    assert backend.get("sid") == "{}"
+    time.sleep(0.1)
+    assert backend.get("sid") is None
+
+
+def test_sweeper_evicts_expired_memory_sessions():
+    backend = MemorySessionBackend()
+    backend.set("expiring", "{}", ttl=0.05)
+    backend.set("alive", "{}", ttl=60)
+    start_sweeper(backend, 0.05)
+
+    deadline = time.monotonic() + 2
+    while len(backend._entries) > 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    # Evicted without anyone reading the expired entry
+    assert list(backend._entries) == ["alive"]
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemorySessionBackend(max_entries=2)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    backend.get("a")
+    backend.set("c", "3", 60)
+    assert backend.get("b") is None
+    assert backend.get("a") == "1" and backend.get("c") == "3"
@@ -0,0 +1,123 @@
+from sqlalchemy import text
+
+from ledger import change_seq, delete_entry, insert_entry
+from sync import changes_since, purge_tombstones
+from conftest import requires_postgres
+
+
+def write_income(db, user_id, count):
+    """Inserts 'count' income rows in one transaction. Returns (their change sequence number, ids)."""
+    ids = [insert_entry(db, "income", user_id, {"source": f"job {n}", "amount": 10, "date": "2024-05-01"})
+           for n in range(count)]
+    seq = change_seq(db, user_id)
+    db.session.commit()
+    return seq, ids
+
+
+def delete_income(db, user_id, item_id):
+    assert delete_entry(db, "income", item_id, user_id)
+    seq = change_seq(db, user_id)
+    db.session.commit()
+    return seq
+
+
+def income_ids(page):
+    return [row["id"] for row in page["changes"]["income"]]
+
+
+@requires_postgres
+def test_pages_are_cut_between_transactions(app_module, user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        first, first_ids = write_income(db, user_id, 2)
+        second, second_ids = write_income(db, user_id, 2)
+        third, third_ids = write_income(db, user_id, 1)
+
+        # Three changes fit, but the second transaction would be split: the page stops before it
+        page = changes_since(db, user_id, since=first - 1, limit=3)
+        assert income_ids(page) == first_ids
+        assert page["has_more"] and page["next_since"] == first and not page["reset"]
+
+        page = changes_since(db, user_id, since=page["next_since"], limit=3)
+        assert income_ids(page) == second_ids + third_ids
+        assert not page["has_more"] and page["next_since"] == third
+
+
+@requires_postgres
+def test_a_transaction_larger_than_the_page_comes_whole(app_module, user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        seq, ids = write_income(db, user_id, 5)
+
+        page = changes_since(db, user_id, since=seq - 1, limit=2)
+        assert income_ids(page) == ids
+        assert page["has_more"] and page["next_since"] == seq
+
+        page = changes_since(db, user_id, since=page["next_since"], limit=2)
+        assert income_ids(page) == [] and not page["has_more"] and page["next_since"] == seq
+
+
+@requires_postgres
+def test_tombstones_only_come_with_incremental_pages(app_module, user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        written, (kept, removed) = write_income(db, user_id, 2)
+        deleted = delete_income(db, user_id, removed)
+
+        page = changes_since(db, user_id, since=written)
+        assert not page["reset"] and page["next_since"] == deleted
+        assert page["deleted"]["income"] == [removed] and income_ids(page) == []
+
+        # A snapshot holds only the rows that exist, so it carries no deletes
+        page = changes_since(db, user_id)
+        assert page["reset"] and income_ids(page) == [kept]
+        assert all(ids == [] for ids in page["deleted"].values())
+
+
+@requires_postgres
+def test_since_ahead_of_the_server_gets_a_reset(app_module, user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        seq, ids = write_income(db, user_id, 1)
+
+        page = changes_since(db, user_id, since=seq + 10)
+        assert page["reset"] and income_ids(page) == ids and page["next_since"] == seq
+
+
+@requires_postgres
+def test_purged_tombstones_force_a_reset(app_module, user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        written, (kept, removed) = write_income(db, user_id, 2)
+        deleted = delete_income(db, user_id, removed)
+        later, later_ids = write_income(db, user_id, 1)
+        db.session.execute(text("""
+            UPDATE sync_tombstones SET deleted_at = NOW() - INTERVAL '100 days' WHERE user_id = :user_id
+        """), {"user_id": user_id})
+        db.session.commit()
+
+        assert purge_tombstones(db, retention_days=90) >= 1
+        assert db.session.execute(text("SELECT purged_seq FROM user_change_seq WHERE user_id = :user_id"),
+                                  {"user_id": user_id}).scalar() == deleted
+        assert db.session.execute(text("SELECT COUNT(*) FROM sync_tombstones WHERE user_id = :user_id"),
+                                  {"user_id": user_id}).scalar() == 0
+
+        # The client never heard about the delete: it has to start over
+        page = changes_since(db, user_id, since=written)
+        assert page["reset"] and income_ids(page) == [kept] + later_ids
+        # A client that synced past the purged delete carries on incrementally
+        page = changes_since(db, user_id, since=deleted)
+        assert not page["reset"] and page["next_since"] == later
+        db.session.rollback()
+
+
+@requires_postgres
+def test_recent_tombstones_are_kept(app_module, user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        written, (kept, removed) = write_income(db, user_id, 2)
+        delete_income(db, user_id, removed)
+
+        purge_tombstones(db, retention_days=90)
+        page = changes_since(db, user_id, since=written)
+        assert not page["reset"] and page["deleted"]["income"] == [removed]